@@ -2,6 +2,7 @@
 from datetime import datetime
 from kqueen.models import Organization, User
 from kqueen.server import create_app
+from kqueen.storages.etcd import Model
 
 import argparse
 
@@ -19,34 +20,30 @@ def main():
     args = parser.parse_args()
     app = create_app()
     with app.app_context():
-        # Organization and user
+        # Organization and user, saved together
+        organization = Organization(
+            id=organization_id,
+            name=args.organization,
+            namespace=args.namespace,
+            created_at=datetime.utcnow()
+        )
+        user = User.create(
+            None,
+            id=user_id,
+            username=args.username,
+            password=args.password,
+            email='admin@kqueen.net',
+            organization=organization,
+            created_at=datetime.utcnow(),
+            role='superadmin',
+            active=True
+        )
         try:
-            organization = Organization(
-                id=organization_id,
-                name=args.organization,
-                namespace=args.namespace,
-                created_at=datetime.utcnow()
-            )
-            organization.save()
-            print('Organization {} successfully created!'.format(organization.name))
+            Model.save_many([organization, user])
         except Exception:
-            raise Exception('Adding {} organization failed'.format(args.organization))
-        try:
-            user = User.create(
-                None,
-                id=user_id,
-                username=args.username,
-                password=args.password,
-                email='admin@kqueen.net',
-                organization=organization,
-                created_at=datetime.utcnow(),
-                role='superadmin',
-                active=True
-            )
-            user.save()
-            print('User {} successfully created!'.format(user.username))
-        except Exception:
-            raise Exception('Adding {} user failed'.format(args.username))
+            raise Exception('Adding {} organization and {} user failed'.format(args.organization, args.username))
+        print('Organization {} successfully created!'.format(organization.name))
+        print('User {} successfully created!'.format(user.username))
 
 
 if __name__ == "__main__":
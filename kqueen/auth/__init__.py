@@ -1,9 +1,10 @@
-from .common import authenticate, identity, encrypt_password, is_authorized
+from .common import authenticate, authorize_many, identity, encrypt_password, is_authorized
 from .ldap import LDAPAuth
 from .local import LocalAuth
 
 __all__ = [
     'authenticate',
+    'authorize_many',
     'identity',
     'encrypt_password',
     'is_authorized',
@@ -1,17 +1,94 @@
 """Authentication methods for API."""
 
+from .hashing import password_pool
+from .hashing import PasswordPoolFull
+from collections import OrderedDict
+from kqueen.config import config_snapshot
 from kqueen.config import current_config
 from kqueen.models import Organization
 from kqueen.models import User
 from uuid import uuid4
 
-import bcrypt
 import importlib
 import logging
+import threading
+import time
 
 config = current_config()
 logger = logging.getLogger('kqueen_api')
 
+
+class IdentityCache:
+    """Per-process cache of users resolved by `identity`, least recently used are dropped.
+
+    Users are invalidated when they or their organization are saved or deleted by this
+    process, changes made by other processes are visible after `ttl`. Cached users are
+    shared by requests and must not be modified, views load the user again to change it.
+
+    Args:
+        max_size (int): Maximal number of cached users. Zero disables the cache.
+        ttl (float): Seconds users are cached.
+    """
+
+    def __init__(self, max_size=0, ttl=0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Return cached user or None if missing or expired."""
+        if not self.max_size:
+            return None
+
+        with self._lock:
+            entry = self._data.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._data[user_id]
+                return None
+
+            self._data.move_to_end(user_id)
+            return entry[1]
+
+    def set(self, user):
+        if not self.max_size:
+            return
+
+        # deserialize all fields (and organization) now, lazy fields are not thread-safe
+        user.get_dict(expand=True)
+
+        with self._lock:
+            self._data[user.id] = (time.monotonic() + self.ttl, user)
+            self._data.move_to_end(user.id)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._data.pop(user_id, None)
+
+    def invalidate_organization(self, organization_id):
+        """Drop all users of the organization."""
+        with self._lock:
+            for user_id, (_, user) in list(self._data.items()):
+                if user.organization is None or user.organization.id == organization_id:
+                    del self._data[user_id]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+identity_cache = IdentityCache(
+    max_size=int(config.get('IDENTITY_CACHE_SIZE', 0)),
+    ttl=float(config.get('IDENTITY_CACHE_TTL', 0)),
+)
+
 """
     Authentication Modules
 
@@ -58,7 +135,7 @@ def generate_auth_options(auth_list):
 def get_auth_instance(name):
     # Default type is local auth
 
-    config = current_config()
+    config = config_snapshot()
     auth_options = generate_auth_options(config.get("AUTH_MODULES"))
     auth_config = auth_options.get(name, {})
 
@@ -92,10 +169,11 @@ def authenticate(username, password):
 
     """
 
-    # find user by username
-    users = list(User.list(None, return_objects=True).values())
-    username_table = {u.username: u for u in users}
-    user = username_table.get(username)
+    # find user by username, only the matching user is read
+    try:
+        user = User.load_by(None, 'username', username)
+    except NameError:
+        user = None
 
     if user:
         user.metadata = user.metadata or {}
@@ -105,6 +183,8 @@ def authenticate(username, password):
 
         try:
             verified_user, verification_error = auth_instance.verify(user, given_password)
+        except PasswordPoolFull:
+            raise
         except Exception as e:
             logger.exception("Verification method {} failed".format(user.auth))
             verified_user, verification_error = None, str(e)
@@ -132,24 +212,138 @@ def identity(payload):
 
     """
     user_id = payload['identity']
+    user = identity_cache.get(user_id)
+    if user is not None:
+        return user
+
     try:
         user = User.load(None, user_id)
     except Exception:
-        user = None
+        return None
+
+    identity_cache.set(user)
     return user
 
 
 def encrypt_password(_password):
     if not _password:
         return None
-    config = current_config()
+    config = config_snapshot()
     rounds = config.get('BCRYPT_ROUNDS', 12)
     password = str(_password).encode('utf-8')
-    encrypted = bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode('utf-8')
+    encrypted = password_pool().hash(password, rounds).decode('utf-8')
     return encrypted
 
 
-def is_authorized(_user, policy_value, resource=None):
+# Predefined policy conditions, compiled to predicates of
+# (USER, ORGANIZATION, ROLE, OWNER, OWNER_ORGANIZATION)
+POLICY_PREDICATES = {
+    'IS_ADMIN': lambda user, organization, role, owner, owner_organization: (
+        organization == owner_organization and role == 'admin'
+    ),
+    'IS_SUPERADMIN': lambda user, organization, role, owner, owner_organization: (
+        role == 'superadmin'
+    ),
+    'IS_OWNER': lambda user, organization, role, owner, owner_organization: (
+        organization == owner_organization and user == owner
+    ),
+    'ADMIN_OR_OWNER': lambda user, organization, role, owner, owner_organization: (
+        organization == owner_organization and (role == 'admin' or user == owner)
+    ),
+    'ALL': lambda user, organization, role, owner, owner_organization: (
+        organization == owner_organization
+    ),
+}
+
+# Owner of resource which has none, equal to no user or organization
+_NO_OWNER = object()
+
+
+def _is_invalid_resource(resource):
+    """Return True if policy can't be evaluated for the resource."""
+    validation, _ = resource.validate()
+    if validation:
+        return False
+
+    # test if we are validating on create view and if so, patch missing object id
+    if not resource.id:
+        resource.id = uuid4()
+        validation, _ = resource.validate()
+        resource.id = None
+        if validation:
+            return False
+
+    logger.error('Cannot evaluate policy for invalid object: {}'.format(str(resource.get_dict())))
+    return True
+
+
+def _resource_owner(resource):
+    """Return ids of owner and owner organization of resource.
+
+    Raises:
+        AttributeError: Owner or organization of resource is missing.
+    """
+    # TODO: check owner has id and, organization ...
+    if hasattr(resource, 'owner'):
+        return resource.owner.id, resource.owner.organization.id
+    elif isinstance(resource, User):
+        return resource.id, resource.organization.id
+    elif isinstance(resource, Organization):
+        return _NO_OWNER, resource.id
+
+    return _NO_OWNER, _NO_OWNER
+
+
+def _authorizer(_user, policy_value, validate=True):
+    """Return function checking user is authorized to a resource by the policy.
+
+    User side of the policy is resolved once, returned function only reads resource owner.
+    Resources are validated only with `validate` set, otherwise just their owner ids are read.
+    """
+    if isinstance(_user, User):
+        user = _user.get_dict()
+    elif isinstance(_user, dict):
+        user = _user
+    else:
+        raise TypeError('Invalid type for argument user {}'.format(type(_user)))
+
+    user_id = user['id']
+    organization = user['organization'].id
+    role = user['role']
+
+    try:
+        predicate = POLICY_PREDICATES[policy_value]
+    except (KeyError, TypeError):
+        logger.error('Policy evaluation failed. Invalid rule: {}'.format(str(policy_value)))
+        return lambda resource: False
+
+    logger.debug('User {} id {} authorized as {}'.format(user['username'], user['id'], user['role']))
+
+    if role == 'superadmin':
+        # no point in checking anything here
+        return lambda resource: True
+
+    def authorize(resource):
+        if not resource:
+            return predicate(user_id, organization, role, _NO_OWNER, _NO_OWNER)
+
+        # if invalid resource is passed, let's just continue dispatch_request
+        # so it can properly fail with 500 response code
+        if validate and _is_invalid_resource(resource):
+            return True
+
+        try:
+            owner, owner_organization = _resource_owner(resource)
+        except AttributeError:
+            logger.error('Cannot evaluate policy for object without owner: {}'.format(resource))
+            return True
+
+        return predicate(user_id, organization, role, owner, owner_organization)
+
+    return authorize
+
+
+def is_authorized(_user, policy_value, resource=None, validate=True):
     """
     Evaluate if given user fulfills requirements of the given
     policy_value.
@@ -164,78 +358,32 @@ def is_authorized(_user, policy_value, resource=None):
 
     Args:
         user (dict or User): User data
-        policy_value (string or list): Condition written using shorthands and magic keywords
+        policy_value (string): Name of condition from `POLICY_PREDICATES`
+        resource (Model): Checked object
+        validate (bool): Validate the resource first, policy is not evaluated for invalid
+            resources. Without it only owner ids of resource are read.
 
     Returns:
         bool: authorized or not
     """
-    if isinstance(_user, User):
-        user = _user.get_dict()
-    elif isinstance(_user, dict):
-        user = _user
-    else:
-        raise TypeError('Invalid type for argument user {}'.format(type(_user)))
+    return _authorizer(_user, policy_value, validate=validate)(resource)
 
-    # magic keywords
-    USER = user['id']                       # noqa: F841
-    ORGANIZATION = user['organization'].id  # noqa: F841
-    ROLE = user['role']
-    if resource:
-        validation, _ = resource.validate()
-        if not validation:
-            invalid = True
-
-            # test if we are validating on create view and if so, patch missing object id
-            if not resource.id:
-                resource.id = uuid4()
-                validation, _ = resource.validate()
-                if validation:
-                    invalid = False
-                resource.id = None
-
-            # if invalid resource is passed, let's just continue dispatch_request
-            # so it can properly fail with 500 response code
-            if invalid:
-                logger.error('Cannot evaluate policy for invalid object: {}'.format(str(resource.get_dict())))
-                return True
-
-        # TODO: check owner has id and, organization ...
-        if hasattr(resource, 'owner'):
-            OWNER = resource.owner.id                            # noqa: F841
-            OWNER_ORGANIZATION = resource.owner.organization.id  # noqa: F841
-        elif isinstance(resource, User):
-            OWNER = resource.id                                  # noqa: F841
-            OWNER_ORGANIZATION = resource.organization.id        # noqa: F841
-        elif isinstance(resource, Organization):
-            OWNER_ORGANIZATION = resource.id                     # noqa: F841
-
-    # predefined conditions for evaluation
-    conditions = {
-        'IS_ADMIN': 'ORGANIZATION == OWNER_ORGANIZATION and ROLE == "admin"',
-        'IS_SUPERADMIN': 'ROLE == "superadmin"',
-        'IS_OWNER': 'ORGANIZATION == OWNER_ORGANIZATION and USER == OWNER',
-        'ADMIN_OR_OWNER': 'ORGANIZATION == OWNER_ORGANIZATION and (ROLE == "admin" or USER == OWNER)',
-        'ALL': 'ORGANIZATION == OWNER_ORGANIZATION'
-    }
 
-    try:
-        condition = conditions[policy_value]
-    except KeyError:
-        logger.exception('Policy evaluation failed. Invalid rule: {}'.format(str(policy_value)))
-        return False
+def authorize_many(_user, policy_value, objects, validate=True):
+    """
+    Filter objects the user is authorized to by the policy_value.
 
-    if ROLE == 'superadmin':
-        # no point in checking anything here
-        logger.debug('User {} id {} authorized as {}'.format(user['username'], user['id'], user['role']))
-        return True
+    Same as calling `is_authorized` for each object, but user and policy
+    are resolved only once.
 
-    try:
-        authorized = eval(condition)
-        if not isinstance(authorized, bool):
-            logger.error('Policy evaluation did not return boolean: {}'.format(str(authorized)))
-            authorized = False
-    except Exception as e:
-        logger.exception('Policy evaluation failed: ')
-        authorized = False
-    logger.debug('User {} id {} authorized as {}'.format(user['username'], user['id'], user['role']))
-    return authorized
+    Args:
+        user (dict or User): User data
+        policy_value (string): Name of condition from `POLICY_PREDICATES`
+        objects (list): Resources
+        validate (bool): Validate each resource first, see `is_authorized`
+
+    Returns:
+        list: Authorized objects in original order
+    """
+    authorize = _authorizer(_user, policy_value, validate=validate)
+    return [obj for obj in objects if authorize(obj)]
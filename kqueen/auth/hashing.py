@@ -0,0 +1,122 @@
+"""Password hashing and verification outside of request threads."""
+
+from kqueen.config import config_snapshot
+from prometheus_client import Gauge
+from prometheus_client import Histogram
+from werkzeug.exceptions import TooManyRequests
+
+import bcrypt
+import logging
+import multiprocessing
+import threading
+import time
+
+logger = logging.getLogger('kqueen_api')
+
+# Prometheus metrics
+PASSWORD_QUEUE_DEPTH = Gauge(
+    'password_queue_depth',
+    'Number of password operations waiting or running',
+    multiprocess_mode='livesum',
+)
+PASSWORD_LATENCY = Histogram(
+    'password_latency',
+    'Password operation latency including waiting for the pool',
+    ['operation'],
+)
+
+# Processes are started by fork server, forking multithreaded application could copy held locks
+START_METHOD = 'forkserver'
+
+# Seconds to wait for result, result of operation is lost when its process is killed
+OPERATION_TIMEOUT = 60
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class PasswordPoolFull(TooManyRequests):
+    """Password operation was rejected, too many of them are waiting (HTTP 429)."""
+    description = 'Too many concurrent password operations, try again later.'
+
+
+class PasswordPool:
+    """Size-limited process pool for bcrypt, so password operations don't pin request threads.
+
+    Operations exceeding `queue_size` (waiting and running together) are rejected at once
+    with `PasswordPoolFull`. Processes are started on first use by `START_METHOD`.
+
+    Args:
+        workers (int): Number of processes. Zero runs operations in calling thread.
+        queue_size (int): Maximal number of waiting and running operations, zero for no limit.
+    """
+
+    def __init__(self, workers=0, queue_size=0):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._slots = threading.BoundedSemaphore(queue_size) if queue_size else None
+        self._processes = None
+        self._lock = threading.Lock()
+
+    def _get_processes(self):
+        with self._lock:
+            if self._processes is None:
+                context = multiprocessing.get_context(START_METHOD)
+                self._processes = context.Pool(processes=self.workers)
+
+            return self._processes
+
+    def run(self, operation, fnc, *args):
+        """Run picklable function in the pool and return its result.
+
+        Raises:
+            PasswordPoolFull: Queue of the pool is full.
+            multiprocessing.TimeoutError: Result was not returned in `OPERATION_TIMEOUT`.
+        """
+        if self._slots is not None and not self._slots.acquire(blocking=False):
+            logger.warning('Password {} rejected, pool queue is full'.format(operation))
+            raise PasswordPoolFull()
+
+        PASSWORD_QUEUE_DEPTH.inc()
+        start = time.monotonic()
+        try:
+            if not self.workers:
+                return fnc(*args)
+
+            # killed processes are replaced by the pool, their operations time out
+            return self._get_processes().apply_async(fnc, args).get(OPERATION_TIMEOUT)
+        finally:
+            PASSWORD_LATENCY.labels(operation).observe(time.monotonic() - start)
+            PASSWORD_QUEUE_DEPTH.dec()
+            if self._slots is not None:
+                self._slots.release()
+
+    def hash(self, password, rounds):
+        """Return bcrypt hash (bytes) of password (bytes)."""
+        return self.run('hash', bcrypt.hashpw, password, bcrypt.gensalt(rounds))
+
+    def check(self, password, hashed):
+        """Check password (bytes) matches bcrypt hash (bytes)."""
+        return self.run('verify', bcrypt.checkpw, password, hashed)
+
+    def shutdown(self):
+        with self._lock:
+            if self._processes is not None:
+                self._processes.close()
+                self._processes.join()
+                self._processes = None
+
+
+def password_pool():
+    """Return process-wide password pool created from configuration."""
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            config = config_snapshot()
+            _pool = PasswordPool(
+                workers=int(config.get('PASSWORD_POOL_WORKERS', 0)),
+                queue_size=int(config.get('PASSWORD_POOL_QUEUE_SIZE', 0)),
+            )
+
+        return _pool
@@ -1,7 +1,7 @@
 from .base import BaseAuth
+from .hashing import password_pool
 from kqueen.models import User
 
-import bcrypt
 import logging
 
 logger = logging.getLogger('kqueen_api')
@@ -32,7 +32,7 @@ class LocalAuth(BaseAuth):
             user_password = user.password.encode('utf-8')
             given_password = password
 
-            if bcrypt.checkpw(given_password, user_password):
+            if password_pool().check(given_password, user_password):
                 return user, None
 
         msg = "Local authentication failed"
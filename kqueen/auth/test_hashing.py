@@ -0,0 +1,72 @@
+from .hashing import PasswordPool
+from .hashing import PasswordPoolFull
+from concurrent.futures import ThreadPoolExecutor
+from kqueen.conftest import UserFixture
+
+import json
+import kqueen.auth.hashing
+import os
+import pytest
+import threading
+
+
+class TestPasswordPool:
+    @pytest.mark.parametrize('workers', [0, 1])
+    def test_hash_and_check(self, workers):
+        pool = PasswordPool(workers=workers)
+        try:
+            hashed = pool.hash(b'password', 4)
+
+            assert pool.check(b'password', hashed)
+            assert not pool.check(b'wrong', hashed)
+        finally:
+            pool.shutdown()
+
+    def test_runs_in_started_process(self):
+        pool = PasswordPool(workers=1)
+        try:
+            assert pool.run('test', os.getpid) != os.getpid()
+            # started by fork server, not forked from this process
+            assert pool.run('test', os.getppid) != os.getpid()
+        finally:
+            pool.shutdown()
+
+    def test_full_queue_rejected(self):
+        pool = PasswordPool(queue_size=1)
+        started = threading.Event()
+        release = threading.Event()
+
+        def blocking():
+            started.set()
+            return release.wait(10)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            running = executor.submit(pool.run, 'test', blocking)
+            assert started.wait(10)
+
+            with pytest.raises(PasswordPoolFull):
+                pool.run('test', blocking)
+
+            release.set()
+            assert running.result()
+
+        # slot is released after the operation
+        assert pool.run('test', lambda: True)
+
+    def test_login_rejected_with_429(self, client, monkeypatch):
+        user = UserFixture()
+        pool = PasswordPool(queue_size=1)
+        monkeypatch.setattr(kqueen.auth.hashing, '_pool', pool)
+        monkeypatch.setattr(pool, '_slots', threading.BoundedSemaphore(1))
+        pool._slots.acquire()
+
+        try:
+            response = client.post(
+                '/api/v1/auth',
+                data=json.dumps({'username': user.obj.username, 'password': user.obj.username + 'password'}),
+                content_type='application/json',
+            )
+
+            assert response.status_code == 429
+        finally:
+            user.destroy()
@@ -4,8 +4,11 @@ from flask import jsonify
 from flask import request
 from flask.views import View
 from flask_jwt import _jwt_required, current_identity, JWTError
+from kqueen.auth import authorize_many
 from kqueen.auth import is_authorized
 from kqueen.models import Organization
+from kqueen.storages.exceptions import FieldError
+from werkzeug.exceptions import HTTPException
 from .helpers import get_object
 
 import logging
@@ -16,6 +19,9 @@ logger = logging.getLogger('kqueen_api')
 class GenericView(View):
     obj = None
 
+    # validate objects before authorization, only needed for objects built from request
+    validate_authorized = False
+
     def get_class(self):
         if hasattr(self, 'object_class'):
             return self.object_class
@@ -47,14 +53,10 @@ class GenericView(View):
             return False
 
         if isinstance(self.obj, list):
-            allowed = []
-            for obj in self.obj:
-                if is_authorized(user, policy_value, resource=obj):
-                    allowed.append(obj)
-            self.obj = allowed
+            self.obj = authorize_many(user, policy_value, self.obj, validate=self.validate_authorized)
         # if there is single object raise if user doesn't have access to it
         else:
-            if not is_authorized(user, policy_value, resource=self.obj):
+            if not is_authorized(user, policy_value, resource=self.obj, validate=self.validate_authorized):
                 raise JWTError('Insufficient permissions',
                                'Your user account is lacking the necessary '
                                'permissions to perform this operation')
@@ -149,6 +151,7 @@ class DeleteView(GenericView):
 class UpdateView(GenericView):
     methods = ['PATCH']
     action = 'update'
+    validate_authorized = True
 
     def get_content(self, *args, **kwargs):
         self.obj = self.hide_secure_data(self.obj)
@@ -187,6 +190,13 @@ class ListView(GenericView):
     sort_field = ''
     sort_order = 'desc'
     supported_sort_fields = {}  # override in child class
+    fields = None
+
+    # Model fields used by sorting and filtering under different names
+    field_aliases = {
+        'created': 'created_at',
+        'status': 'state',
+    }
 
     _objects_total = 0
 
@@ -206,6 +216,53 @@ class ListView(GenericView):
     def sort_objects(self, objects, key, order):
         return objects  # implement in child class
 
+    def get_load_fields(self, filters):
+        """Return fields loaded from storage, `None` loads whole objects.
+
+        Besides fields requested by `fields` argument, objects need owner relations
+        read by authorization and fields used for sorting and filtering. Listed objects
+        are not validated, so other required fields are not loaded.
+        """
+        if self.fields is None:
+            return None
+
+        obj_class = self.get_class()
+        load_fields = set(self.fields)
+        for field_name in ('owner', 'organization'):
+            if field_name in obj_class.get_fields():
+                load_fields.add(field_name)
+
+        for name in list(filters.keys()) + [self.sort_field]:
+            name = self.field_aliases.get(name, name)
+            if name in obj_class.get_fields():
+                load_fields.add(name)
+
+        return sorted(load_fields)
+
+    def get_sort_index(self, filters):
+        """Return name of storage sort index serving requested page.
+
+        Returns:
+            str: Sort index name or `None` when whole list has to be loaded.
+        """
+        if self.limit <= 0 or not self.sort_field or filters or request.args.get('all_namespaces'):
+            return None
+
+        sort_name = self.field_aliases.get(self.sort_field, self.sort_field)
+        if sort_name in self.get_class().sort_indexes:
+            return sort_name
+
+    def set_fields(self):
+        fields = request.args.get('fields')
+        if not fields:
+            return
+
+        self.fields = [f.strip() for f in fields.split(',') if f.strip()]
+        try:
+            self.get_class().get_projection(self.fields)
+        except FieldError as e:
+            abort(400, description=str(e))
+
     def set_object(self, *args, **kwargs):
         supported_filters = ['name', 'provisioner', 'engine']
         filters = {}
@@ -228,8 +285,11 @@ class ListView(GenericView):
             self.limit = int(request.args.get('limit', 20))
         obj_class = self.get_class()
 
+        self.set_fields()
+        load_fields = self.get_load_fields(filters)
+
         def get_objects_list(namespace):
-            return list(obj_class.list(namespace, return_objects=True).values())
+            return list(obj_class.list(namespace, return_objects=True, fields=load_fields).values())
 
         if request.args.get('all_namespaces'):
             objects = []
@@ -244,6 +304,19 @@ class ListView(GenericView):
         except AttributeError:
             namespace = None
 
+        sort_name = self.get_sort_index(filters)
+        if sort_name:
+            self.obj, self._objects_total = obj_class.list_page(
+                namespace,
+                sort_name,
+                offset=self.offset,
+                limit=self.limit,
+                reverse=self.sort_order == 'asc',
+                fields=load_fields,
+            )
+            self.check_authorization()
+            return
+
         self._save_objects_range(self.filter_objects(get_objects_list(namespace), filters))
         self.check_authorization()
 
@@ -252,19 +325,23 @@ class ListView(GenericView):
             objs = []
             for obj in self.obj:
                 namespace = obj._object_namespace
-                obj_dict = obj.get_dict(expand=True)
+                obj_dict = obj.get_dict(expand=True, fields=self.fields)
                 obj_dict['_namespace'] = namespace
                 obj_dict = self.hide_secure_data(obj_dict)
                 objs.append(obj_dict)
             return objs
         for i, obj in enumerate(self.obj):
             self.obj[i] = self.hide_secure_data(obj)
+            if self.fields is not None:
+                self.obj[i] = self.obj[i].get_dict(expand=True, fields=self.fields)
         return self.obj
 
     def dispatch_request(self, *args, **kwargs):
         self.check_authentication()
         try:
             self.set_object(*args, **kwargs)
+        except HTTPException:
+            raise
         except Exception as e:
             logger.exception(e)
             abort(500, description='Unable to get objects list. {}'.format(repr(e)))
@@ -277,6 +354,7 @@ class ListView(GenericView):
 class CreateView(GenericView):
     methods = ['POST']
     action = 'create'
+    validate_authorized = True
 
     def save_object(self):
         self.obj.save()
@@ -85,6 +85,40 @@ class TestClusterCRUD(BaseTestCRUD):
         )
         assert obj.get_dict(expand=True) in data
 
+    def test_list_fields_expand_selected_relations(self):
+        response = self.client.get(
+            self.urls['list'],
+            query_string={'fields': 'name,state,provisioner.name'},
+            headers=self.auth_header,
+        )
+
+        assert response.status_code == 200
+        item = [i for i in response.json if i['id'] == str(self.obj.id)][0]
+
+        # state might have been updated during LIST
+        assert set(item.keys()) == {'id', 'name', 'state', 'provisioner'}
+        assert item['name'] == self.obj.name
+        assert item['provisioner'] == {
+            'id': str(self.obj.provisioner.id),
+            'name': self.obj.provisioner.name,
+        }
+
+    def test_list_page_uses_sort_index(self, monkeypatch):
+        def fail(*args, **kwargs):
+            raise AssertionError('Whole list should not be loaded')
+
+        self.obj.__class__.build_indexes(self.namespace)
+        monkeypatch.setattr(self.obj.__class__, 'list', fail)
+        response = self.client.get(
+            self.urls['list'],
+            query_string={'sortby': 'name', 'offset': 0, 'limit': 1},
+            headers=self.auth_header,
+        )
+
+        assert response.status_code == 200
+        assert response.json['total'] == 1
+        assert [i['id'] for i in response.json['items']] == [str(self.obj.id)]
+
     @pytest.mark.parametrize('cluster_id, status_code', [
         (uuid4(), 404),
         ('wrong-uuid', 404),
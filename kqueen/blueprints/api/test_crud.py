@@ -1,4 +1,5 @@
 from flask import url_for
+from kqueen.auth import common
 from kqueen.conftest import AuthHeader
 from kqueen.conftest import UserWithNamespaceFixture
 from kqueen.conftest import UserFixture
@@ -148,6 +149,39 @@ class BaseTestCRUD:
         )
         assert obj.get_dict(expand=True) in data
 
+    def test_crud_list_fields(self):
+        response = self.client.get(
+            self.urls['list'],
+            query_string={'fields': 'id,created_at'},
+            headers=self.auth_header
+        )
+
+        assert response.status_code == 200
+        for item in response.json:
+            assert set(item.keys()) <= {'id', 'created_at'}
+        assert str(self.obj.id) in [item['id'] for item in response.json]
+
+    def test_crud_list_not_validated(self, monkeypatch):
+        validated = []
+        monkeypatch.setattr(common, '_is_invalid_resource', lambda obj: validated.append(obj))
+
+        response = self.client.get(
+            self.urls['list'],
+            headers=self.auth_header
+        )
+
+        assert response.status_code == 200
+        assert validated == []
+
+    def test_crud_list_unknown_fields(self):
+        response = self.client.get(
+            self.urls['list'],
+            query_string={'fields': 'id,unknown'},
+            headers=self.auth_header
+        )
+
+        assert response.status_code == 400
+
     def test_crud_update(self):
         data = self.get_edit_data()
 
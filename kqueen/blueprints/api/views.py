@@ -57,6 +57,11 @@ def not_found(error):
     return error_response(404, error)
 
 
+@api.errorhandler(429)
+def too_many_requests(error):
+    return error_response(429, error)
+
+
 @api.errorhandler(500)
 def not_implemented(error):
     return error_response(500, error)
@@ -99,6 +104,12 @@ class ListClusters(ListView):
     def sort_objects(self, objects, key, order):
         return sorted(objects, key=self.supported_sort_fields[key], reverse=order == 'asc')
 
+    def get_load_fields(self, filters):
+        # state update needs whole clusters
+        if config.get('CLUSTER_STATE_ON_LIST'):
+            return None
+        return super().get_load_fields(filters)
+
     async def _update_clusters(self, clusters, loop):
         futures = [
             loop.run_in_executor(
@@ -137,6 +148,7 @@ class ListClusters(ListView):
 
 class GetClustersHealth(ListView):
     object_class = Cluster
+    fields = ['state']
 
     def get_content(self, *args, **kwargs):
         clusters = self.obj
@@ -330,6 +342,12 @@ class ListProvisioners(ListView):
     def sort_objects(self, objects, key, order):
         return sorted(objects, key=self.supported_sort_fields[key], reverse=order == 'asc')
 
+    def get_load_fields(self, filters):
+        # engine status check needs whole provisioners
+        if config.get('PROVISIONER_STATE_ON_LIST'):
+            return None
+        return super().get_load_fields(filters)
+
     async def _update_provisioners(self, provisioners, loop):
         futures = [
             loop.run_in_executor(
@@ -368,6 +386,7 @@ class ListProvisioners(ListView):
 
 class GetProvisionersHealth(ListView):
     object_class = Provisioner
+    fields = ['state']
 
     def get_content(self, *args, **kwargs):
         provisioners = self.obj
@@ -63,27 +63,22 @@ class MetricUpdater:
 
     def get_data(self):
         # users
-        cls = User
-        namespace = None
-
         sum = defaultdict(lambda: defaultdict(lambda: 0))
 
-        for obj_id, obj in cls.list(namespace, True).items():
-            user_dict = obj.get_dict(True)
-
-            user_namespace = user_dict['organization']['namespace']
-            user_role = user_dict['role']
-            user_active = user_dict['active']
+        # relations are not needed for these counts
+        for obj in User.list(None, fields=['role', 'active']).values():
+            sum['roles'][obj.role] += 1
+            sum['active'][obj.active] += 1
 
-            sum['namespace'][user_namespace] += 1
-            sum['roles'][user_role] += 1
-            sum['active'][user_active] += 1
+        # organizations
+        organizations = Organization.list(None, fields=['namespace']).values()
+        for organization in organizations:
+            count = len(User.list_group(None, 'organization', organization, return_objects=False))
+            if count:
+                sum['namespace'][organization.namespace] += count
 
         self.data['users'] = sum
-
-        # organizations
-        objs = Organization.list(None, False)
-        self.data['organizations'] = len(objs)
+        self.data['organizations'] = len(organizations)
 
     def update_metric_users_by_namespace(self, metric):
         for namespace, count in self.data['users']['namespace'].items():
@@ -1,3 +1,5 @@
+from .utils import config_snapshot
 from .utils import current_config
+from .utils import reload_config
 
-__all__ = ['current_config']
+__all__ = ['config_snapshot', 'current_config', 'reload_config']
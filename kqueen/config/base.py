@@ -27,6 +27,35 @@ class BaseConfig:
     # ETCD_HOST
     # ETCD_PORT
 
+    # Storage backend, `etcd` (etcd v2 API), `etcd3` (etcd v3 API) or `memory`
+    STORAGE_BACKEND = 'etcd'
+    # URL prefix of etcd v3 gateway, use `/v3beta` for etcd 3.3
+    ETCD_API_PREFIX = '/v3'
+
+    # Number of deserialized objects cached per process (0 disables cache)
+    STORAGE_CACHE_SIZE = 10000
+    # Seconds missing objects are remembered per process (0 disables cache)
+    STORAGE_MISSING_TTL = 1
+
+    # Compress field values longer than this number of characters (0 disables compression)
+    STORAGE_COMPRESSION_THRESHOLD = 0
+
+    # Related objects of listed objects are loaded by listing their model when at least this
+    # number of them is missing, fewer are loaded one by one (0 always loads one by one)
+    STORAGE_PREFETCH_THRESHOLD = 20
+
+    # Encryption of field values, key is derived from SECRET_KEY and stored with values as its id.
+    # Keys replaced by rotation are kept for reading by id in ENCRYPTION_OLD_KEYS (JSON
+    # in environment), `cbc` cipher writes format readable by older versions.
+    ENCRYPTION_KEY_ID = 'default'
+    ENCRYPTION_OLD_KEYS = {}
+    ENCRYPTION_CIPHER = 'gcm'
+
+    # Serve reads from in-memory replica of etcd kept current by watch
+    ETCD_REPLICA = False
+    # Maximal age of replica (in seconds), older replica falls back to etcd reads
+    ETCD_REPLICA_MAX_STALENESS = 5
+
     # JWT auth options
     JWT_DEFAULT_REALM = 'Login Required'
     JWT_AUTH_URL_RULE = '/api/v1/auth'
@@ -34,6 +63,15 @@ class BaseConfig:
     JWT_AUTH_HEADER_PREFIX = 'Bearer'
 
     BCRYPT_ROUNDS = 12
+    # Processes hashing and verifying passwords (0 hashes in request threads) and maximal
+    # number of waiting password operations, further requests are rejected with 429
+    PASSWORD_POOL_WORKERS = 2
+    PASSWORD_POOL_QUEUE_SIZE = 32
+
+    # Users resolved from JWT tokens are cached per process (0 disables cache), changes
+    # made by other processes are applied after IDENTITY_CACHE_TTL seconds
+    IDENTITY_CACHE_SIZE = 1000
+    IDENTITY_CACHE_TTL = 10
 
     # Cluster statuses
     CLUSTER_ERROR_STATE = 'Error'
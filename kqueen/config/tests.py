@@ -1,9 +1,12 @@
+from .utils import config_snapshot
 from .utils import current_config
+from .utils import reload_config
 from .utils import select_file
 from kqueen.server import create_app
 from .base import BaseConfig
 
 import pytest
+import uuid
 
 config_envvar = 'KQUEEN_CONFIG_FILE'
 config_file_default = 'config/test.py'
@@ -45,6 +48,7 @@ class TestCurrentConfig:
         assert config.source_file == select_file(config_file)
 
 
+@pytest.mark.usefixtures('restore_config')
 class TestConfigFromEnv:
     @pytest.mark.parametrize('name,value', [
         ('KQUEEN_DUMMY', '123'),
@@ -81,3 +85,38 @@ class TestBaseFunction:
 
     def test_get_default(self):
         assert self.cl.get('NONEXISTING', 123) == 123
+
+
+@pytest.mark.usefixtures('restore_config')
+class TestConfigSnapshot:
+
+    def test_memoized(self):
+        assert config_snapshot() is config_snapshot()
+
+    def test_read_only(self):
+        config = config_snapshot()
+
+        with pytest.raises(AttributeError):
+            config.DEBUG = True
+        with pytest.raises(TypeError):
+            config['DEBUG'] = True
+
+    def test_values(self):
+        config = config_snapshot()
+
+        assert config.source_file == select_file()
+        assert config.get('SECRET_KEY') == current_config().SECRET_KEY
+        assert config['DEFAULT_POLICIES']
+        assert config.get('NONEXISTING', 123) == 123
+
+    def test_reload(self, monkeypatch):
+        config = config_snapshot()
+        value = str(uuid.uuid4())
+        monkeypatch.setenv('KQUEEN_DUMMY', value)
+
+        assert config_snapshot().get('DUMMY') != value
+
+        reloaded = reload_config()
+        assert reloaded is not config
+        assert config_snapshot() is reloaded
+        assert reloaded.get('DUMMY') == value
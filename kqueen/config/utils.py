@@ -1,12 +1,17 @@
+from collections.abc import Mapping
 from distutils import util
 import importlib
 import logging
 import os
 import re
+import threading
 
 logger = logging.getLogger('kqueen_api')
 CONFIG_FILE_DEFAULT = 'config/dev.py'
 
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
 
 def select_file(config_file=None):
     """
@@ -60,3 +65,86 @@ def current_config(config_file=None):
     setattr(config, 'source_file', read_file)
 
     return config
+
+
+class ConfigSnapshot(Mapping):
+    """Read-only copy of configuration values, see `config_snapshot`.
+
+    Values are available as items, attributes and by `get` like on configuration classes.
+    Snapshot itself can't be changed, mutable values (e.g. dicts) are shared with the
+    configuration class and must not be modified.
+
+    Args:
+        values (dict): Configuration values.
+        source_file (str): Configuration file the values were read from.
+    """
+    __slots__ = ('_values', 'source_file')
+
+    def __init__(self, values, source_file=None):
+        object.__setattr__(self, '_values', dict(values))
+        object.__setattr__(self, 'source_file', source_file)
+
+    def __getitem__(self, name):
+        return self._values[name]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __getattr__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Configuration snapshot is read-only')
+
+    def to_dict(self):
+        """Return dict of all configuration values."""
+        return dict(self._values)
+
+
+def config_snapshot():
+    """Return configuration of the process.
+
+    Configuration file and environment variables are read by `current_config` only on the
+    first call, following calls return the same snapshot until `reload_config` is called.
+    Use it on hot paths instead of `current_config`.
+
+    Returns:
+        ConfigSnapshot: Configuration values.
+    """
+    snapshot = _snapshot
+    if snapshot is not None:
+        return snapshot
+
+    with _snapshot_lock:
+        if _snapshot is None:
+            return _load_snapshot()
+
+        return _snapshot
+
+
+def reload_config():
+    """Read configuration again and replace snapshot returned by `config_snapshot`.
+
+    Returns:
+        ConfigSnapshot: New configuration values.
+    """
+    with _snapshot_lock:
+        return _load_snapshot()
+
+
+def _load_snapshot():
+    """Create new snapshot, must be called with snapshot lock held."""
+    global _snapshot
+
+    config = current_config()
+    config.setup_policies()
+    _snapshot = ConfigSnapshot(config.to_dict(), source_file=config.source_file)
+    logger.debug('Configuration snapshot loaded from {}'.format(config.source_file))
+
+    return _snapshot
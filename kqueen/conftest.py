@@ -1,15 +1,17 @@
 """Configuration and fixtures for pytest."""
 from kqueen.config import current_config
+from kqueen.config import reload_config
 from kqueen.models import Cluster
 from kqueen.models import Organization
 from kqueen.models import Provisioner
 from kqueen.models import User
 from kqueen.server import create_app
+from kqueen.storages.exceptions import KeyNotFound
 
 import datetime
-import etcd
 import faker
 import json
+import kqueen.server
 import pytest
 import random
 import string
@@ -191,11 +193,36 @@ def app():
 def etcd_setup():
     global current_app
     try:
-        current_app.db.client.delete(current_app.config['ETCD_PREFIX'], recursive=True)
-    except etcd.EtcdKeyNotFound:
+        current_app.db.delete(current_app.config['ETCD_PREFIX'], recursive=True)
+    except KeyNotFound:
         pass
 
 
+@pytest.fixture
+def restore_config(monkeypatch):
+    """Undo changes of configuration class made by environment variables.
+
+    Configuration snapshot and storage application are created again, so they
+    don't keep values of the test. Environment variables must be set after the
+    fixture is set up.
+    """
+    config = current_config()
+    saved = {name: value for name, value in vars(config).items() if not name.startswith('__')}
+
+    yield
+
+    # environment variables must be gone before configuration is read again
+    monkeypatch.undo()
+    for name in [name for name in vars(config) if not name.startswith('__')]:
+        if name not in saved:
+            delattr(config, name)
+    for name, value in saved.items():
+        setattr(config, name, value)
+
+    reload_config()
+    kqueen.server._storage_app = None
+
+
 @pytest.fixture
 def cluster():
     """Create cluster with manual provisioner."""
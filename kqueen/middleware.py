@@ -1,4 +1,5 @@
 from flask import request
+from kqueen.storages.etcd import IdentityMap
 from prometheus_client import Counter
 from prometheus_client import Histogram
 
@@ -31,6 +32,16 @@ def record_request_data(response):
     return response
 
 
+def open_identity_map():
+    request.identity_map = IdentityMap().open()
+
+
+def close_identity_map(exception=None):
+    identity_map = getattr(request, 'identity_map', None)
+    if identity_map is not None:
+        identity_map.close()
+
+
 def check_prometheus():
     is_gunicorn = "gunicorn" in os.environ.get("SERVER_SOFTWARE", "")
 
@@ -47,3 +58,10 @@ def setup_metrics(app):
 
     app.before_request(start_timer)
     app.after_request(record_request_data)
+
+
+def setup_identity_map(app):
+    """Share related objects loaded during one request."""
+
+    app.before_request(open_identity_map)
+    app.teardown_request(close_identity_map)
@@ -32,11 +32,17 @@ class Cluster(Model, metaclass=ModelMeta):
     name = StringField(required=True)
     provisioner = RelationField(remote_class_name='Provisioner')
     state = StringField()
-    kubeconfig = JSONField(encrypted=True)
-    metadata = JSONField()
+    kubeconfig = JSONField(encrypted=True, cold=True)
+    metadata = JSONField(cold=True)
     created_at = DatetimeField(default=datetime.utcnow)
     owner = RelationField(required=True, remote_class_name='User')
 
+    sort_indexes = {
+        'name': ('name', 'created_at'),
+        'created_at': ('created_at', 'name'),
+        'state': ('state', 'name'),
+    }
+
     def update_state(self):
         # Check for stale clusters
         max_age = timedelta(seconds=config.get('PROVISIONER_TIMEOUT'))
@@ -98,18 +104,11 @@ class Cluster(Model, metaclass=ModelMeta):
         return kubeconfig
 
     def save(self, **kwargs):
-        # While used in async method, app context is not available by default
-        # and needs to be imported
-        from flask import current_app as app
-        from kqueen.server import create_app
-
-        try:
-            if not app.testing:
-                app = create_app()
-        except RuntimeError:
-            app = create_app()
+        # While used in async method, app context is not available by default,
+        # shared storage context is used instead
+        from kqueen.server import storage_context
 
-        with app.app_context():
+        with storage_context():
             return super().save(**kwargs)
 
     def status(self):
@@ -318,6 +317,12 @@ class Provisioner(Model, metaclass=ModelMeta):
     created_at = DatetimeField(default=datetime.utcnow)
     owner = RelationField(required=True, remote_class_name='User')
 
+    sort_indexes = {
+        'name': ('name', 'created_at'),
+        'created_at': ('created_at',),
+        'state': ('state', 'name'),
+    }
+
     @classmethod
     def list_engines(self):
         """Read engines and filter them according to whitelist."""
@@ -353,17 +358,11 @@ class Provisioner(Model, metaclass=ModelMeta):
         return state
 
     def save(self, check_status=True, **kwargs):
-        # While used in async method, app context is not available by default
-        # and needs to be imported
-        from flask import current_app as app
-        from kqueen.server import create_app
-        try:
-            if not app.testing:
-                app = create_app()
-        except RuntimeError:
-            app = create_app()
+        # While used in async method, app context is not available by default,
+        # shared storage context is used instead
+        from kqueen.server import storage_context
 
-        with app.app_context():
+        with storage_context():
             if check_status:
                 self.state = self.engine_status(save=False)
             self.verbose_name = getattr(self.get_engine_cls(), 'verbose_name', self.engine)
@@ -386,15 +385,13 @@ class Organization(Model, metaclass=ModelMeta):
 
     def is_deletable(self):
         remaining = []
-        if User.list(self.namespace, return_objects=False):
-            all_users = User.list(None).values()
-            users = [u for u in all_users if u.namespace == self.namespace]
-            for user in users:
-                remaining.append({
-                    'object': 'User',
-                    'name': user.username,
-                    'uuid': user.id
-                })
+        users = User.list_group(None, 'organization', self, fields=['username']).values()
+        for user in users:
+            remaining.append({
+                'object': 'User',
+                'name': user.username,
+                'uuid': user.id
+            })
         if Provisioner.list(self.namespace, return_objects=False):
             provisioners = Provisioner.list(self.namespace).values()
             for provisioner in provisioners:
@@ -415,6 +412,12 @@ class Organization(Model, metaclass=ModelMeta):
             return False, remaining
         return True, remaining
 
+    def after_change(self):
+        # Users cached by JWT identity resolution refer to the organization
+        from kqueen.auth.common import identity_cache
+
+        identity_cache.invalidate_organization(self.id)
+
     def delete(self):
         deletable, remaining = self.is_deletable()
         if deletable:
@@ -431,6 +434,9 @@ class Organization(Model, metaclass=ModelMeta):
 class User(Model, metaclass=ModelMeta):
     global_namespace = True
 
+    # Users of one organization are listed without reading the others
+    group_indexes = {'organization': 'organization'}
+
     id = IdField(required=True)
     username = StringField(required=True, unique=True)
     email = StringField(required=False, unique=True)
@@ -442,6 +448,12 @@ class User(Model, metaclass=ModelMeta):
     metadata = JSONField(required=False)
     auth = StringField()
 
+    def after_change(self):
+        # User can be cached by JWT identity resolution
+        from kqueen.auth.common import identity_cache
+
+        identity_cache.invalidate(self.id)
+
     @property
     def namespace(self):
         """Get namespace from organization.
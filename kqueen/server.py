@@ -2,19 +2,27 @@ from .auth import authenticate
 from .auth import identity
 from .blueprints.api.views import api
 from .blueprints.metrics.views import metrics
+from .config import config_snapshot
 from .config import current_config
 from .exceptions import ImproperlyConfigured
+from .middleware import setup_identity_map
 from .middleware import setup_metrics
 from .serializers import KqueenJSONEncoder
 from .storages.etcd import EtcdBackend
+from .storages.etcd3 import Etcd3Backend
+from .storages.memory import MemoryBackend
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from flask import current_app
 from flask import Flask
+from flask import has_app_context
 from flask_jwt import JWT
 from flask_swagger_ui import get_swaggerui_blueprint
 from kqueen.utils.loggers import setup_logging
 from werkzeug.contrib.cache import SimpleCache
 
 import logging
+import threading
 
 # Logging configuration
 config = current_config(config_file=None)
@@ -22,6 +30,12 @@ setup_logging(config.get('LOG_CONFIG'), config.get('DEBUG'))
 logger = logging.getLogger('kqueen_api')
 
 cache = SimpleCache()
+
+STORAGE_BACKENDS = {
+    'etcd': EtcdBackend,
+    'etcd3': Etcd3Backend,
+    'memory': MemoryBackend,
+}
 swagger_url = '/api/docs'
 api_url = '/api/v1/swagger'
 
@@ -34,6 +48,21 @@ swaggerui_blueprint = get_swaggerui_blueprint(
 )
 
 
+def setup_storage(app, config):
+    """Load configuration and storage backend to the application."""
+    secret_key = config.get('SECRET_KEY')
+    if not secret_key or len(secret_key) < 16:
+        raise ImproperlyConfigured('The SECRET_KEY must be set and longer than 16 chars.')
+
+    app.config.from_mapping(config.to_dict())
+
+    backend_class = STORAGE_BACKENDS.get(app.config.get('STORAGE_BACKEND', 'etcd'))
+    if not backend_class:
+        raise ImproperlyConfigured('Unknown STORAGE_BACKEND {}, use one of: {}'.format(
+            app.config.get('STORAGE_BACKEND'), ', '.join(sorted(STORAGE_BACKENDS))))
+    app.db = backend_class()
+
+
 def create_app(config_file=None):
     app = Flask(__name__, static_folder='./asset/static')
     app.json_encoder = KqueenJSONEncoder
@@ -46,15 +75,9 @@ def create_app(config_file=None):
     config = current_config(config_file)
     config.setup_policies()
 
-    secret_key = config.get('SECRET_KEY')
-    if not secret_key or len(secret_key) < 16:
-        raise ImproperlyConfigured('The SECRET_KEY must be set and longer than 16 chars.')
-
-    app.config.from_mapping(config.to_dict())
-    app.executor = ThreadPoolExecutor(max_workers=app.config.get('POOL_MAX_WORKERS'))
-
     # setup database
-    app.db = EtcdBackend()
+    setup_storage(app, config)
+    app.executor = ThreadPoolExecutor(max_workers=app.config.get('POOL_MAX_WORKERS'))
 
     # setup JWT
     JWT(app, authenticate, identity)
@@ -62,9 +85,52 @@ def create_app(config_file=None):
     # setup metrics
     setup_metrics(app)
 
+    # share related objects within request
+    setup_identity_map(app)
+
     return app
 
 
+_storage_app = None
+_storage_app_lock = threading.Lock()
+
+
+def storage_app():
+    """Return process-wide application with configuration and storage only.
+
+    The application is created on first use and shared by all threads, it has no
+    blueprints, executor, JWT or metrics.
+    """
+    global _storage_app
+
+    with _storage_app_lock:
+        if _storage_app is None:
+            minimal_app = Flask(__name__)
+            setup_storage(minimal_app, config_snapshot())
+            _storage_app = minimal_app
+
+    return _storage_app
+
+
+@contextmanager
+def storage_context():
+    """Provide application context for storage access from any thread.
+
+    Current application context is used when there is one, otherwise context of
+    `storage_app` is pushed.
+
+    Example:
+        >>> with storage_context():
+        ...     cluster.save()
+    """
+    if has_app_context():
+        yield current_app._get_current_object()
+        return
+
+    with storage_app().app_context() as context:
+        yield context.app
+
+
 app = create_app()
 
 
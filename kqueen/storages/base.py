@@ -0,0 +1,305 @@
+from .crypto import KeyRing
+from .exceptions import KeyNotFound
+from collections import namedtuple
+from collections import OrderedDict
+from kqueen.config import current_config
+
+import threading
+import time
+
+StorageNode = namedtuple('StorageNode', ['key', 'value', 'modified_index'])
+StorageEvent = namedtuple('StorageEvent', ['action', 'node'])
+
+
+class DeserializationCache:
+    """Per-process cache of parsed stored values.
+
+    Entries are keyed by storage key and validated by `modified_index`, so any write to the key
+    makes the cached entry stale. Only `SerializedObject` instances (immutable strings) are
+    stored, every hit still builds fresh field objects and callers never share mutable state.
+
+    Args:
+        max_size (int): Maximal number of cached keys. Zero disables the cache.
+    """
+
+    def __init__(self, max_size=0):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, modified_index):
+        """Return cached values for key or None if missing or stale."""
+        if not self.max_size or modified_index is None:
+            return None
+
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] != modified_index:
+                del self._data[key]
+                return None
+
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, modified_index, values):
+        if not self.max_size or modified_index is None:
+            return
+
+        with self._lock:
+            self._data[key] = (modified_index, values)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class MissingKeyCache:
+    """Per-process cache of keys recently found missing.
+
+    Repeated reads of missing keys are answered without storage access for `ttl` seconds.
+    Keys written by this process are invalidated immediately, keys created by other
+    processes are visible after `ttl` at latest.
+
+    Args:
+        ttl (float): Seconds missing keys are remembered. Zero disables the cache.
+        max_size (int): Maximal number of cached keys.
+    """
+
+    def __init__(self, ttl=0, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        if not self.ttl:
+            return False
+
+        with self._lock:
+            expires = self._data.get(key)
+            if expires is None:
+                return False
+            if expires <= time.monotonic():
+                del self._data[key]
+                return False
+
+            return True
+
+    def add(self, key):
+        if not self.ttl:
+            return
+
+        with self._lock:
+            self._data[key] = time.monotonic() + self.ttl
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Caches of missing keys by storage prefix, shared by all backends of the process
+_missing_caches = {}
+_missing_caches_lock = threading.Lock()
+
+
+def shared_missing_cache(prefix, ttl):
+    """Return process-wide cache of missing keys for backends using `prefix`.
+
+    Backends of the request application and of `kqueen.server.storage_app` share it,
+    so a key written through any of them is not reported missing by the others.
+    """
+    with _missing_caches_lock:
+        cache = _missing_caches.get(prefix)
+        if cache is None:
+            cache = _missing_caches[prefix] = MissingKeyCache(ttl)
+
+        return cache
+
+
+class StorageBackend:
+    """Interface of storage drivers used by models.
+
+    Storage is a flat map of string keys to string values, directories are emulated by
+    keys ending with `/`. Every write assigns the key `modified_index` which grows with
+    each change of the storage and is used for compare-and-swap and watches.
+
+    Errors are reported by exceptions from `kqueen.storages.exceptions`: `KeyNotFound`
+    for missing keys, `KeyConflict` for failed conditions and `BackendError` otherwise.
+
+    Attributes:
+        prefix (str): Prefix of object keys.
+        index_prefix (str): Prefix of index keys.
+        cold_prefix (str): Prefix of values of cold fields, see `Field.cold`.
+        indexed (set): Index prefixes known to be built.
+        cache (DeserializationCache): Cache of parsed objects.
+        missing (MissingKeyCache): Cache of missing object keys, shared by backends of
+            the process, see `shared_missing_cache`.
+        compression_threshold (int): Minimal length of compressed field values, see
+            `Field.compress`.
+        prefetch_threshold (int): Minimal number of missing related objects loaded by listing
+            their model, see `Model._prefetch_relations`.
+        keyring (KeyRing): Keys of encrypted field values.
+    """
+    # Objects are written with their index entries in single transaction, see `Model.save`
+    transactions = False
+
+    # Maximal number of operations in one transaction, `0` for no limit
+    max_txn_operations = 0
+
+    def __init__(self, **kwargs):
+        config = current_config()
+
+        self.prefix = '{}/obj/'.format(config.get('ETCD_PREFIX', '/kqueen'))
+        self.index_prefix = '{}/idx/'.format(config.get('ETCD_PREFIX', '/kqueen'))
+        self.cold_prefix = '{}/cold/'.format(config.get('ETCD_PREFIX', '/kqueen'))
+        self.indexed = set()
+        self.cache = DeserializationCache(int(config.get('STORAGE_CACHE_SIZE', 0)))
+        self.missing = shared_missing_cache(self.prefix, float(config.get('STORAGE_MISSING_TTL', 0)))
+        self.compression_threshold = int(config.get('STORAGE_COMPRESSION_THRESHOLD', 0))
+        self.prefetch_threshold = int(config.get('STORAGE_PREFETCH_THRESHOLD', 0))
+        self.keyring = KeyRing.from_config(config)
+
+    def get(self, key, allow_stale=False):
+        """Read the key.
+
+        Attributes:
+            allow_stale (bool): Value can be served from local replica, if backend has one.
+
+        Returns:
+            StorageNode: Stored node.
+
+        Raises:
+            KeyNotFound: Key doesn't exist.
+        """
+        raise NotImplementedError
+
+    def exists(self, key, allow_stale=False):
+        """Check the key exists, without reading its value where backend allows it."""
+        try:
+            self.get(key, allow_stale=allow_stale)
+            return True
+        except KeyNotFound:
+            return False
+
+    def list_prefix(self, prefix, allow_stale=False):
+        """Return nodes of keys directly in directory `prefix` (ending with `/`) ordered by key."""
+        raise NotImplementedError
+
+    def put(self, key, value):
+        """Write the value unconditionally.
+
+        Returns:
+            StorageNode: Written node.
+        """
+        raise NotImplementedError
+
+    def cas(self, key, value, prev_index=None, prev_exist=None):
+        """Write the value if stored key matches the conditions (compare-and-swap).
+
+        Attributes:
+            prev_index (int): Key must exist with given `modified_index`.
+            prev_exist (bool): Key must (not) exist.
+
+        Returns:
+            StorageNode: Written node.
+
+        Raises:
+            KeyConflict: Some of conditions failed.
+        """
+        raise NotImplementedError
+
+    def delete(self, key, prev_value=None, recursive=False):
+        """Delete the key.
+
+        Attributes:
+            prev_value (str): Delete only if key has given value.
+            recursive (bool): Delete also all keys in directory `key`.
+
+        Returns:
+            int: Modified index of the deletion.
+
+        Raises:
+            KeyNotFound: Nothing was deleted.
+            KeyConflict: Stored value differs from `prev_value`.
+        """
+        raise NotImplementedError
+
+    def watch(self, prefix, index=None, timeout=None):
+        """Wait for change of any key under `prefix`.
+
+        Attributes:
+            index (int): Return first change with `modified_index` greater or equal to
+                `index`, next change if not set.
+            timeout (float): Maximal time to wait in seconds.
+
+        Returns:
+            StorageEvent: Action (`set` or `delete`) and changed node, None on timeout.
+
+        Raises:
+            WatchExpired: Changes since `index` are not available anymore.
+        """
+        raise NotImplementedError
+
+    def transaction(self, compare, puts, reads=(), deletes=()):
+        """Write values only if all compared keys are unchanged.
+
+        Implemented by backends with `transactions` set.
+
+        Attributes:
+            compare (dict): Compared keys mapped to required `modified_index`, `None` for
+                keys which must not exist.
+            puts (list): `(key, value)` pairs written when comparison succeeds.
+            reads (list): Keys read when comparison fails.
+            deletes (list): Keys deleted (if they exist) when comparison succeeds.
+
+        Returns:
+            tuple: `True` and written nodes when comparison succeeded, otherwise `False`
+                and read nodes (`None` for missing keys).
+        """
+        raise NotImplementedError
+
+    def list_sorted(self, directory, offset=0, limit=0, reverse=False):
+        """Return page of directory entries ordered by key.
+
+        Attributes:
+            directory (str): Directory key, ending with `/`.
+            offset (int): Number of skipped entries.
+            limit (int): Maximal number of returned entries, `0` for all.
+            reverse (bool): Return entries in descending order.
+
+        Returns:
+            tuple: List of `(name, value)` tuples and total number of entries.
+        """
+        entries = [(node.key[len(directory):], node.value) for node in self.list_prefix(directory)]
+        if reverse:
+            entries.reverse()
+
+        page = entries[offset:offset + limit] if limit > 0 else entries[offset:]
+        return page, len(entries)
+
+    def write_many(self, items):
+        """Write `(key, value)` pairs."""
+        for key, value in items:
+            self.put(key, value)
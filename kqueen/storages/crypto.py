@@ -0,0 +1,151 @@
+from .exceptions import FieldError
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.ciphers.algorithms import AES
+from cryptography.hazmat.primitives.ciphers.modes import CBC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from kqueen.config import config_snapshot
+
+import base64
+import hashlib
+import json
+import os
+import threading
+
+# Prefix of values encrypted by AES-GCM, followed by key id and data separated by `$`.
+# Base64 never contains `$`, so values of legacy CBC format can't start with it.
+GCM_PREFIX = '$gcm1$'
+
+# Configuration snapshot and key ring created from it
+_default_keyring = (None, None)
+_default_keyring_lock = threading.Lock()
+
+
+class KeyRing:
+    """Keys used to encrypt field values, derived once per process.
+
+    New values are encrypted by AES-GCM as `$gcm1$<key id>$<base64 of nonce, ciphertext
+    and tag>`. Key id is stored with the value, so values encrypted by previous keys
+    can be read after rotation until they are rewritten, see `kqueen.storages.reencrypt`.
+    Values of legacy format (AES-CBC with key derived from `SECRET_KEY`, base64 of IV and
+    ciphertext) are always readable by current secret key, they have no key id, so they have
+    to be rewritten before the secret key is rotated.
+
+    Args:
+        secret_key (str): Secret of current key.
+        key_id (str): Id of current key.
+        old_keys (dict): Secrets of previous keys by their id, used only for reading.
+        cipher (str): Format of new values, `gcm` or `cbc` (readable by older versions).
+    """
+    block_size = 16
+
+    def __init__(self, secret_key, key_id='default', old_keys=None, cipher='gcm'):
+        if secret_key is None:
+            raise FieldError('Missing SECRET_KEY')
+        if '$' in key_id:
+            raise FieldError('Encryption key id {} can\'t contain $'.format(key_id))
+        if cipher not in ('gcm', 'cbc'):
+            raise FieldError('Unknown encryption cipher {}, use gcm or cbc'.format(cipher))
+
+        self.key_id = key_id
+        self.cipher = cipher
+        self.legacy_key = hashlib.sha256(secret_key.encode('utf-8')).digest()[:self.block_size]
+
+        secrets = dict(old_keys or {})
+        secrets[key_id] = secret_key
+        self.aead = {kid: AESGCM(self._derive(secret)) for kid, secret in secrets.items()}
+
+    @classmethod
+    def from_config(cls, config):
+        """Create key ring from `SECRET_KEY` and `ENCRYPTION_*` options."""
+        old_keys = config.get('ENCRYPTION_OLD_KEYS') or {}
+        if isinstance(old_keys, str):
+            # environment variables contain JSON
+            old_keys = json.loads(old_keys)
+
+        return cls(
+            config.get('SECRET_KEY'),
+            key_id=str(config.get('ENCRYPTION_KEY_ID', 'default')),
+            old_keys=old_keys,
+            cipher=config.get('ENCRYPTION_CIPHER', 'gcm'),
+        )
+
+    @staticmethod
+    def _derive(secret):
+        hkdf = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=b'kqueen field encryption',
+            backend=default_backend(),
+        )
+        return hkdf.derive(secret.encode('utf-8'))
+
+    def encrypt(self, plaintext):
+        """Return encrypted string for plaintext string."""
+        data = plaintext.encode('utf-8')
+        if self.cipher == 'cbc':
+            return self._encrypt_cbc(data)
+
+        nonce = os.urandom(12)
+        encrypted = self.aead[self.key_id].encrypt(nonce, data, None)
+        return '{}{}${}'.format(GCM_PREFIX, self.key_id, base64.b64encode(nonce + encrypted).decode('ascii'))
+
+    def decrypt(self, crypted):
+        """Return plaintext string of value encrypted by any known key."""
+        if not crypted.startswith(GCM_PREFIX):
+            return self._decrypt_cbc(crypted)
+
+        key_id, _, data = crypted[len(GCM_PREFIX):].partition('$')
+        aead = self.aead.get(key_id)
+        if aead is None:
+            raise FieldError('Unknown encryption key {}'.format(key_id))
+
+        decoded = base64.b64decode(data)
+        try:
+            return aead.decrypt(decoded[:12], decoded[12:], None).decode('utf-8')
+        except InvalidTag:
+            raise FieldError('Value encrypted by key {} can\'t be decrypted'.format(key_id))
+
+    def is_current(self, crypted):
+        """Check value is encrypted in current format by current key."""
+        if self.cipher == 'cbc':
+            return not crypted.startswith(GCM_PREFIX)
+
+        return crypted.startswith('{}{}$'.format(GCM_PREFIX, self.key_id))
+
+    def _encrypt_cbc(self, data):
+        padder = padding.PKCS7(self.block_size * 8).padder()
+        padded = padder.update(data) + padder.finalize()
+
+        iv = os.urandom(self.block_size)
+        encryptor = Cipher(AES(self.legacy_key), CBC(iv), backend=default_backend()).encryptor()
+        return base64.b64encode(iv + encryptor.update(padded) + encryptor.finalize()).decode('ascii')
+
+    def _decrypt_cbc(self, crypted):
+        decoded = base64.b64decode(crypted)
+        iv = decoded[:self.block_size]
+
+        decryptor = Cipher(AES(self.legacy_key), CBC(iv), backend=default_backend()).decryptor()
+        padded = decryptor.update(decoded[self.block_size:]) + decryptor.finalize()
+        # pad length is the last byte (PKCS7), as written by all versions
+        return padded[:-padded[-1]].decode('utf-8')
+
+
+def default_keyring():
+    """Return key ring created from configuration, used outside of application context.
+
+    Key ring is created again only when configuration was reloaded, see `reload_config`.
+    """
+    global _default_keyring
+
+    config = config_snapshot()
+    with _default_keyring_lock:
+        if _default_keyring[0] is not config:
+            _default_keyring = (config, KeyRing.from_config(config))
+
+        return _default_keyring[1]
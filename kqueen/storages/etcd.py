@@ -1,9 +1,15 @@
+from .base import StorageBackend
+from .base import StorageEvent
+from .base import StorageNode
+from .crypto import default_keyring
 from .exceptions import BackendError
 from .exceptions import FieldError
-from cryptography.hazmat.primitives.ciphers.algorithms import AES
-from cryptography.hazmat.primitives.ciphers.modes import CBC
-from cryptography.hazmat.primitives.ciphers import Cipher
-from cryptography.hazmat.backends import default_backend
+from .exceptions import KeyConflict
+from .exceptions import KeyNotFound
+from .exceptions import WatchExpired
+from collections import namedtuple
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 from dateutil.parser import parse as du_parse
 from flask import current_app
@@ -12,29 +18,482 @@ from kqueen.config import current_config
 import base64
 import etcd
 import hashlib
-import os
 import importlib
 import json
 import logging
+import threading
+import time
+import urllib.parse
 import uuid
+import zlib
 
 logger = logging.getLogger('kqueen_api')
 
 
-class EtcdBackend:
+class EtcdBackend(StorageBackend):
+    """Storage backend using etcd v2 API.
+
+    With `ETCD_REPLICA` enabled, reads allowing stale values are served from local
+    replica of the object tree, see `EtcdReplica`.
+    """
+
     def __init__(self, **kwargs):
+        super().__init__(**kwargs)
         config = current_config()
 
-        self.client = etcd.Client(
+        self.client = self.create_client(config)
+        self.replica = None
+        if config.get('ETCD_REPLICA'):
+            self.replica = self.create_replica(config)
+
+    def create_client(self, config):
+        return etcd.Client(
             host=config.get('ETCD_HOST', 'localhost'),
             port=int(config.get('ETCD_PORT', 4001)),
         )
-        self.prefix = '{}/obj/'.format(config.get('ETCD_PREFIX', '/kqueen'))
+
+    def create_replica(self, config):
+        return EtcdReplica(
+            self.client,
+            self.prefix,
+            max_staleness=float(config.get('ETCD_REPLICA_MAX_STALENESS', 5)),
+        )
+
+    def get_replica(self):
+        """Return replica if enabled and fresh enough to serve reads, None otherwise."""
+        if self.replica is not None and self.replica.is_fresh():
+            return self.replica
+
+    def _replica_for(self, key, allow_stale):
+        if allow_stale and key.startswith(self.prefix):
+            return self.get_replica()
+
+    def _replicate(self, action, key, value, modified_index, is_dir=False):
+        if self.replica is None:
+            return
+        if key.startswith(self.prefix) or (is_dir and self.prefix.startswith('{}/'.format(key.rstrip('/')))):
+            self.replica.apply(action, key, value, modified_index, is_dir=is_dir)
+
+    @contextmanager
+    def _translate_errors(self, key):
+        """Raise storage exceptions instead of etcd ones."""
+        try:
+            yield
+        except etcd.EtcdKeyNotFound as e:
+            raise KeyNotFound('Key {} not found'.format(key)) from e
+        except (etcd.EtcdCompareFailed, etcd.EtcdAlreadyExist) as e:
+            raise KeyConflict('Key {} was changed concurrently'.format(key)) from e
+        except etcd.EtcdEventIndexCleared as e:
+            raise WatchExpired('Changes of {} are not available anymore'.format(key)) from e
+        except etcd.EtcdException as e:
+            raise BackendError('Storage operation on {} failed: {}'.format(key, e)) from e
+
+    def get(self, key, allow_stale=False):
+        replica = self._replica_for(key, allow_stale)
+        if replica is not None:
+            node = replica.get(key)
+            if node is None:
+                raise KeyNotFound('Key {} not found'.format(key))
+            return StorageNode(node.key, node.value, node.modifiedIndex)
+
+        with self._translate_errors(key):
+            response = self.client.read(key)
+        if response.dir:
+            raise KeyNotFound('Key {} is a directory'.format(key))
+
+        return StorageNode(response.key, response.value, response.modifiedIndex)
+
+    def list_prefix(self, prefix, allow_stale=False):
+        replica = self._replica_for(prefix, allow_stale)
+        if replica is not None:
+            return sorted(StorageNode(n.key, n.value, n.modifiedIndex) for n in replica.children(prefix))
+
+        try:
+            with self._translate_errors(prefix):
+                response = self.client.read(prefix)
+        except KeyNotFound:
+            return []
+
+        # Don't allow iteration over children generator on empty directory.
+        # More information is here: https://github.com/jplana/python-etcd/issues/54
+        if not getattr(response, '_children', []):
+            return []
+
+        return sorted(
+            StorageNode(result.key, result.value, result.modifiedIndex)
+            for result in response.children if not result.dir
+        )
+
+    def _write(self, key, value, **kwargs):
+        with self._translate_errors(key):
+            response = self.client.write(key, value, **kwargs)
+
+        node = StorageNode(key, response.value, response.modifiedIndex)
+        self._replicate('set', key, node.value, node.modified_index)
+        return node
+
+    def put(self, key, value):
+        return self._write(key, value)
+
+    def cas(self, key, value, prev_index=None, prev_exist=None):
+        kwargs = {}
+        if prev_index is not None:
+            kwargs['prevIndex'] = prev_index
+        if prev_exist is not None:
+            kwargs['prevExist'] = prev_exist
+
+        try:
+            return self._write(key, value, **kwargs)
+        except KeyNotFound as e:
+            raise KeyConflict('Key {} was changed concurrently'.format(key)) from e
+
+    def delete(self, key, prev_value=None, recursive=False):
+        kwargs = {'recursive': recursive}
+        if prev_value is not None:
+            kwargs['prevValue'] = prev_value
+
+        with self._translate_errors(key):
+            response = self.client.delete(key, **kwargs)
+
+        self._replicate('delete', key, None, response.modifiedIndex, is_dir=recursive)
+        return response.modifiedIndex
+
+    def watch(self, prefix, index=None, timeout=None):
+        kwargs = {'waitIndex': index} if index is not None else {}
+        with self._translate_errors(prefix):
+            try:
+                event = self.client.read(prefix.rstrip('/'), recursive=True, wait=True, timeout=timeout, **kwargs)
+            except etcd.EtcdWatchTimedOut:
+                return None
+
+        action = 'delete' if event.action in ('delete', 'expire', 'compareAndDelete') else 'set'
+        return StorageEvent(action, StorageNode(event.key, event.value, event.modifiedIndex))
+
+
+ReplicaNode = namedtuple('ReplicaNode', ['key', 'value', 'modifiedIndex', 'dir'])
+
+
+class EtcdReplica:
+    """In-memory replica of the object tree kept current by etcd watch.
+
+    Replica is filled by one recursive read and then updated from a watch started at the
+    last seen index. It is started lazily on first use, so every (forked) worker process
+    keeps its own copy and throwaway applications never start a watch thread.
+
+    Reads should be served only when `is_fresh` returns True, i.e. replica was confirmed
+    to be current within last `max_staleness` seconds. Writes always go to etcd and are
+    applied locally with `apply` to keep read-your-writes consistency.
+
+    Args:
+        client (etcd.Client): etcd client.
+        prefix (str): Replicated directory.
+        max_staleness (float): Maximal age (in seconds) of replica allowed to serve reads.
+    """
+
+    def __init__(self, client, prefix, max_staleness=5):
+        self.client = client
+        self.prefix = prefix.rstrip('/')
+        self.max_staleness = max_staleness
+        self.watch_timeout = max(max_staleness / 2, 1)
+
+        self._nodes = {}
+        self._dirs = {}
+        self._deleted = {}
+        self._index = None
+        self._synced_at = None
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+
+            self._stopped = False
+            self.sync()
+            self._thread = threading.Thread(target=self._watch, name='etcd-replica', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+
+    def sync(self):
+        """Replace replica content with one recursive read."""
+        started = time.monotonic()
+        try:
+            response = self.client.read(self.prefix, recursive=True)
+            nodes = [node for node in response.leaves if not node.dir]
+            index = response.etcd_index
+        except etcd.EtcdKeyNotFound as e:
+            nodes = []
+            index = int(e.payload.get('index', 0)) if isinstance(e.payload, dict) else 0
+
+        with self._lock:
+            self._nodes = {}
+            self._dirs = {}
+            self._deleted = {}
+            for node in nodes:
+                self._set(node.key, node.value, node.modifiedIndex)
+            self._index = index
+            self._synced_at = started
+
+        logger.debug('Replica of {} synced at index {}'.format(self.prefix, index))
+
+    def _watch(self):
+        while not self._stopped:
+            started = time.monotonic()
+            try:
+                event = self.client.read(
+                    self.prefix,
+                    recursive=True,
+                    wait=True,
+                    waitIndex=self._index + 1,
+                    timeout=self.watch_timeout,
+                )
+                if self._stopped:
+                    break
+                self.apply(event.action, event.key, event.value, event.modifiedIndex, event.dir)
+                with self._lock:
+                    self._index = max(self._index, event.modifiedIndex)
+                    self._synced_at = started
+                    self._prune_deleted()
+            except etcd.EtcdWatchTimedOut:
+                if self._stopped:
+                    break
+                with self._lock:
+                    self._synced_at = started
+                    self._prune_deleted()
+            except etcd.EtcdEventIndexCleared:
+                logger.warning('Replica of {} is outdated, resyncing'.format(self.prefix))
+                self._sync_or_wait()
+            except Exception:
+                logger.exception('Watch of {} failed'.format(self.prefix))
+                self._sync_or_wait()
+
+    def _sync_or_wait(self):
+        try:
+            self.sync()
+        except Exception:
+            logger.exception('Unable to sync replica of {}'.format(self.prefix))
+            time.sleep(self.watch_timeout)
+
+    def is_fresh(self):
+        if self._thread is None:
+            try:
+                self.start()
+            except Exception:
+                logger.exception('Unable to start replica of {}'.format(self.prefix))
+                return False
+
+        return self._synced_at is not None and time.monotonic() - self._synced_at <= self.max_staleness
+
+    def apply(self, action, key, value, modified_index, is_dir=False):
+        """Apply change of the key to replica.
+
+        Changes older than replicated state of the key are ignored, so local writes
+        and watch events can be applied in any order.
+        """
+        with self._lock:
+            if action in ('delete', 'expire', 'compareAndDelete'):
+                if is_dir:
+                    for node_key in [k for k in self._nodes if k.startswith(key.rstrip('/') + '/')]:
+                        self._delete(node_key, modified_index)
+                else:
+                    self._delete(key, modified_index)
+            elif not is_dir:
+                current = self._nodes.get(key)
+                if current and current.modifiedIndex >= modified_index:
+                    return
+                if self._deleted.get(key, -1) >= modified_index:
+                    return
+                self._set(key, value, modified_index)
+
+    def _set(self, key, value, modified_index):
+        node = ReplicaNode(key, value, modified_index, False)
+        self._nodes[key] = node
+        self._dirs.setdefault(self._parent(key), {})[key] = node
+        self._deleted.pop(key, None)
+
+    def _delete(self, key, modified_index):
+        self._nodes.pop(key, None)
+        self._dirs.get(self._parent(key), {}).pop(key, None)
+        self._deleted[key] = modified_index
+
+    def _prune_deleted(self):
+        """Forget deletions already confirmed by watch."""
+        self._deleted = {k: i for k, i in self._deleted.items() if i > self._index}
+
+    @staticmethod
+    def _parent(key):
+        return key.rsplit('/', 1)[0] + '/'
+
+    def get(self, key):
+        """Return replicated node or None."""
+        return self._nodes.get(key)
+
+    def children(self, directory):
+        """Return list of replicated nodes directly in directory."""
+        with self._lock:
+            return list(self._dirs.get(directory, {}).values())
+
+
+class IdentityMap:
+    """Unit of work scoped registry of related objects.
+
+    While identity map is open, relations are resolved at most once per object and
+    `Model.list` prefetches all related objects with one directory read per related model.
+    Maps are stacked per thread, so it is safe to open them in request handlers.
+
+    Example:
+        >>> with IdentityMap():
+        ...     clusters = Cluster.list('demo')
+    """
+    _local = threading.local()
+
+    def __init__(self):
+        self._objects = {}
+        self._prefetching = set()
+        self._depth = 0
+
+    @classmethod
+    def current(cls):
+        """Return innermost open identity map for current thread or None."""
+        stack = getattr(cls._local, 'stack', None)
+        return stack[-1] if stack else None
+
+    @classmethod
+    def scope(cls):
+        """Return currently open identity map or a new one."""
+        return cls.current() or cls()
+
+    @staticmethod
+    def _identity(model_class, namespace, object_id):
+        namespace = namespace if model_class.is_namespaced() else None
+        return model_class.__name__, namespace, str(object_id)
+
+    def open(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        self._local.stack.append(self)
+        self._depth += 1
+        return self
+
+    def close(self):
+        self._depth -= 1
+        self._local.stack.pop()
+        if not self._depth:
+            self._objects.clear()
+
+    def get(self, model_class, namespace, object_id):
+        return self._objects.get(self._identity(model_class, namespace, object_id))
+
+    def add(self, obj, namespace=None):
+        self._objects[self._identity(obj.__class__, namespace, obj.id)] = obj
+
+    def discard(self, model_class, namespace, object_id):
+        self._objects.pop(self._identity(model_class, namespace, object_id), None)
+
+    def __contains__(self, identity):
+        return self._identity(*identity) in self._objects
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class SerializedObject:
+    """Stored field values of one object, decrypted on demand.
+
+    Decrypted values are kept, so every field of cached object is decrypted at most once.
+
+    Args:
+        stored (dict): Stored (possibly encrypted) values of fields.
+    """
+    __slots__ = ('stored', 'plaintext')
+
+    def __init__(self, stored):
+        self.stored = stored
+        self.plaintext = {}
+
+    def __contains__(self, field_name):
+        return field_name in self.stored
+
+    def get(self, field_name, field):
+        """Return serialized (decrypted) value of the field."""
+        try:
+            return self.plaintext[field_name]
+        except KeyError:
+            value = field.decrypt_serialized(self.stored[field_name])
+            self.plaintext[field_name] = value
+            return value
+
+
+class ColdValues:
+    """Values of cold field stored under separate keys, read on first access.
+
+    Loader shared by objects of one `Model.list` reads the whole field directory at once,
+    so listed objects don't read their values one by one. Backend of current application is
+    kept, so values can be read outside of application context (e.g. by worker threads).
+
+    Args:
+        directory (str): Directory of field values, keys are object ids.
+        batch (bool): Read all values of the directory on first access.
+    """
+    __slots__ = ('directory', 'batch', 'stored', 'backend')
+
+    def __init__(self, directory, batch=False):
+        self.directory = directory
+        self.batch = batch
+        self.stored = None
+        self.backend = current_app.db
+
+    def _read(self, object_id):
+        if self.batch:
+            return {
+                node.key[len(self.directory):]: node.value
+                for node in self.backend.list_prefix(self.directory, allow_stale=True)
+            }
+
+        try:
+            return {object_id: self.backend.get('{}{}'.format(self.directory, object_id), allow_stale=True).value}
+        except KeyNotFound:
+            return {}
+
+    def get(self, object_id, field):
+        """Return serialized (decrypted) value of the field of given object."""
+        if self.stored is None:
+            self.stored = self._read(object_id)
+
+        stored = self.stored.get(object_id)
+        value = json.loads(stored) if stored is not None else None
+        return field.decrypt_serialized(value) if value is not None else None
+
+
+# Stored value of field is not known
+_UNKNOWN = object()
 
 
 class Field:
     is_field = True
 
+    # Deserialize stored value on first access
+    lazy = True
+
+    # Version of envelope of compressed values, see `compress`
+    compression_version = 1
+
+    # Every object has its own field instances, so they don't use `__dict__`.
+    # `_stored_serialized` is serialized value as it is stored, `_UNKNOWN` for new
+    # values and values which were not read.
+    __slots__ = (
+        'required', 'encrypted', 'default', 'unique', 'cold', 'bs',
+        '_value', '_pending', '_stored_serialized', '_stored_pending',
+    )
+
     def __init__(self, *args, **kwargs):
         """Initialize Field object.
 
@@ -45,13 +504,20 @@ class Field:
             required (bool): Set field to be required before saving the model. Defaults to False.
             unique (bool): Set field to be unique within the Model before saving the model.
                            Defaults to False.
+            cold (bool): Store field under its own key and load it on first access, used for
+                         large values rarely needed together with the object. Defaults to False.
             value: Set field value.
         """
+        self._pending = None
+        self._stored_serialized = _UNKNOWN
+        self._stored_pending = None
+
         # Field parameters
         self.required = kwargs.get('required', False)
         self.encrypted = kwargs.get('encrypted', False)
         self.default = kwargs.get('default', None)
         self.unique = kwargs.get('unique', False)
+        self.cold = kwargs.get('cold', False)
 
         # Value can be passed as args[0] or kwargs['value']
         if len(args) >= 1:
@@ -62,6 +528,29 @@ class Field:
         # Set block size for crypto
         self.bs = 16
 
+    def copy(self):
+        """Return new field with the same parameters and without value.
+
+        Used to create fields of model objects from fields of the model, it is faster than
+        creating the field again.
+        """
+        field = object.__new__(self.__class__)
+        field.required = self.required
+        field.encrypted = self.encrypted
+        field.default = self.default
+        field.unique = self.unique
+        field.cold = self.cold
+        field.bs = self.bs
+        if hasattr(self, '__dict__'):
+            # fields defined outside of this module can keep parameters in `__dict__`
+            field.__dict__.update(self.__dict__)
+
+        field._value = None
+        field._pending = None
+        field._stored_serialized = _UNKNOWN
+        field._stored_pending = None
+        return field
+
     def _default_value(self):
         """Return default value directly or by calling return function."""
         if self.default is None:
@@ -70,6 +559,73 @@ class Field:
             return self.default()
         return self.default
 
+    @property
+    def value(self):
+        if self._pending is not None:
+            self._materialize()
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        if self._pending is not None:
+            # replaced stored value is compared by `changed` only when needed
+            self._stored_pending = self._pending
+        self._pending = None
+        self._value = value
+
+    @property
+    def deferred(self):
+        """Stored value was not deserialized yet."""
+        return self._pending is not None
+
+    @property
+    def cold_deferred(self):
+        """Stored value of cold field was not read yet, see `ColdValues`."""
+        return self._pending is not None and isinstance(self._pending[0], ColdValues)
+
+    @property
+    def stored_with_object(self):
+        """Cold field was stored with the object before it became cold, moved by next save."""
+        return self.cold and self.deferred and not self.cold_deferred
+
+    def set_serialized(self, serialized_object, field_name, **kwargs):
+        """Keep stored value and deserialize it on first access.
+
+        Args:
+            serialized_object (SerializedObject): Stored values of the object, or
+                `ColdValues` with object id passed as `field_name`.
+            field_name (str): Name of this field in the object.
+        """
+        self._pending = (serialized_object, field_name, kwargs)
+
+    def _materialize(self):
+        serialized_object, field_name, kwargs = self._pending
+        self._pending = None
+        self._value = None
+
+        serialized = serialized_object.get(field_name, self)
+        if serialized is not None or not isinstance(serialized_object, ColdValues):
+            self.deserialize(serialized, **kwargs)
+        self._stored_serialized = serialized
+
+    def mark_stored(self):
+        """Remember current value as the stored one, see `changed`."""
+        self._stored_serialized = None if self.empty() else self.serialize()
+        self._stored_pending = None
+
+    @property
+    def changed(self):
+        """Value differs from the stored one, values which were not deserialized are unchanged."""
+        if self.deferred:
+            return False
+
+        if self._stored_pending is not None:
+            serialized_object, field_name, _ = self._stored_pending
+            self._stored_pending = None
+            self._stored_serialized = serialized_object.get(field_name, self)
+
+        return (None if self.empty() else self.serialize()) != self._stored_serialized
+
     def on_create(self, **kwargs):
         """Optional action that should be run only on newly created objects."""
         pass
@@ -87,6 +643,18 @@ class Field:
     def serialize(self):
         return str(self.value) if self.value is not None else None
 
+    def sort_value(self):
+        """Return string with the same ordering as field values, used by sort indexes.
+
+        Returned string contains only hexadecimal digits, so it can be joined with
+        other sort values by `.` without changing the order.
+        """
+        serialized = self.serialize()
+        if serialized is None:
+            return ''
+
+        return str(serialized).encode('utf-8').hex()
+
     def deserialize(self, serialized, **kwargs):
         """
         This method is used for value deserialization. It is necessary to create instance first
@@ -101,6 +669,8 @@ class Field:
         self.set_value(serialized, **kwargs)
 
     def empty(self):
+        if self.deferred:
+            return False
         return self.value is None
 
     def validate(self):
@@ -113,63 +683,99 @@ class Field:
         """
         return True
 
-    def _get_encryption_key(self):
-        """Read encryption key and format it.
-
-        Returns:
-            Encryption key.
-        """
-        # Check for key
-        config = current_config()
-        key = config.get('SECRET_KEY')
-
-        if key is None:
-            raise Exception('Missing SECRET_KEY')
-
-        # Calculate hash password
-        return hashlib.sha256(key.encode('utf-8')).digest()[:self.bs]
-
-    def _pad(self, s):
-        return s + (self.bs - len(s) % self.bs) * chr(self.bs - len(s) % self.bs)
-
-    def _unpad(self, s):
-        return s[:-ord(s[len(s) - 1:])]
+    @staticmethod
+    def _keyring():
+        """Return keys of storage backend, derived once per process."""
+        try:
+            return current_app.db.keyring
+        except (AttributeError, RuntimeError):
+            return default_keyring()
 
     def encrypt(self):
         """Encrypt stored value."""
-        serialized = self.serialize()
+        if self.deferred:
+            # value was not accessed since loading, reuse stored value
+            serialized_object, field_name, _ = self._pending
+            return serialized_object.stored[field_name]
+
+        return self.encrypt_serialized(self.serialize())
+
+    def encrypt_serialized(self, serialized):
+        """Return stored value for serialized (plaintext) value, see `decrypt_serialized`."""
+        if serialized is not None:
+            compressed = self.compress(str(serialized))
+            if compressed is not None:
+                return compressed
 
         if not self.encrypted:
             return serialized
 
         if serialized is not None:
-            key = self._get_encryption_key()
-            padded = self._pad(str(serialized))
-            backend = default_backend()
-            iv = os.urandom(self.bs)
-            cipher = Cipher(AES(key), CBC(iv), backend=backend)
-            enc = cipher.encryptor()
-            encrypted = enc.update(str(padded).encode('utf-8')) + enc.finalize()
-            encoded = base64.b64encode(iv + encrypted).decode('utf-8')
-            return encoded
+            return self._encrypt_string(str(serialized))
+
+    def _encrypt_string(self, plaintext):
+        return self._keyring().encrypt(plaintext)
+
+    def stored_is_current(self, stored):
+        """Check stored value is encrypted by current key (or not encrypted at all)."""
+        if isinstance(stored, dict):
+            return not stored.get('encrypted') or self._keyring().is_current(stored['data'])
+
+        return not self.encrypted or stored is None or self._keyring().is_current(stored)
+
+    def compress(self, serialized):
+        """Return envelope with compressed value or None when value is not compressed.
+
+        Values longer than `STORAGE_COMPRESSION_THRESHOLD` (zero disables compression) are
+        compressed by zlib before encryption and stored as dict
+        `{"v": 1, "codec": "zlib", "encrypted": bool, "data": str}`. Plain stored values are
+        never dicts, so both formats can be read regardless of current configuration.
+        """
+        try:
+            threshold = current_app.db.compression_threshold
+        except (AttributeError, RuntimeError):
+            threshold = 0
+
+        if not threshold or len(serialized) < threshold:
+            return None
+
+        plaintext = serialized.encode('utf-8')
+        data = base64.b64encode(zlib.compress(plaintext)).decode('ascii')
+        # incompressible values are stored as they are
+        if len(data) >= len(plaintext):
+            return None
+
+        envelope = {'v': self.compression_version, 'codec': 'zlib', 'encrypted': self.encrypted}
+        envelope['data'] = self._encrypt_string(data) if self.encrypted else data
+        return envelope
+
+    def decompress(self, envelope):
+        """Return serialized (plaintext) value of compressed envelope, see `compress`."""
+        if envelope.get('v') != self.compression_version or envelope.get('codec') != 'zlib':
+            raise FieldError('Unsupported compressed value version {} ({})'.format(
+                envelope.get('v'), envelope.get('codec')))
+
+        data = envelope['data']
+        if envelope.get('encrypted'):
+            data = self._decrypt_string(data)
+
+        return zlib.decompress(base64.b64decode(data)).decode('utf-8')
 
     def decrypt(self, crypted, **kwargs):
-        if not self.encrypted:
-            return self.deserialize(crypted, **kwargs)
+        self.deserialize(self.decrypt_serialized(crypted), **kwargs)
 
-        key = self._get_encryption_key()
-        decoded = base64.b64decode(crypted)
+    def decrypt_serialized(self, crypted):
+        """Return serialized (plaintext) value for stored value."""
+        if isinstance(crypted, dict):
+            return self.decompress(crypted)
 
-        iv = decoded[:self.bs]
-        backend = default_backend()
-        cipher = Cipher(AES(key), CBC(iv), backend=backend)
-        decryptor = cipher.decryptor()
-        decrypted = decryptor.update(decoded[self.bs:]) + decryptor.finalize()
-        decrypted_decoded = decrypted.decode('utf-8')
+        if not self.encrypted:
+            return crypted
 
-        serialized = self._unpad(decrypted_decoded)
+        return self._decrypt_string(crypted)
 
-        self.deserialize(serialized, **kwargs)
+    def _decrypt_string(self, crypted):
+        return self._keyring().decrypt(crypted)
 
     def __str__(self):
         return str(self.value)
@@ -182,10 +788,12 @@ class Field:
 
 
 class StringField(Field):
-    pass
+    __slots__ = ()
 
 
 class BoolField(Field):
+    __slots__ = ()
+
     def deserialize(self, serialized, **kwargs):
         if isinstance(serialized, str):
             value = json.loads(serialized)
@@ -204,12 +812,16 @@ class BoolField(Field):
 
 
 class IdField(Field):
+    __slots__ = ()
+
     def set_value(self, value, **kwargs):
         """Don't serialize None."""
         self.value = str(value) if value is not None else value
 
 
 class PasswordField(Field):
+    __slots__ = ()
+
     def on_create(self):
         from kqueen.auth import encrypt_password
         self.value = encrypt_password(self.value)
@@ -217,6 +829,7 @@ class PasswordField(Field):
 
 class DatetimeField(Field):
     """Datetime is stored as UTC timestamp in DB and as naive datetime on instance."""
+    __slots__ = ()
 
     def deserialize(self, serialized, **kwargs):
         # Convert to float if serialized is digit
@@ -239,6 +852,10 @@ class DatetimeField(Field):
     def serialize(self):
         return int(self.value.timestamp()) if isinstance(self.value, datetime) else None
 
+    def sort_value(self):
+        serialized = self.serialize()
+        return '{:016x}'.format(serialized) if serialized is not None else ''
+
     def dict_value(self):
         """Return API representation of value."""
         return self.value.isoformat() if self.value and isinstance(self.value, datetime) else None
@@ -246,6 +863,7 @@ class DatetimeField(Field):
 
 class JSONField(Field):
     """JSON is stored as value."""
+    __slots__ = ()
 
     def set_value(self, value, **kwargs):
         if isinstance(value, str):
@@ -262,6 +880,10 @@ class RelationField(Field):
 
     Serialization format is `ModelName:object_id`.
     """
+    # Relations are resolved while related objects are prefetched, see `IdentityMap`
+    lazy = False
+
+    __slots__ = ('remote_class_name',)
 
     def __init__(self, *args, **kwargs):
         super(RelationField, self).__init__(*args, **kwargs)
@@ -299,9 +921,14 @@ class RelationField(Field):
 
             obj_class = self._get_related_class(class_name)
 
-            obj = obj_class.load(kwargs.get('namespace'), object_id)
+            obj = obj_class.load_related(kwargs.get('namespace'), object_id)
             self.set_value(obj, **kwargs)
 
+    def copy(self):
+        field = super(RelationField, self).copy()
+        field.remote_class_name = self.remote_class_name
+        return field
+
     def _get_related_class(self, class_name):
         module = importlib.import_module('kqueen.models')
         return getattr(module, class_name)
@@ -335,18 +962,45 @@ class ModelMeta(type):
                 name_hidden = '_{}'.format(attr_name)
                 fields[attr_name] = attr
 
-                def fget(self, k=attr_name):
-                    att = getattr(self, "_{}".format(k))
-                    return att.get_value()
+                def fget(self, name_hidden=name_hidden):
+                    return getattr(self, name_hidden).get_value()
 
-                def fset(self, value, k=attr_name):
-                    att = getattr(self, "_{}".format(k))
-                    att.set_value(value)
+                def fset(self, value, name_hidden=name_hidden):
+                    getattr(self, name_hidden).set_value(value)
 
                 newattributes[attr_name] = property(fget, fset)
                 logger.debug('Setting {} to point to {}'.format(attr_name, name_hidden))
 
         newattributes['_fields'] = fields
+        newattributes['_field_specs'] = tuple(
+            (field_name, '_{}'.format(field_name), field)
+            for field_name, field in fields.items()
+        )
+
+        # Cold fields are stored outside of the object and can't be checked with it
+        cold_fields = []
+        for field_name, field in fields.items():
+            if not field.cold:
+                continue
+            if field.unique or isinstance(field, RelationField):
+                raise FieldError('Field {} of {} can\'t be cold'.format(field_name, clsname))
+            cold_fields.append(field_name)
+        newattributes['_cold_fields'] = cold_fields
+
+        # Sort index keys contain field values
+        for sort_name, field_names in attributedict.get('sort_indexes', {}).items():
+            for field_name in field_names:
+                if field_name not in fields or fields[field_name].encrypted or fields[field_name].cold:
+                    raise FieldError('Field {} of {} can\'t be used by sort index {}'.format(
+                        field_name, clsname, sort_name))
+
+        # Group index entries share names with sort index entries, see `Model._sort_values`
+        for group_name, field_name in attributedict.get('group_indexes', {}).items():
+            if field_name not in fields or fields[field_name].cold:
+                raise FieldError('Field {} of {} can\'t be used by group index {}'.format(
+                    field_name, clsname, group_name))
+            if group_name in attributedict.get('sort_indexes', {}):
+                raise FieldError('Index {} of {} is both sort and group index'.format(group_name, clsname))
 
         return type.__new__(cls, clsname, superclasses, newattributes)
 
@@ -355,6 +1009,23 @@ class Model:
     """Parent class for all models."""
     id = IdField()  # id field is required for all models
 
+    # Number of attempts to write object changed concurrently
+    save_retries = 5
+
+    # Fields loaded by `list` with projection, `None` for complete objects
+    _projection = None
+
+    # `(field_name, hidden_name, field)` of all fields, set by `ModelMeta`
+    _field_specs = ()
+
+    # Sort indexes used by `list_page`, index name mapped to sorting fields. Object id
+    # is always used as the last sorting field.
+    sort_indexes = {}
+
+    # Group indexes used by `list_group`, index name mapped to grouping field. Objects
+    # with the same value of the field are listed from one directory.
+    group_indexes = {}
+
     def __init__(self, ns=None, **kwargs):
         """Create model object.
 
@@ -372,18 +1043,18 @@ class Model:
                 raise BackendError('Missing namespace for class {}'.format(self.__class__.__name__))
 
         # Loop fields and set it
-        for field_name, field in self.__class__.get_fields().items():
-            field_class = field.__class__
-            if hasattr(field_class, 'is_field'):
-                field_object = field_class(**field.__dict__)
-                field_object.set_value(kwargs.get(field_name, field_object._default_value()),
-                                       namespace=ns)
+        create = kwargs.get('__create__', False)
+        for field_name, name_hidden, field in self._field_specs:
+            field_object = field.copy()
+            value = kwargs[field_name] if field_name in kwargs else field_object._default_value()
+            if value is not None:
+                field_object.set_value(value, namespace=ns)
 
-                # Hash password field in case of new DB entry
-                if kwargs.get('__create__', False):
-                    field_object.on_create()
+            # Hash password field in case of new DB entry
+            if create:
+                field_object.on_create()
 
-                setattr(self, '_{}'.format(field_name), field_object)
+            setattr(self, name_hidden, field_object)
 
     @classmethod
     def get_model_name(cls):
@@ -421,6 +1092,406 @@ class Model:
             model=cls.get_model_name(),
         )
 
+    @classmethod
+    def get_cold_prefix(cls, namespace, field_name):
+        """Return directory of values of cold field.
+
+        Cold values are kept outside of object directories, so listing objects never reads
+        them, not even on backends listing whole key ranges.
+
+        Example:
+            /kqueen/cold/default/MyModel/field/
+        """
+        if cls.is_namespaced():
+            if not namespace:
+                raise BackendError('Missing namespace for class {}'.format(cls.__name__))
+        else:
+            namespace = 'global'
+
+        return '{prefix}{namespace}/{model}/{field}/'.format(
+            prefix=current_app.db.cold_prefix,
+            namespace=namespace,
+            model=cls.get_model_name(),
+            field=field_name,
+        )
+
+    @classmethod
+    def get_index_prefix(cls, namespace=None):
+        """Calculate prefix for indexes of unique fields.
+
+        Example:
+            /kqueen/idx/default/MyModel/
+        """
+        if not cls.is_namespaced():
+            namespace = 'global'
+
+        return '{prefix}{namespace}/{model}/'.format(
+            prefix=current_app.db.index_prefix,
+            namespace=namespace,
+            model=cls.get_model_name(),
+        )
+
+    @classmethod
+    def get_index_key(cls, namespace, field_name, index_value):
+        """Return key of the index entry, the value of this key is object id.
+
+        Example:
+            /kqueen/idx/global/user/username/admin
+        """
+        return '{prefix}{field}/{value}'.format(
+            prefix=cls.get_index_prefix(namespace),
+            field=field_name,
+            value=urllib.parse.quote(index_value, safe=''),
+        )
+
+    @classmethod
+    def _index_value(cls, field_name, value):
+        """Return string used as index for value of unique field."""
+        field = cls.get_fields()[field_name]
+        field_object = field.copy()
+        field_object.set_value(value)
+
+        return cls._format_index_value(field_object)
+
+    @staticmethod
+    def _format_index_value(field_object):
+        """Values of encrypted fields are hashed, so they never appear in keys."""
+        serialized = field_object.serialize()
+        if serialized is None:
+            return None
+
+        serialized = str(serialized)
+        if field_object.encrypted:
+            return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+        return serialized
+
+    def _index_values(self):
+        """Return index values for all unique fields with value."""
+        values = {}
+        for field_name, name_hidden, field in self._field_specs:
+            if field.unique:
+                index_value = self._format_index_value(getattr(self, name_hidden))
+                if index_value is not None:
+                    values[field_name] = index_value
+
+        return values
+
+    @classmethod
+    def get_sort_index_prefix(cls, namespace, sort_name):
+        """Return prefix of sort index entries, keys of entries are ordered as objects.
+
+        Example:
+            /kqueen/idx/default/cluster/_sort/name/
+        """
+        return '{prefix}_sort/{name}/'.format(
+            prefix=cls.get_index_prefix(namespace),
+            name=sort_name,
+        )
+
+    @classmethod
+    def get_group_index_prefix(cls, namespace, group_name, group_value=None):
+        """Return prefix of group index entries, directory of single group with `group_value`.
+
+        Example:
+            /kqueen/idx/global/user/_group/organization/Organization%3A123/
+        """
+        prefix = '{prefix}_group/{name}/'.format(
+            prefix=cls.get_index_prefix(namespace),
+            name=group_name,
+        )
+        if group_value is None:
+            return prefix
+
+        return '{}{}/'.format(prefix, urllib.parse.quote(group_value, safe=''))
+
+    @classmethod
+    def get_entry_key(cls, namespace, index_name, entry):
+        """Return key of sort or group index entry, see `_sort_values`."""
+        if index_name in cls.group_indexes:
+            return '{}{}'.format(cls.get_group_index_prefix(namespace, index_name), entry)
+
+        return '{}{}'.format(cls.get_sort_index_prefix(namespace, index_name), entry)
+
+    def _sort_values(self):
+        """Return entry names of sort and group indexes of this object, mapped by index name.
+
+        Group entries are named `group value/object id`, objects without value of the grouping
+        field have no group entry.
+        """
+        values = {}
+        for sort_name, field_names in self.__class__.sort_indexes.items():
+            parts = [getattr(self, '_{}'.format(field_name)).sort_value() for field_name in field_names]
+            parts.append(self._id.sort_value())
+            values[sort_name] = '.'.join(parts)
+
+        for group_name, field_name in self.__class__.group_indexes.items():
+            group_value = self._group_value(field_name)
+            if group_value is not None:
+                values[group_name] = '{}/{}'.format(urllib.parse.quote(group_value, safe=''), self.id)
+
+        return values
+
+    def _group_value(self, field_name):
+        """Return value of grouping field used in group index entries."""
+        field = getattr(self, '_{}'.format(field_name))
+        if field.value is None:
+            return None
+
+        return self._format_index_value(field)
+
+    def _write_sort_entries(self, namespace, values):
+        """Write sort index entries missing for current values.
+
+        Entries are written after the object, so failed attempts leave no entries behind.
+        Entries of values overwritten concurrently are deleted by `list_page`.
+        """
+        sorted_values = getattr(self, '_sorted', {})
+        for sort_name, entry in values.items():
+            if sorted_values.get(sort_name) != entry:
+                current_app.db.put(
+                    self.__class__.get_entry_key(namespace, sort_name, entry),
+                    self.id,
+                )
+
+    def _delete_sort_entry(self, namespace, sort_name, entry):
+        try:
+            current_app.db.delete(
+                self.__class__.get_entry_key(namespace, sort_name, entry),
+                prev_value=self.id,
+            )
+        except (KeyNotFound, KeyConflict):
+            pass
+
+    @classmethod
+    def build_indexes(cls, namespace=None):
+        """Write index entries for all stored objects.
+
+        Indexes are built automatically on first lookup for objects stored
+        before indexes were introduced.
+        """
+        entries = []
+        for obj in cls.list(namespace).values():
+            for field_name, index_value in obj._index_values().items():
+                entries.append((cls.get_index_key(namespace, field_name, index_value), obj.id))
+            for sort_name, entry in obj._sort_values().items():
+                entries.append((cls.get_entry_key(namespace, sort_name, entry), obj.id))
+
+        current_app.db.write_many(entries)
+
+        current_app.db.put('{}_built'.format(cls.get_index_prefix(namespace)), cls._indexes_version())
+        current_app.db.indexed.add(cls.get_index_prefix(namespace))
+
+    @classmethod
+    def _indexes_version(cls):
+        """Return version of built indexes, indexes are built again when group index is added."""
+        if not cls.group_indexes:
+            return '1'
+
+        return '1+{}'.format(','.join(sorted(cls.group_indexes)))
+
+    @classmethod
+    def _ensure_indexes(cls, namespace):
+        prefix = cls.get_index_prefix(namespace)
+        if prefix in current_app.db.indexed:
+            return
+
+        try:
+            built = current_app.db.get('{}_built'.format(prefix)).value
+        except KeyNotFound:
+            built = None
+
+        if built == cls._indexes_version():
+            current_app.db.indexed.add(prefix)
+        else:
+            logger.info('Building indexes in {}'.format(prefix))
+            cls.build_indexes(namespace)
+
+    @classmethod
+    def lookup_id(cls, namespace, field_name, value):
+        """Find object id by value of unique field using index.
+
+        Returns:
+            str: Object id or None if index entry is missing.
+        """
+        index_value = cls._index_value(field_name, value)
+        if index_value is None:
+            return None
+
+        cls._ensure_indexes(namespace)
+        try:
+            return current_app.db.get(cls.get_index_key(namespace, field_name, index_value)).value
+        except KeyNotFound:
+            return None
+
+    @classmethod
+    def load_by(cls, namespace, field_name, value):
+        """Load object by value of unique field.
+
+        Raises:
+            NameError: Object is not found.
+        """
+        object_id = cls.lookup_id(namespace, field_name, value)
+        if object_id is None:
+            raise NameError('Object is not found')
+
+        obj = cls.load(namespace, object_id)
+
+        # index entry can be stale after interrupted save
+        if obj._index_values().get(field_name) != cls._index_value(field_name, value):
+            raise NameError('Object is not found')
+
+        return obj
+
+    def _claim_indexes(self, namespace, values, validate=True):
+        """Atomically point index entries of unique fields to this object.
+
+        Index entries are created only if missing, entries of other objects are
+        replaced only when they are stale (compare-and-swap on their `modified_index`).
+
+        Returns:
+            list: Index values claimed by this call, as tuples `(field_name, index_value)`.
+
+        Raises:
+            ValueError: Value is already used by other object and `validate` is set.
+            KeyConflict: Index entry changed during the claim.
+        """
+        indexed = getattr(self, '_indexed', {})
+        claimed = []
+
+        try:
+            for field_name, index_value in values.items():
+                if indexed.get(field_name) == index_value:
+                    continue
+
+                index_key = self.__class__.get_index_key(namespace, field_name, index_value)
+                try:
+                    current_app.db.cas(index_key, self.id, prev_exist=False)
+                    claimed.append((field_name, index_value))
+                    continue
+                except KeyConflict:
+                    owner = current_app.db.get(index_key)
+
+                if owner.value == self.id:
+                    continue
+
+                owner_exists = self.__class__._index_owner_exists(namespace, field_name, index_value, owner.value)
+                if owner_exists or not self._take_over_index(namespace, field_name, index_value, owner):
+                    if validate:
+                        raise ValueError('Validation for model failed with: Field "{name}" should be unique'.format(
+                            name=field_name))
+                    continue
+
+                claimed.append((field_name, index_value))
+        except Exception:
+            self._release_indexes(namespace, claimed)
+            raise
+
+        return claimed
+
+    @classmethod
+    def _index_owner_exists(cls, namespace, field_name, index_value, object_id):
+        """Check index entry is not stale, i.e. object exists and still has the value.
+
+        Object is read from storage directly, replica or missing key cache could miss
+        the object written just now.
+        """
+        key = '{}{}'.format(cls.get_db_prefix(namespace), object_id)
+        try:
+            node = current_app.db.get(key)
+        except KeyNotFound:
+            return False
+
+        owner = cls.deserialize(node.value, key=key, modified_index=node.modified_index, namespace=namespace)
+        return owner._index_values().get(field_name) == index_value
+
+    def _take_over_index(self, namespace, field_name, index_value, owner):
+        """Point stale index entry of other object to this object.
+
+        Entry of other object is created before the object itself, so its owner can be
+        written between the staleness check and the swap. The owner is checked again and
+        the entry is given back when the owner turned out to be live.
+
+        Attributes:
+            owner (StorageNode): Current index entry, found stale.
+
+        Returns:
+            bool: Entry was taken over.
+
+        Raises:
+            KeyConflict: Index entry changed since it was checked.
+        """
+        index_key = self.__class__.get_index_key(namespace, field_name, index_value)
+        taken = current_app.db.cas(index_key, self.id, prev_index=owner.modified_index)
+
+        if not self.__class__._index_owner_exists(namespace, field_name, index_value, owner.value):
+            return True
+
+        try:
+            current_app.db.cas(index_key, owner.value, prev_index=taken.modified_index)
+        except (KeyConflict, KeyNotFound):
+            pass
+        return False
+
+    def _verify_claims(self, namespace, key, claimed, node, previous):
+        """Check index entries claimed before writing the object still point to it.
+
+        Other saver can take over an entry claimed by this object before the object was
+        written (see `_take_over_index`). The write is then undone, so the value is used
+        by one object only.
+
+        Attributes:
+            claimed (list): Claimed index values, as tuples `(field_name, index_value)`.
+            node (StorageNode): Written object.
+            previous (StorageNode): Object stored before the write, None for new objects.
+
+        Raises:
+            ValueError: Some entry was taken over, the write was undone.
+        """
+        for field_name, index_value in claimed:
+            index_key = self.__class__.get_index_key(namespace, field_name, index_value)
+            try:
+                if current_app.db.get(index_key).value == self.id:
+                    continue
+            except KeyNotFound:
+                continue
+
+            try:
+                if previous is None:
+                    current_app.db.delete(key, prev_value=node.value)
+                else:
+                    current_app.db.cas(key, previous.value, prev_index=node.modified_index)
+            except (KeyConflict, KeyNotFound):
+                logger.error('Unable to undo write of {} with non-unique field {}'.format(key, field_name))
+            current_app.db.cache.invalidate(key)
+
+            self._release_indexes(namespace, claimed)
+            raise ValueError('Validation for model failed with: Field "{name}" should be unique'.format(
+                name=field_name))
+
+    def _read_previous(self, key, claimed, validate=True):
+        """Return stored object needed to undo the write, see `_verify_claims`."""
+        if not validate or not claimed or self._stored_index(key) is None:
+            return None
+
+        try:
+            return current_app.db.get(key)
+        except KeyNotFound:
+            return None
+
+    def _release_indexes(self, namespace, index_values):
+        for field_name, index_value in index_values:
+            self._delete_index(namespace, field_name, index_value)
+
+    def _delete_index(self, namespace, field_name, index_value):
+        try:
+            current_app.db.delete(
+                self.__class__.get_index_key(namespace, field_name, index_value),
+                prev_value=self.id,
+            )
+        except (KeyNotFound, KeyConflict):
+            pass
+
     @classmethod
     def create(cls, ns, **kwargs):
         """Create a new object."""
@@ -428,75 +1499,426 @@ class Model:
         return cls(ns, **kwargs)
 
     @classmethod
-    def list(cls, namespace, return_objects=True):
-        """List objects in the database."""
+    def get_projection(cls, fields):
+        """Return projection for list of field names.
+
+        Fields of related objects are selected by dotted names, e.g. `provisioner.name`.
+        Field `id` is always part of projection.
+
+        Args:
+            fields (list): Field names.
+
+        Returns:
+            dict: Field names mapped to list of related field names (`None` for whole field).
+        """
+        projection = {'id': None}
+
+        for name in fields:
+            field_name, _, related = name.partition('.')
+            field = cls.get_fields().get(field_name)
+            if field is None:
+                raise FieldError('Unknown field {} of {}'.format(field_name, cls.get_model_name()))
+
+            if not related:
+                projection[field_name] = None
+                continue
+
+            if not isinstance(field, RelationField):
+                raise FieldError('Field {} of {} is not a relation'.format(field_name, cls.get_model_name()))
+            if field.remote_class_name:
+                field._get_related_class(field.remote_class_name).get_projection([related])
+
+            if field_name not in projection:
+                projection[field_name] = [related]
+            elif projection[field_name] is not None:
+                projection[field_name].append(related)
+
+        return projection
+
+    @classmethod
+    def list(cls, namespace, return_objects=True, fields=None):
+        """List objects in the database.
+
+        Related objects of all listed objects are prefetched in bulk, see `IdentityMap`.
+
+        Attributes:
+            fields (list): Load only given fields, see `get_projection`. Relations missing
+                in `fields` are not loaded at all. Such objects can't be saved.
+        """
+        projection = cls.get_projection(fields) if fields is not None else None
         output = {}
         key = cls.get_db_prefix(namespace)
 
         try:
-            directory = current_app.db.client.get(key)
-        except etcd.EtcdKeyNotFound:
-            logger.debug('No objects found in the following path: {}'.format(key))
-            return output
-        except etcd.EtcdException:
-            logger.exception('Error while getting {} key from the etcd'.format(key))
+            children = current_app.db.list_prefix(key, allow_stale=True)
+        except BackendError:
+            logger.exception('Error while getting {} key from the storage'.format(key))
             return output
 
-        # Don't allow iteration over children generator on empty directory.
-        # More information is here: https://github.com/jplana/python-etcd/issues/54
-        if not getattr(directory, '_children', []):
+        if not children:
+            logger.debug('No objects found in the following path: {}'.format(key))
             return output
-
-        for result in directory.children:
-            output[result.key.replace(key, '')] = (
-                cls.deserialize(result.value, namespace=namespace)
-                if return_objects else None
+        if not return_objects:
+            return {result.key.replace(key, ''): None for result in children}
+
+        serialized_objects = [
+            (result.key, result.modified_index, cls._parse_serialized(result.value, result.key, result.modified_index))
+            for result in children
+        ]
+
+        # values of cold fields are read for all objects at once, when first of them is needed
+        cold = {
+            field_name: ColdValues(cls.get_cold_prefix(namespace, field_name), batch=True)
+            for field_name in cls._cold_fields
+        }
+
+        with IdentityMap.scope() as identity_map:
+            cls._prefetch_relations(
+                identity_map,
+                namespace,
+                [o for _, _, o in serialized_objects],
+                projection=projection,
             )
 
+            for result_key, modified_index, serialized_object in serialized_objects:
+                output[result_key.replace(key, '')] = cls._from_serialized(
+                    serialized_object,
+                    projection=projection,
+                    cold=cold,
+                    key=result_key,
+                    modified_index=modified_index,
+                    namespace=namespace,
+                )
+
         return output
 
     @classmethod
-    def load(cls, namespace, object_id):
-        """Load object from database."""
+    def _prefetch_relations(cls, identity_map, namespace, serialized_objects, projection=None):
+        """Load missing related objects with one list per related model.
+
+        Related model is listed only when at least `prefetch_threshold` of its objects are
+        missing, fewer objects are cheaper to load one by one, see `load_related`.
+        """
+        threshold = current_app.db.prefetch_threshold
+        missing = {}
+
+        for field_name, field in cls.get_fields().items():
+            if not isinstance(field, RelationField):
+                continue
+            if projection is not None and field_name not in projection:
+                continue
+
+            for serialized_object in serialized_objects:
+                if field_name not in serialized_object:
+                    continue
+                serialized = serialized_object.get(field_name, field)
+                if not serialized or ':' not in serialized:
+                    continue
+
+                class_name, object_id = serialized.split(':')
+                obj_class = field._get_related_class(class_name)
+                if (obj_class, namespace, object_id) not in identity_map:
+                    missing.setdefault(obj_class, set()).add(object_id)
+
+        for obj_class, object_ids in missing.items():
+            if not threshold or len(object_ids) < threshold or obj_class in identity_map._prefetching:
+                continue
+            if obj_class.is_namespaced() and not namespace:
+                continue
+
+            identity_map._prefetching.add(obj_class)
+            try:
+                for obj in obj_class.list(namespace).values():
+                    identity_map.add(obj, namespace)
+            finally:
+                identity_map._prefetching.discard(obj_class)
+
+    @classmethod
+    def list_page(cls, namespace, sort_name, offset=0, limit=0, reverse=False, fields=None):
+        """Return one page of objects ordered by sort index.
+
+        Only entries of the sort index are listed, objects are read just for the
+        requested page.
+
+        Attributes:
+            sort_name (str): Name of sort index, see `sort_indexes`.
+            offset (int): Number of skipped objects.
+            limit (int): Maximal number of returned objects, `0` for all.
+            reverse (bool): Return objects in descending order.
+            fields (list): Load only given fields, see `list`.
+
+        Returns:
+            tuple: List of objects and total number of objects.
+        """
+        if sort_name not in cls.sort_indexes:
+            raise BackendError('Unknown sort index {} of {}'.format(sort_name, cls.get_model_name()))
+
+        if fields is not None:
+            fields = list(fields) + list(cls.sort_indexes[sort_name])
+
+        cls._ensure_indexes(namespace)
+        directory = cls.get_sort_index_prefix(namespace, sort_name)
+        objects = []
+        position = offset
+
+        with IdentityMap.scope():
+            while True:
+                page, total = current_app.db.list_sorted(
+                    directory,
+                    offset=position,
+                    limit=limit - len(objects) if limit > 0 else 0,
+                    reverse=reverse,
+                )
+                dropped = 0
+
+                for entry, object_id in page:
+                    try:
+                        obj = cls.load(namespace, object_id, fields=fields)
+                    except NameError:
+                        obj = None
+
+                    if obj is not None and obj._sort_values()[sort_name] == entry:
+                        objects.append(obj)
+                    elif cls._drop_sort_entry(namespace, sort_name, entry, object_id):
+                        dropped += 1
+
+                # entries following dropped ones fill the page
+                position += len(page) - dropped
+                total -= dropped
+                if not dropped or limit <= 0 or not page:
+                    break
+
+        return objects, total
+
+    @classmethod
+    def _drop_sort_entry(cls, namespace, sort_name, entry, object_id):
+        """Delete sort entry not matching its object, return True if it was deleted.
+
+        Entry of concurrent save can be deleted between its object and entry writes, so
+        the object is read again (bypassing replicas and caches) and the entry is written
+        back when it matches.
+        """
+        db = current_app.db
+        entry_key = cls.get_entry_key(namespace, sort_name, entry)
+        try:
+            db.delete(entry_key, prev_value=object_id)
+        except (KeyNotFound, KeyConflict):
+            return False
+
+        key = '{}{}'.format(cls.get_db_prefix(namespace), object_id)
+        try:
+            node = db.get(key)
+        except KeyNotFound:
+            return True
+
+        obj = cls.deserialize(node.value, projection=cls.get_projection(cls.sort_indexes[sort_name]), namespace=namespace)
+        if obj._sort_values()[sort_name] == entry:
+            db.put(entry_key, object_id)
+            return False
+
+        logger.debug('Deleted stale sort entry {}'.format(entry_key))
+        return True
+
+    @classmethod
+    def list_group(cls, namespace, group_name, value, return_objects=True, fields=None):
+        """List objects with given value of grouping field using group index.
+
+        Only entries of the group are read, so the cost doesn't depend on number of objects
+        in other groups.
+
+        Attributes:
+            group_name (str): Name of group index, see `group_indexes`.
+            value: Value of grouping field, e.g. related object.
+            return_objects (bool): Load objects. Ids (mapped to `None`) of listed entries
+                are returned otherwise, these can include stale entries of interrupted saves.
+            fields (list): Load only given fields, see `list`.
+
+        Returns:
+            dict: Objects (or `None`) mapped by object id.
+        """
+        if group_name not in cls.group_indexes:
+            raise BackendError('Unknown group index {} of {}'.format(group_name, cls.get_model_name()))
+
+        field_name = cls.group_indexes[group_name]
+        group_value = cls._index_value(field_name, value)
+        if group_value is None:
+            return {}
+
+        if fields is not None:
+            fields = list(fields) + [field_name]
+
+        cls._ensure_indexes(namespace)
+        directory = cls.get_group_index_prefix(namespace, group_name, group_value)
+        object_ids = [node.value for node in current_app.db.list_prefix(directory, allow_stale=True)]
+        if not return_objects:
+            return {object_id: None for object_id in object_ids}
+
+        output = {}
+        with IdentityMap.scope():
+            for object_id in object_ids:
+                try:
+                    obj = cls.load(namespace, object_id, fields=fields)
+                except NameError:
+                    continue
+
+                # stale entry of previous value, left in place as in `list_page`
+                if obj._group_value(field_name) != group_value:
+                    continue
+
+                output[object_id] = obj
+
+        return output
+
+    @classmethod
+    def load(cls, namespace, object_id, fields=None):
+        """Load object from database.
+
+        Objects found missing are remembered for a short time, see `MissingKeyCache`.
+
+        Attributes:
+            fields (list): Load only given fields, see `list`.
+        """
+        projection = cls.get_projection(fields) if fields is not None else None
         key = '{}{}'.format(cls.get_db_prefix(namespace), str(object_id))
+        db = current_app.db
+
+        if key in db.missing:
+            raise NameError('Object is not found')
         try:
-            response = current_app.db.client.read(key)
-            value = response.value
-        except etcd.EtcdKeyNotFound:
+            response = db.get(key, allow_stale=True)
+        except KeyNotFound:
+            db.missing.add(key)
             raise NameError('Object is not found')
-        except Exception:
-            raise
 
-        return cls.deserialize(value, key=key, namespace=namespace)
+        return cls.deserialize(
+            response.value,
+            projection=projection,
+            key=key,
+            modified_index=response.modified_index,
+            namespace=namespace,
+        )
+
+    @classmethod
+    def load_related(cls, namespace, object_id):
+        """Load object referenced by relation.
+
+        Objects are shared through currently open `IdentityMap` so every related object is
+        loaded at most once per unit of work.
+        """
+        identity_map = IdentityMap.current()
+        if identity_map is None:
+            return cls.load(namespace, object_id)
+
+        obj = identity_map.get(cls, namespace, object_id)
+        if obj is None:
+            obj = cls.load(namespace, object_id)
+            identity_map.add(obj, namespace)
+
+        return obj
 
     @classmethod
     def exists(cls, namespace, object_id):
-        """Check if object exists."""
-        try:
-            cls.load(namespace, object_id)
-            return True
-        except NameError:
+        """Check if object exists, its value is not read (where backend allows it)."""
+        key = '{}{}'.format(cls.get_db_prefix(namespace), str(object_id))
+        db = current_app.db
+
+        if key in db.missing:
             return False
+        if db.exists(key, allow_stale=True):
+            return True
+
+        db.missing.add(key)
+        return False
 
     @classmethod
     def deserialize(cls, serialized, **kwargs):
-        object_kwargs = {}
-        # Deserialize toplevel dict and loop fields and deserialize them
-        toplevel = json.loads(serialized)
+        """Create object from serialized value.
 
-        for field_name, field in cls.get_fields().items():
-            field_class = field.__class__
+        Parsed values are cached by `key` and `modified_index` (when both are passed)
+        so unchanged objects skip JSON parsing and decryption on next read. Fields are
+        decrypted and deserialized on first access.
+        """
+        serialized_object = cls._parse_serialized(serialized, kwargs.get('key'), kwargs.get('modified_index'))
+
+        return cls._from_serialized(serialized_object, **kwargs)
+
+    @classmethod
+    def _parse_serialized(cls, serialized, key=None, modified_index=None):
+        """Return `SerializedObject` for stored value."""
+        try:
+            cache = current_app.db.cache
+        except (AttributeError, RuntimeError):
+            cache = None
+
+        serialized_object = cache.get(key, modified_index) if cache is not None else None
+        if serialized_object is None:
+            # Deserialize toplevel dict, fields are decrypted on demand
+            toplevel = json.loads(serialized)
+            serialized_object = SerializedObject({
+                field_name: toplevel[field_name]
+                for field_name in cls.get_fields()
+                if toplevel.get(field_name) is not None
+            })
 
-            if hasattr(field_class, 'is_field') and toplevel.get(field_name) is not None:
-                field_object = field_class(**field.__dict__)
-                field_object.decrypt(toplevel[field_name], **kwargs)
+            if cache is not None:
+                cache.set(key, modified_index, serialized_object)
 
-                object_kwargs[field_name] = field_object.get_value()
+        return serialized_object
 
-        o = cls(kwargs.get('namespace'), **object_kwargs)
+    @classmethod
+    def _from_serialized(cls, serialized_object, projection=None, cold=None, **kwargs):
+        """Create object from `SerializedObject`.
+
+        Attributes:
+            cold (dict): Cold field names mapped to `ColdValues` shared by listed objects.
+                Values of single object are read separately when not set.
+        """
+        namespace = kwargs.get('namespace')
+        o = cls.__new__(cls)
+        if cls.is_namespaced():
+            if not namespace:
+                raise BackendError('Missing namespace for class {}'.format(cls.__name__))
+            o._object_namespace = namespace
+        o._projection = projection
+
+        for field_name, name_hidden, field in cls._field_specs:
+            field_object = field.copy()
+            setattr(o, name_hidden, field_object)
+
+            if field_name in serialized_object and (projection is None or field_name in projection):
+                if field.lazy:
+                    # same as `set_serialized`, but keyword arguments are shared by all fields
+                    field_object._pending = (serialized_object, field_name, kwargs)
+                else:
+                    serialized = serialized_object.get(field_name, field)
+                    field_object.deserialize(serialized, **kwargs)
+                    field_object._stored_serialized = serialized
+                continue
+
+            default = field_object._default_value()
+            if default is not None:
+                field_object.set_value(default, namespace=namespace)
+            if not field.cold:
+                field_object._stored_serialized = None
+
+        # values stored with the object before the field became cold are moved by next save
+        for field_name in cls._cold_fields:
+            if field_name in serialized_object or (projection is not None and field_name not in projection):
+                continue
+            if not o.id or (cls.is_namespaced() and not kwargs.get('namespace')):
+                continue
+
+            loader = cold.get(field_name) if cold is not None else None
+            if loader is None:
+                loader = ColdValues(cls.get_cold_prefix(kwargs.get('namespace'), field_name))
+            getattr(o, '_{}'.format(field_name)).set_serialized(loader, str(o.id), **kwargs)
 
         if kwargs.get('key'):
             o._key = kwargs.get('key')
+            o._modified_index = kwargs.get('modified_index')
+        o._indexed = o._index_values()
+        if projection is None:
+            o._sorted = o._sort_values()
 
         return o
 
@@ -531,7 +1953,15 @@ class Model:
     def save(self, validate=True, assign_id=True):
         """Save object to database.
 
-        Hold lock during saving to avoid interruption into unique fields check.
+        Unchanged objects (see `changed_fields`) are not written at all and objects with only
+        cold fields changed write just these fields.
+
+        Saving uses optimistic concurrency instead of locks. Unique values are claimed by
+        atomic creation of index entries and the object itself is written with compare-and-swap
+        on its `modified_index` (or only if missing for new objects). When the object was
+        changed concurrently, validation is repeated against the current state and the write
+        is retried, so the last writer wins as before. Without transactions, claimed entries
+        are checked again after the write, see `_verify_claims`.
 
         Attributes:
             validate (bool): Validate model before saving. Defaults to `True`.
@@ -540,10 +1970,24 @@ class Model:
         Return:
             bool: `True` if model was saved without errors, `False` otherwise.
         """
-        with etcd.Lock(current_app.db.client, 'customer1'):
-            if assign_id:
-                self.verify_id()
+        if self._projection is not None:
+            raise BackendError('Unable to save {}, only some of its fields were loaded'.format(self))
+
+        if assign_id:
+            self.verify_id()
+
+        namespace = self._object_namespace if self.__class__.is_namespaced() else None
 
+        if self._stored_index(self.get_db_key()) is not None:
+            changed = self.changed_fields()
+            if not changed:
+                logger.debug('{} is unchanged, skipping write'.format(self))
+                return True
+            moved = any(getattr(self, '_{}'.format(f)).stored_with_object for f in changed)
+            if set(changed) <= set(self.__class__._cold_fields) and not moved:
+                return self._save_cold(namespace, validate=validate)
+
+        for attempt in range(self.save_retries):
             validation_status, validation_msg = self.validate()
             if validate and not validation_status:
                 raise ValueError('Validation for model failed with: {}'.format(validation_msg))
@@ -551,52 +1995,521 @@ class Model:
             key = self.get_db_key()
             logger.debug('Writing {} to {}'.format(self, key))
 
+            values = self._index_values()
+            sort_values = self._sort_values()
+            claimed = []
             try:
-                current_app.db.client.write(key, self.serialize())
+                if current_app.db.transactions:
+                    response = self._write_transaction(namespace, key, values, sort_values, validate=validate)
+                else:
+                    claimed = self._claim_indexes(namespace, values, validate=validate)
+                    previous = self._read_previous(key, claimed, validate=validate)
+                    response = self._write(key)
+                    if validate:
+                        self._verify_claims(namespace, key, claimed, response, previous)
+                    self._write_sort_entries(namespace, sort_values)
+                    self._write_cold(namespace, key)
+            except (KeyConflict, KeyNotFound):
+                logger.debug('Conflicting write of {}, retrying'.format(key))
+                self._release_indexes(namespace, claimed)
+                self._refresh_index(key)
+                continue
+
+            self._saved(namespace, key, values, sort_values, response)
+            return True
 
-                self._key = key
-                return True
-            except Exception:
-                raise
+        raise BackendError('Unable to save {}, too many conflicting writes'.format(self))
+
+    def _saved(self, namespace, key, values, sort_values, node, delete_sort_entries=True):
+        """Drop index entries of previous values and update state of the written object.
+
+        Attributes:
+            delete_sort_entries (bool): Delete sort entries of previous values, unset when
+                they were deleted by the write.
+        """
+        indexed = getattr(self, '_indexed', {})
+        self._release_indexes(
+            namespace,
+            [(f, v) for f, v in indexed.items() if values.get(f) != v],
+        )
+
+        if delete_sort_entries:
+            sorted_values = getattr(self, '_sorted', {})
+            for sort_name, entry in sorted_values.items():
+                if sort_values.get(sort_name) != entry:
+                    self._delete_sort_entry(namespace, sort_name, entry)
+
+        self._mark_stored()
+
+        self._indexed = values
+        self._sorted = sort_values
+        self._key = key
+        self._modified_index = node.modified_index
+        current_app.db.missing.invalidate(key)
+        self._discard_identity()
+        self.after_change()
+
+    def _save_cold(self, namespace, validate=True):
+        """Write changed cold fields of stored object, which is left as it is."""
+        if validate:
+            validation_status, validation_msg = self.validate(check_unique=False)
+            if not validation_status:
+                raise ValueError('Validation for model failed with: {}'.format(validation_msg))
+
+        self._write_cold(namespace, self.get_db_key())
+        self._mark_stored()
+        self._discard_identity()
+        self.after_change()
+        return True
+
+    def _mark_stored(self):
+        """Remember current values of fields as stored, see `changed_fields`."""
+        for _, name_hidden, _ in self._field_specs:
+            field = getattr(self, name_hidden)
+            if field.stored_with_object:
+                # value was moved to its own key
+                field._materialize()
+            if not field.deferred:
+                field.mark_stored()
+
+    def changed_fields(self):
+        """Return names of fields changed since the object was loaded or saved.
+
+        All fields of new objects are changed. Changes are detected by comparing serialized
+        values, so values modified in place (e.g. dicts of `JSONField`) are detected too.
+        """
+        changed = []
+        for field_name, name_hidden, _ in self._field_specs:
+            field = getattr(self, name_hidden)
+            if field.changed or field.stored_with_object:
+                changed.append(field_name)
+
+        return changed
+
+    @classmethod
+    def save_many(cls, objects, validate=True, assign_id=True):
+        """Save several objects (of any models) with as few storage operations as possible.
+
+        Objects are validated together and unique values are checked with one index read
+        per field, including duplicates within the batch. Unchanged objects are skipped
+        (see `changed_fields`). Backends with transactions write
+        objects in transactions of at most `max_txn_operations` operations, each of them
+        atomic. Other backends write objects one by one with compare-and-swap.
+
+        Objects of transaction (or write) failed due to concurrent change are saved one
+        by one by `save` with the usual retries. `save` overrides of models are not called.
+
+        Attributes:
+            objects (list): Objects to save.
+            validate (bool): Validate objects before saving. Defaults to `True`.
+            assign_id (bool): Assign id (if missing) before saving. Defaults to `True`.
+
+        Return:
+            bool: `True` if all objects were saved.
+        """
+        keys = set()
+        changed = []
+
+        for obj in objects:
+            if obj._projection is not None:
+                raise BackendError('Unable to save {}, only some of its fields were loaded'.format(obj))
+            if assign_id:
+                obj.verify_id()
+            if obj.get_db_key() in keys:
+                raise BackendError('Unable to save {}, object is saved more than once'.format(obj))
+            keys.add(obj.get_db_key())
+            if obj._stored_index(obj.get_db_key()) is not None and not obj.changed_fields():
+                continue
+
+            if validate:
+                validation_status, validation_msg = obj.validate(check_unique=False)
+                if not validation_status:
+                    raise ValueError('Validation for model failed with: {}'.format(validation_msg))
+            changed.append(obj)
+
+        owners = Model._index_owners(changed, validate=validate)
+
+        if current_app.db.transactions:
+            Model._save_transactions(changed, owners, validate=validate)
+        else:
+            for obj in changed:
+                obj._save_claimed(owners, validate=validate)
+
+        return True
+
+    @staticmethod
+    def _index_owners(objects, validate=True):
+        """Return current index entries of unique values claimed by the objects.
+
+        Index directory of every unique field is read once.
+
+        Returns:
+            dict: Index keys mapped to current entry, `None` for missing and `False` for
+                entries skipped because the value is used by other object.
+
+        Raises:
+            ValueError: Value is already used by other object and `validate` is set.
+        """
+        claims = OrderedDict()
+        for obj in objects:
+            obj_class = obj.__class__
+            namespace = obj._object_namespace if obj_class.is_namespaced() else None
+            indexed = getattr(obj, '_indexed', {})
+
+            for field_name, index_value in obj._index_values().items():
+                if indexed.get(field_name) != index_value:
+                    claims.setdefault((obj_class, namespace, field_name), []).append((obj, index_value))
+
+        owners = {}
+        for (obj_class, namespace, field_name), field_claims in claims.items():
+            obj_class._ensure_indexes(namespace)
+            directory = '{}{}/'.format(obj_class.get_index_prefix(namespace), field_name)
+            entries = {node.key: node for node in current_app.db.list_prefix(directory)}
+
+            for obj, index_value in field_claims:
+                index_key = obj_class.get_index_key(namespace, field_name, index_value)
+                node = entries.get(index_key)
+
+                if index_key in owners:
+                    # value used by other object of the batch
+                    taken = True
+                elif node is None or node.value == obj.id:
+                    taken = False
+                else:
+                    taken = obj_class._index_owner_exists(namespace, field_name, index_value, node.value)
+
+                if taken:
+                    if validate:
+                        raise ValueError('Validation for model failed with: Field "{name}" should be unique'.format(
+                            name=field_name))
+                    owners.setdefault(index_key, False)
+                    continue
+
+                owners[index_key] = node
+
+        return owners
+
+    @staticmethod
+    def _save_transactions(objects, owners, validate=True):
+        """Write objects in transactions limited by `max_txn_operations` of the backend."""
+        limit = current_app.db.max_txn_operations
+        batch = []
+        operations = 0
+
+        for obj in objects:
+            namespace = obj._object_namespace if obj.__class__.is_namespaced() else None
+            key = obj.get_db_key()
+            values = obj._index_values()
+            sort_values = obj._sort_values()
+
+            compare, puts, _ = obj._transaction_operations(namespace, key, values, sort_values, owners)
+            deletes = obj._previous_sort_entries(namespace, sort_values)
+            size = max(len(compare), len(puts) + len(deletes))
+
+            if batch and limit and operations + size > limit:
+                Model._write_batch(batch, validate=validate)
+                batch = []
+                operations = 0
+
+            batch.append((obj, namespace, key, values, sort_values, compare, puts, deletes))
+            operations += size
+
+        if batch:
+            Model._write_batch(batch, validate=validate)
+
+    @staticmethod
+    def _write_batch(batch, validate=True):
+        """Write objects prepared by `_save_transactions` in single transaction."""
+        compare = OrderedDict()
+        puts = []
+        deletes = []
+        for _, _, _, _, _, obj_compare, obj_puts, obj_deletes in batch:
+            compare.update(obj_compare)
+            puts.extend(obj_puts)
+            deletes.extend(obj_deletes)
+
+        succeeded, nodes = current_app.db.transaction(compare, puts, deletes=deletes)
+        written = {node.key: node for node in nodes} if succeeded else {}
+
+        for obj, namespace, key, values, sort_values, _, _, _ in batch:
+            if succeeded:
+                obj._saved(namespace, key, values, sort_values, written[key], delete_sort_entries=False)
+            else:
+                logger.debug('Conflicting write of {}, saving objects one by one'.format(key))
+                Model.save(obj, validate=validate, assign_id=False)
+
+    def _save_claimed(self, owners, validate=True):
+        """Write object with unique values checked by `_index_owners`, without transactions."""
+        namespace = self._object_namespace if self.__class__.is_namespaced() else None
+        key = self.get_db_key()
+        values = self._index_values()
+        sort_values = self._sort_values()
+        claimed = []
+
+        try:
+            for field_name, index_value in values.items():
+                if getattr(self, '_indexed', {}).get(field_name) == index_value:
+                    continue
+
+                index_key = self.__class__.get_index_key(namespace, field_name, index_value)
+                owner = owners.get(index_key)
+                if owner is False:
+                    continue
+                if owner is None:
+                    current_app.db.cas(index_key, self.id, prev_exist=False)
+                elif owner.value == self.id:
+                    continue
+                elif not self._take_over_index(namespace, field_name, index_value, owner):
+                    if validate:
+                        raise ValueError('Validation for model failed with: Field "{name}" should be unique'.format(
+                            name=field_name))
+                    continue
+                claimed.append((field_name, index_value))
+
+            previous = self._read_previous(key, claimed, validate=validate)
+            response = self._write(key)
+        except (KeyConflict, KeyNotFound):
+            logger.debug('Conflicting write of {}, retrying'.format(key))
+            self._release_indexes(namespace, claimed)
+            return Model.save(self, validate=validate, assign_id=False)
+        except ValueError:
+            self._release_indexes(namespace, claimed)
+            raise
+
+        if validate:
+            self._verify_claims(namespace, key, claimed, response, previous)
+
+        self._write_sort_entries(namespace, sort_values)
+        self._write_cold(namespace, key)
+
+        self._saved(namespace, key, values, sort_values, response)
+        return True
+
+    def _previous_sort_entries(self, namespace, sort_values):
+        """Return keys of sort entries of previous values."""
+        return [
+            self.__class__.get_entry_key(namespace, sort_name, entry)
+            for sort_name, entry in getattr(self, '_sorted', {}).items()
+            if sort_values.get(sort_name) != entry
+        ]
+
+    def _write(self, key):
+        """Write serialized object with compare-and-swap."""
+        if getattr(self, '_key', None) == key and getattr(self, '_modified_index', None):
+            return current_app.db.cas(key, self.serialize(), prev_index=self._modified_index)
+
+        return current_app.db.cas(key, self.serialize(), prev_exist=False)
+
+    def _cold_puts(self, namespace, key):
+        """Return `(key, value)` pairs of changed cold fields, see `Field.changed`.
+
+        Empty values of new objects are not written at all.
+        """
+        new = self._stored_index(key) is None
+        puts = []
+
+        for field_name in self.__class__._cold_fields:
+            field = getattr(self, '_{}'.format(field_name))
+            if field.cold_deferred:
+                continue
+
+            # value still stored with the object is moved even when it wasn't accessed
+            if not field.deferred and (not field.changed or (new and field.empty())):
+                continue
+
+            cold_key = '{}{}'.format(self.__class__.get_cold_prefix(namespace, field_name), self.id)
+            puts.append((cold_key, json.dumps(field.encrypt())))
+
+        return puts
+
+    def _write_cold(self, namespace, key):
+        """Write changed cold fields after the object, used by backends without transactions.
+
+        Object was already written, so concurrent writes of the same cold field are not
+        detected and the last writer wins.
+        """
+        for cold_key, value in self._cold_puts(namespace, key):
+            current_app.db.put(cold_key, value)
+
+    def _write_transaction(self, namespace, key, values, sort_values, validate=True):
+        """Write object together with its new index entries in single transaction.
+
+        Used by backends with multi-key transactions. Transaction compares `modified_index`
+        of the object and checks index entries of unique values don't exist. When some entry
+        exists, its owner is checked and the transaction is repeated with the entry compared
+        by `modified_index` (stale entry or entry of this object) or without the entry (value
+        used by other object and `validate` is not set).
+
+        Raises:
+            ValueError: Value is already used by other object and `validate` is set.
+            KeyConflict: Object or index entry changed concurrently.
+        """
+        modified_index = self._stored_index(key)
+
+        # index key mapped to its current entry, `False` for skipped entries
+        owners = {}
+
+        for attempt in range(2):
+            compare, puts, claims = self._transaction_operations(namespace, key, values, sort_values, owners)
+            succeeded, nodes = current_app.db.transaction(compare, puts, reads=list(compare))
+            if succeeded:
+                return nodes[0]
+
+            stored = nodes[0]
+            if (stored is None) != (not modified_index) or (stored and stored.modified_index != modified_index):
+                raise KeyConflict('Object {} was changed concurrently'.format(key))
+
+            for (field_name, index_value, index_key), node in zip(claims, nodes[1:]):
+                if node is None:
+                    owners.pop(index_key, None)
+                elif node.value == self.id:
+                    owners[index_key] = node
+                elif self.__class__._index_owner_exists(namespace, field_name, index_value, node.value):
+                    if validate:
+                        raise ValueError('Validation for model failed with: Field "{name}" should be unique'.format(
+                            name=field_name))
+                    owners[index_key] = False
+                else:
+                    owners[index_key] = node
+
+        raise KeyConflict('Index entries of {} were changed concurrently'.format(key))
+
+    def _stored_index(self, key):
+        """Return `modified_index` of the stored object, None for new objects."""
+        if getattr(self, '_key', None) == key:
+            return getattr(self, '_modified_index', None) or None
+
+    def _transaction_operations(self, namespace, key, values, sort_values, owners):
+        """Return comparisons and writes of transaction saving the object.
+
+        Attributes:
+            owners (dict): Index keys mapped to their current entry, `False` for skipped
+                entries. Index keys missing in `owners` must not exist.
+
+        Returns:
+            tuple: Compared keys (see `StorageBackend.transaction`), `(key, value)` pairs
+                to write and claimed index entries as `(field_name, index_value, index_key)`.
+        """
+        indexed = getattr(self, '_indexed', {})
+        sorted_values = getattr(self, '_sorted', {})
+
+        compare = OrderedDict([(key, self._stored_index(key))])
+        puts = [(key, self.serialize())]
+        claims = []
+
+        for field_name, index_value in values.items():
+            if indexed.get(field_name) == index_value:
+                continue
+
+            index_key = self.__class__.get_index_key(namespace, field_name, index_value)
+            owner = owners.get(index_key)
+            if owner is False:
+                continue
+
+            compare[index_key] = owner.modified_index if owner is not None else None
+            puts.append((index_key, self.id))
+            claims.append((field_name, index_value, index_key))
+
+        for sort_name, entry in sort_values.items():
+            if sorted_values.get(sort_name) != entry:
+                sort_key = self.__class__.get_entry_key(namespace, sort_name, entry)
+                puts.append((sort_key, self.id))
+
+        puts.extend(self._cold_puts(namespace, key))
+
+        return compare, puts, claims
+
+    def _refresh_index(self, key):
+        """Read current `modified_index` of the stored object before retrying write."""
+        try:
+            self._modified_index = current_app.db.get(key).modified_index
+            self._key = key
+        except KeyNotFound:
+            self._modified_index = None
 
     def delete(self):
         """Delete the object."""
-        current_app.db.client.delete(self.get_db_key())
+        key = self.get_db_key()
+        current_app.db.delete(key)
 
-    def validate(self):
+        namespace = self._object_namespace if self.__class__.is_namespaced() else None
+        for field_name, index_value in self._index_values().items():
+            self._delete_index(namespace, field_name, index_value)
+        for sort_name, entry in self._sort_values().items():
+            self._delete_sort_entry(namespace, sort_name, entry)
+        for field_name in self.__class__._cold_fields:
+            try:
+                current_app.db.delete('{}{}'.format(self.__class__.get_cold_prefix(namespace, field_name), self.id))
+            except KeyNotFound:
+                pass
+
+        current_app.db.cache.invalidate(key)
+        self._discard_identity()
+        self.after_change()
+
+    def after_change(self):
+        """Called after the object was written or deleted by this process, including `save_many`.
+
+        Models override it to drop their copies kept outside of storage.
+        """
+        pass
+
+    def _discard_identity(self):
+        """Drop other copies of this object from currently open identity map."""
+        identity_map = IdentityMap.current()
+        if identity_map is not None:
+            namespace = self._object_namespace if self.__class__.is_namespaced() else None
+            if identity_map.get(self.__class__, namespace, self.id) is not self:
+                identity_map.discard(self.__class__, namespace, self.id)
+
+    def validate(self, check_unique=True):
         """Validate the model object passes all requirements.
 
         Checks:
             * Required fields
+            * Unique fields, unless `check_unique` is unset
 
         Returns:
             Validation result. `True` for passed, `False` for failed.
         """
-        fields = self.__class__.get_field_names()
-        for field in fields:
-            hidden_field = '_{}'.format(field)
+        for field, hidden_field, _ in self._field_specs:
             field_object = getattr(self, hidden_field)
 
             # Validation
             # TODO: move to validate method of Field
-            if field_object.required and field_object.value is None:
+            if field_object.required and field_object.empty():
                 return False, 'Required field {} is None'.format(field)
 
-            if field_object.unique and field_object.value:
-                namespace = self._object_namespace if self.is_namespaced() else self.namespace
+            if check_unique and field_object.unique and field_object.value and not self._is_unique(field):
+                return False, 'Field "{name}" should be unique'.format(name=field)
 
-                for k, v in self.list(namespace).items():
-                    # Skip checking for uniqueness on object update
-                    if getattr(v, 'id') == self.id:
-                        continue
-                    if getattr(v, field) == field_object.value:
-                        return False, 'Field "{name}" should be unique'.format(name=field)
+            # stored values were validated before saving
+            if field_object.deferred:
+                continue
 
             if field_object.value and not field_object.validate():
                 return False, 'Field {} validation failed'.format(field)
 
         return True, None
 
+    def _is_unique(self, field_name):
+        """Check value of the field is not used by other object, using index."""
+        namespace = self._object_namespace if self.is_namespaced() else None
+        value = getattr(self, field_name)
+
+        object_id = self.__class__.lookup_id(namespace, field_name, value)
+        # Skip checking for uniqueness on object update
+        if object_id is None or object_id == str(self.id):
+            return True
+
+        # index entry can be stale after interrupted save
+        try:
+            self.__class__.load_by(namespace, field_name, value)
+        except NameError:
+            return True
+
+        return False
+
     def _expand(self, obj):
         expanded = obj.get_dict()
         for key, value in expanded.items():
@@ -604,21 +2517,28 @@ class Model:
                 expanded[key] = self._expand(value)
         return expanded
 
-    def get_dict(self, expand=False):
+    def get_dict(self, expand=False, fields=None):
         """Return object properties represented by dict.
 
         Attributes:
             expand (bool): Expand properties to dict (if possible).
+            fields (list): Return only given fields, see `get_projection`. Related objects
+                are limited to selected fields too.
 
         Returns:
             Dict with object properties
         """
         output = {}
+        projection = self.__class__.get_projection(fields) if fields is not None else None
 
-        for field_name in self.__class__.get_field_names():
-            field = getattr(self, '_{}'.format(field_name))
+        for field_name, name_hidden, _ in self._field_specs:
+            if projection is not None and field_name not in projection:
+                continue
+            field = getattr(self, name_hidden)
 
-            if expand and hasattr(field.value, 'get_dict'):
+            if projection is not None and projection[field_name] is not None:
+                wr = field.value.get_dict(fields=projection[field_name]) if field.value else None
+            elif expand and hasattr(field.value, 'get_dict'):
                 wr = self._expand(field.value)
             elif hasattr(field, 'dict_value'):
                 wr = field.dict_value()
@@ -631,11 +2551,16 @@ class Model:
         return output
 
     def serialize(self):
+        """Return JSON with values of all fields except cold ones, see `_cold_puts`."""
         serdict = {}
-        for attr_name, attr in self.get_dict().items():
-            value = getattr(self, '_{}'.format(attr_name)).encrypt()
+        for field_name, name_hidden, _ in self._field_specs:
+            field = getattr(self, name_hidden)
+            if field.cold or field.empty():
+                continue
+
+            value = field.encrypt()
             if value is not None:
-                serdict[attr_name] = value
+                serdict[field_name] = value
 
         return json.dumps(serdict)
 
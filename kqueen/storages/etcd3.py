@@ -0,0 +1,416 @@
+from .base import StorageEvent
+from .base import StorageNode
+from .etcd import EtcdBackend
+from .exceptions import KeyNotFound
+from requests.packages.urllib3.exceptions import ReadTimeoutError
+
+import base64
+import etcd
+import json
+import logging
+import requests
+
+logger = logging.getLogger('kqueen_api')
+
+
+def _encode(value):
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    return base64.b64encode(value).decode('ascii')
+
+
+def _decode(value):
+    return base64.b64decode(value).decode('utf-8')
+
+
+def prefix_end(prefix):
+    """Return end of the key range containing all keys starting with `prefix`."""
+    end = bytearray(prefix.encode('utf-8'))
+    while end:
+        if end[-1] < 0xff:
+            end[-1] += 1
+            return bytes(end)
+        end.pop()
+
+    # all keys
+    return b'\0'
+
+
+class Etcd3Client:
+    """Client of etcd v3 API served by gRPC gateway over HTTP.
+
+    Besides v3 operations (`range`, `txn`, `watch`) the client implements the part of python-etcd
+    client interface used by models (`read`, `get`, `write`, `delete`). Directories of
+    v2 API are emulated by key prefixes and `modifiedIndex` of results is v3 `mod_revision`.
+
+    Args:
+        host (str): etcd host.
+        port (int): etcd client port.
+        protocol (str): `http` or `https`.
+        api_prefix (str): URL prefix of the gateway, `/v3beta` for etcd 3.3.
+        read_timeout (float): Timeout of requests in seconds.
+    """
+
+    def __init__(self, host='localhost', port=4001, protocol='http', api_prefix='/v3', read_timeout=60):
+        self.host = host
+        self.port = port
+        self.base_url = '{}://{}:{}{}'.format(protocol, host, port, api_prefix)
+        self.read_timeout = read_timeout
+        self.session = requests.Session()
+
+    def _call(self, method, data):
+        try:
+            response = self.session.post(
+                '{}/{}'.format(self.base_url, method),
+                json=data,
+                timeout=self.read_timeout,
+            )
+        except requests.RequestException as e:
+            raise etcd.EtcdConnectionFailed('Connection to etcd failed due to {}'.format(repr(e)), cause=e)
+
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = {}
+
+        if response.status_code != 200:
+            raise etcd.EtcdException(
+                payload.get('message') or payload.get('error') or response.text,
+                payload,
+            )
+
+        return payload
+
+    @staticmethod
+    def _node(kv):
+        return {
+            'key': _decode(kv['key']),
+            'value': _decode(kv['value']) if 'value' in kv else None,
+            'modifiedIndex': int(kv.get('mod_revision', 0)),
+            'createdIndex': int(kv.get('create_revision', 0)),
+        }
+
+    @staticmethod
+    def revision(response):
+        """Return store revision from response header."""
+        return int(response.get('header', {}).get('revision', 0))
+
+    def range(self, key, range_end=None, limit=0, descending=False, keys_only=False):
+        """Read keys in range.
+
+        Attributes:
+            key (str): First key of range or the key.
+            range_end (bytes): End of range (exclusive), see `prefix_end`. Only `key` is read
+                if not set.
+            limit (int): Maximal number of returned keys, `0` for no limit.
+            descending (bool): Return keys in descending order.
+            keys_only (bool): Don't return values.
+
+        Returns:
+            tuple: List of nodes (dicts with `key`, `value` and `modifiedIndex`) ordered by key
+                and total number of keys in range.
+        """
+        data = {'key': _encode(key)}
+        if range_end is not None:
+            data['range_end'] = _encode(range_end)
+        if limit:
+            data['limit'] = limit
+        if descending:
+            data['sort_order'] = 'DESCEND'
+            data['sort_target'] = 'KEY'
+        if keys_only:
+            data['keys_only'] = True
+
+        response = self._call('kv/range', data)
+        return [self._node(kv) for kv in response.get('kvs', [])], int(response.get('count', 0))
+
+    def txn(self, compare, success, failure=None):
+        """Run transaction.
+
+        Returns:
+            tuple: `True` if comparisons succeeded and the response.
+        """
+        response = self._call('kv/txn', {
+            'compare': compare,
+            'success': success,
+            'failure': failure or [],
+        })
+        return bool(response.get('succeeded', False)), response
+
+    @staticmethod
+    def compare_missing(key):
+        return {'key': _encode(key), 'target': 'CREATE', 'result': 'EQUAL', 'create_revision': 0}
+
+    @staticmethod
+    def compare_modified(key, modified_index):
+        return {'key': _encode(key), 'target': 'MOD', 'result': 'EQUAL', 'mod_revision': modified_index}
+
+    @staticmethod
+    def compare_value(key, value):
+        return {'key': _encode(key), 'target': 'VALUE', 'result': 'EQUAL', 'value': _encode(str(value))}
+
+    @staticmethod
+    def put_operation(key, value):
+        return {'request_put': {'key': _encode(key), 'value': _encode(str(value))}}
+
+    @staticmethod
+    def delete_operation(key, range_end=None):
+        operation = {'key': _encode(key)}
+        if range_end is not None:
+            operation['range_end'] = _encode(range_end)
+        return {'request_delete_range': operation}
+
+    @staticmethod
+    def range_operation(key):
+        return {'request_range': {'key': _encode(key)}}
+
+    @classmethod
+    def range_results(cls, response):
+        """Return node (or `None`) read by each range operation of transaction."""
+        nodes = []
+        for result in response.get('responses', []):
+            if 'response_range' in result:
+                kvs = result['response_range'].get('kvs', [])
+                nodes.append(cls._node(kvs[0]) if kvs else None)
+
+        return nodes
+
+    def watch(self, key, range_end=None, start_revision=None, timeout=None):
+        """Wait for first change of keys in range.
+
+        Attributes:
+            start_revision (int): Return first change since this revision, next change
+                if not set.
+            timeout (float): Maximal time to wait in seconds, wait forever if not set.
+
+        Returns:
+            tuple: Event type (`PUT` or `DELETE`) and changed node, None on timeout.
+        """
+        request = {'key': _encode(key)}
+        if range_end is not None:
+            request['range_end'] = _encode(range_end)
+        if start_revision:
+            request['start_revision'] = start_revision
+
+        try:
+            response = self.session.post(
+                '{}/watch'.format(self.base_url),
+                json={'create_request': request},
+                stream=True,
+                timeout=(self.read_timeout, timeout),
+            )
+        except requests.exceptions.ReadTimeout:
+            return None
+        except requests.RequestException as e:
+            raise etcd.EtcdConnectionFailed('Connection to etcd failed due to {}'.format(repr(e)), cause=e)
+
+        try:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+
+                payload = json.loads(line.decode('utf-8'))
+                if 'error' in payload:
+                    raise etcd.EtcdException(payload['error'].get('message'), payload)
+
+                result = payload.get('result', {})
+                if int(result.get('compact_revision', 0)):
+                    raise etcd.EtcdEventIndexCleared('Revision {} was compacted'.format(start_revision), payload)
+                events = result.get('events')
+                if events:
+                    return events[0].get('type', 'PUT'), self._node(events[0]['kv'])
+        except requests.exceptions.ConnectionError as e:
+            if e.args and isinstance(e.args[0], ReadTimeoutError):
+                return None
+            raise etcd.EtcdConnectionFailed('Connection to etcd failed due to {}'.format(repr(e)), cause=e)
+        finally:
+            response.close()
+
+    def _directory(self, key, nodes, recursive):
+        """Build v2 directory node from nodes under `key`."""
+        children = []
+        subdirectories = {}
+
+        for node in nodes:
+            name = node['key'][len(key) + 1:]
+            if '/' not in name:
+                children.append(node)
+            else:
+                subdirectories.setdefault(name.split('/')[0], []).append(node)
+
+        for name, subnodes in sorted(subdirectories.items()):
+            subkey = '{}/{}'.format(key, name)
+            if recursive:
+                children.append(self._directory(subkey, subnodes, recursive))
+            else:
+                children.append({'key': subkey, 'dir': True})
+
+        return {'key': key, 'dir': True, 'nodes': children}
+
+    def _compare_kwargs(self, key, prevExist=None, prevIndex=None, prevValue=None):
+        compare = []
+        if prevExist is False:
+            compare.append(self.compare_missing(key))
+        elif prevExist:
+            compare.append({'key': _encode(key), 'target': 'VERSION', 'result': 'GREATER', 'version': 0})
+        if prevIndex:
+            compare.append(self.compare_modified(key, prevIndex))
+        if prevValue is not None:
+            compare.append(self.compare_value(key, prevValue))
+
+        return compare
+
+    def _raise_failed(self, key, response, prevExist=None):
+        """Raise v2 exception for failed conditional operation."""
+        current = self.range_results(response)[0]
+        if current is None:
+            raise etcd.EtcdKeyNotFound('Key not found : {}'.format(key))
+        if prevExist is False:
+            raise etcd.EtcdAlreadyExist('Key already exists : {}'.format(key))
+        raise etcd.EtcdCompareFailed('Compare failed : {}'.format(key))
+
+    def read(self, key, recursive=False, **kwargs):
+        """Read key or directory (all keys with prefix `key/`)."""
+        nodes, _ = self.range(key)
+        if nodes:
+            return etcd.EtcdResult('get', nodes[0])
+
+        directory = key.rstrip('/')
+        nodes, _ = self.range('{}/'.format(directory), prefix_end('{}/'.format(directory)))
+        if not nodes:
+            raise etcd.EtcdKeyNotFound('Key not found : {}'.format(key))
+
+        return etcd.EtcdResult('get', self._directory(directory, nodes, recursive))
+
+    def get(self, key):
+        return self.read(key)
+
+    def write(self, key, value, prevExist=None, prevIndex=None, prevValue=None, **kwargs):
+        """Write value, optionally with v2 conditions."""
+        value = str(value)
+        compare = self._compare_kwargs(key, prevExist=prevExist, prevIndex=prevIndex, prevValue=prevValue)
+
+        if compare:
+            succeeded, response = self.txn(compare, [self.put_operation(key, value)], [self.range_operation(key)])
+            if not succeeded:
+                self._raise_failed(key, response, prevExist=prevExist)
+        else:
+            response = self._call('kv/put', {'key': _encode(key), 'value': _encode(value)})
+
+        return etcd.EtcdResult('set', {'key': key, 'value': value, 'modifiedIndex': self.revision(response)})
+
+    def delete(self, key, recursive=False, prevIndex=None, prevValue=None, **kwargs):
+        """Delete key or with `recursive` whole directory."""
+        operations = [self.delete_operation(key)]
+        if recursive:
+            directory = '{}/'.format(key.rstrip('/'))
+            operations.append(self.delete_operation(directory, prefix_end(directory)))
+
+        compare = self._compare_kwargs(key, prevIndex=prevIndex, prevValue=prevValue)
+        succeeded, response = self.txn(compare, operations, [self.range_operation(key)])
+        if not succeeded:
+            self._raise_failed(key, response)
+
+        deleted = sum(
+            int(result['response_delete_range'].get('deleted', 0))
+            for result in response.get('responses', [])
+            if 'response_delete_range' in result
+        )
+        if not deleted:
+            raise etcd.EtcdKeyNotFound('Key not found : {}'.format(key))
+
+        return etcd.EtcdResult('delete', {'key': key, 'modifiedIndex': self.revision(response)})
+
+
+class Etcd3Backend(EtcdBackend):
+    """Storage backend using etcd v3 API.
+
+    Objects are saved together with index entries in single transaction, pages of sort
+    indexes are read by range with limit and index entries are written in batches.
+    """
+    transactions = True
+
+    # etcd limits number of operations in one transaction (--max-txn-ops)
+    max_txn_operations = 128
+
+    def create_client(self, config):
+        return Etcd3Client(
+            host=config.get('ETCD_HOST', 'localhost'),
+            port=int(config.get('ETCD_PORT', 4001)),
+            api_prefix=config.get('ETCD_API_PREFIX', '/v3'),
+        )
+
+    def create_replica(self, config):
+        logger.warning('ETCD_REPLICA is not supported with etcd v3 storage backend')
+
+    @staticmethod
+    def _storage_node(node):
+        return StorageNode(node['key'], node['value'], node['modifiedIndex'])
+
+    def get(self, key, allow_stale=False):
+        # single range request, directory emulation of client.read is not needed for values
+        with self._translate_errors(key):
+            nodes, _ = self.client.range(key)
+        if not nodes:
+            raise KeyNotFound('Key {} not found'.format(key))
+
+        return self._storage_node(nodes[0])
+
+    def exists(self, key, allow_stale=False):
+        with self._translate_errors(key):
+            nodes, _ = self.client.range(key, keys_only=True)
+
+        return bool(nodes)
+
+    def list_prefix(self, prefix, allow_stale=False):
+        with self._translate_errors(prefix):
+            nodes, _ = self.client.range(prefix, prefix_end(prefix))
+
+        return [self._storage_node(node) for node in nodes if '/' not in node['key'][len(prefix):]]
+
+    def transaction(self, compare, puts, reads=(), deletes=()):
+        client = self.client
+        conditions = [
+            client.compare_missing(key) if modified_index is None else client.compare_modified(key, modified_index)
+            for key, modified_index in compare.items()
+        ]
+
+        operations = [client.put_operation(key, value) for key, value in puts]
+        operations.extend(client.delete_operation(key) for key in deletes)
+
+        with self._translate_errors(', '.join(compare)):
+            succeeded, response = client.txn(conditions, operations, [client.range_operation(key) for key in reads])
+
+        if succeeded:
+            revision = client.revision(response)
+            return True, [StorageNode(key, str(value), revision) for key, value in puts]
+
+        return False, [self._storage_node(node) if node else None for node in client.range_results(response)]
+
+    def watch(self, prefix, index=None, timeout=None):
+        with self._translate_errors(prefix):
+            result = self.client.watch(prefix, prefix_end(prefix), start_revision=index, timeout=timeout)
+        if result is None:
+            return None
+
+        event_type, node = result
+        return StorageEvent('delete' if event_type == 'DELETE' else 'set', self._storage_node(node))
+
+    def list_sorted(self, directory, offset=0, limit=0, reverse=False):
+        with self._translate_errors(directory):
+            nodes, total = self.client.range(
+                directory,
+                prefix_end(directory),
+                limit=offset + limit if limit > 0 else 0,
+                descending=reverse,
+            )
+
+        entries = [(node['key'].replace(directory, ''), node['value']) for node in nodes[offset:]]
+        return entries, total
+
+    def write_many(self, items):
+        items = list(items)
+        for start in range(0, len(items), self.max_txn_operations):
+            chunk = items[start:start + self.max_txn_operations]
+            with self._translate_errors(chunk[0][0]):
+                self.client.txn([], [self.client.put_operation(key, value) for key, value in chunk])
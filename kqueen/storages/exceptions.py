@@ -4,3 +4,15 @@ class BackendError(Exception):
 
 class FieldError(Exception):
     pass
+
+
+class KeyNotFound(BackendError):
+    pass
+
+
+class KeyConflict(BackendError):
+    pass
+
+
+class WatchExpired(BackendError):
+    pass
@@ -0,0 +1,178 @@
+from .base import StorageBackend
+from .base import StorageEvent
+from .base import StorageNode
+from .exceptions import KeyConflict
+from .exceptions import KeyNotFound
+from .exceptions import WatchExpired
+from collections import deque
+
+import bisect
+import threading
+import time
+
+
+class MemoryStore:
+    """Keys, values and recent changes of `MemoryBackend`.
+
+    Args:
+        history_size (int): Number of changes kept for watches.
+    """
+
+    def __init__(self, history_size=1000):
+        self.nodes = {}
+        self.keys = []
+        self.index = 0
+        self.events = deque(maxlen=history_size)
+        self.cleared_index = 0
+        self.condition = threading.Condition()
+
+
+class MemoryBackend(StorageBackend):
+    """Thread-safe storage backend keeping data in process memory.
+
+    Intended for tests and development, data are lost with the process. Backends share
+    one store per process (unless `store` is passed), so applications created during
+    request handling see the same data.
+
+    Args:
+        store (MemoryStore): Store used instead of the shared one.
+    """
+    transactions = True
+
+    shared_store = MemoryStore()
+
+    def __init__(self, store=None, **kwargs):
+        super().__init__(**kwargs)
+        self.store = store if store is not None else self.shared_store
+
+    def _set(self, key, value):
+        """Write value, must be called with store condition held."""
+        store = self.store
+        if key not in store.nodes:
+            bisect.insort(store.keys, key)
+
+        store.index += 1
+        node = StorageNode(key, str(value), store.index)
+        store.nodes[key] = node
+        self._record('set', node)
+        return node
+
+    def _remove(self, key):
+        """Delete key, must be called with store condition held."""
+        store = self.store
+        del store.nodes[key]
+        del store.keys[bisect.bisect_left(store.keys, key)]
+
+        store.index += 1
+        self._record('delete', StorageNode(key, None, store.index))
+        return store.index
+
+    def _record(self, action, node):
+        store = self.store
+        if len(store.events) == store.events.maxlen:
+            store.cleared_index = store.events[0].node.modified_index
+        store.events.append(StorageEvent(action, node))
+        store.condition.notify_all()
+
+    def _keys_with_prefix(self, prefix):
+        keys = self.store.keys
+        start = bisect.bisect_left(keys, prefix)
+        end = start
+        while end < len(keys) and keys[end].startswith(prefix):
+            end += 1
+
+        return keys[start:end]
+
+    def get(self, key, allow_stale=False):
+        with self.store.condition:
+            node = self.store.nodes.get(key)
+        if node is None:
+            raise KeyNotFound('Key {} not found'.format(key))
+
+        return node
+
+    def exists(self, key, allow_stale=False):
+        with self.store.condition:
+            return key in self.store.nodes
+
+    def list_prefix(self, prefix, allow_stale=False):
+        with self.store.condition:
+            return [
+                self.store.nodes[key]
+                for key in self._keys_with_prefix(prefix)
+                if '/' not in key[len(prefix):]
+            ]
+
+    def put(self, key, value):
+        with self.store.condition:
+            return self._set(key, value)
+
+    def cas(self, key, value, prev_index=None, prev_exist=None):
+        with self.store.condition:
+            current = self.store.nodes.get(key)
+            if prev_exist is not None and prev_exist != (current is not None):
+                raise KeyConflict('Key {} was changed concurrently'.format(key))
+            if prev_index is not None and (current is None or current.modified_index != prev_index):
+                raise KeyConflict('Key {} was changed concurrently'.format(key))
+
+            return self._set(key, value)
+
+    def delete(self, key, prev_value=None, recursive=False):
+        with self.store.condition:
+            current = self.store.nodes.get(key)
+            if prev_value is not None and current is not None and current.value != str(prev_value):
+                raise KeyConflict('Key {} was changed concurrently'.format(key))
+
+            keys = [key] if current is not None else []
+            if recursive:
+                keys.extend(self._keys_with_prefix('{}/'.format(key.rstrip('/'))))
+            if not keys:
+                raise KeyNotFound('Key {} not found'.format(key))
+
+            return max(self._remove(k) for k in keys)
+
+    def watch(self, prefix, index=None, timeout=None):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        store = self.store
+
+        with store.condition:
+            if index is None:
+                index = store.index + 1
+            if index <= store.cleared_index:
+                raise WatchExpired('Changes of {} since {} are not available'.format(prefix, index))
+
+            while True:
+                for event in store.events:
+                    if event.node.modified_index >= index and event.node.key.startswith(prefix):
+                        return event
+
+                # skip checked events on next wake up
+                index = max(index, store.index + 1)
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return None
+                store.condition.wait(remaining)
+
+    def transaction(self, compare, puts, reads=(), deletes=()):
+        with self.store.condition:
+            nodes = self.store.nodes
+            for key, modified_index in compare.items():
+                current = nodes.get(key)
+                if (current.modified_index if current is not None else None) != modified_index:
+                    return False, [nodes.get(read) for read in reads]
+
+            written = [self._set(key, value) for key, value in puts]
+            for key in deletes:
+                if key in nodes:
+                    self._remove(key)
+
+            return True, written
+
+    def list_sorted(self, directory, offset=0, limit=0, reverse=False):
+        with self.store.condition:
+            keys = [k for k in self._keys_with_prefix(directory) if '/' not in k[len(directory):]]
+            if reverse:
+                keys.reverse()
+
+            page = keys[offset:offset + limit] if limit > 0 else keys[offset:]
+            return [(key[len(directory):], self.store.nodes[key].value) for key in page], len(keys)
@@ -0,0 +1,142 @@
+"""Rewrite encrypted field values by current encryption key and format.
+
+Stored values are rewritten one key at a time by compare-and-swap of the stored
+value, so the command can run while the application is serving requests. Objects
+changed concurrently are read again and only their stale values are rewritten.
+
+Example:
+    $ KQUEEN_CONFIG_FILE=config/prod.py kqueen-reencrypt --workers 8
+"""
+
+from .exceptions import KeyConflict
+from .exceptions import KeyNotFound
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+
+import argparse
+import json
+import logging
+
+logger = logging.getLogger('kqueen_api')
+
+# Attempts to rewrite one key changed concurrently by the application
+MAX_ATTEMPTS = 10
+
+
+def reencrypt_stored(field, stored):
+    """Return stored value encrypted by current key, None when it is current already."""
+    if stored is None or field.stored_is_current(stored):
+        return None
+
+    return field.encrypt_serialized(field.decrypt_serialized(stored))
+
+
+def _reencrypt_object(model_class, value):
+    toplevel = json.loads(value)
+    changed = False
+
+    for field_name, field in model_class.get_fields().items():
+        reencrypted = reencrypt_stored(field, toplevel.get(field_name))
+        if reencrypted is not None:
+            toplevel[field_name] = reencrypted
+            changed = True
+
+    return json.dumps(toplevel) if changed else None
+
+
+def _reencrypt_cold(field, value):
+    reencrypted = reencrypt_stored(field, json.loads(value))
+    return json.dumps(reencrypted) if reencrypted is not None else None
+
+
+def _rewrite(app, node, reencrypt):
+    """Rewrite single node, return `rewritten`, `current` or `missing`."""
+    with app.app_context():
+        db = current_app.db
+
+        for _ in range(MAX_ATTEMPTS):
+            value = reencrypt(node.value)
+            if value is None:
+                return 'current'
+
+            try:
+                db.cas(node.key, value, prev_index=node.modified_index)
+                return 'rewritten'
+            except KeyConflict:
+                try:
+                    node = db.get(node.key)
+                except KeyNotFound:
+                    return 'missing'
+
+        raise KeyConflict('Key {} was changed concurrently {} times'.format(node.key, MAX_ATTEMPTS))
+
+
+def _directories(model_class, namespaces):
+    """Yield directories of model objects and cold values with their rewrite functions."""
+    for namespace in namespaces if model_class.is_namespaced() else [None]:
+        yield model_class.get_db_prefix(namespace), lambda value: _reencrypt_object(model_class, value)
+
+        for field_name in model_class._cold_fields:
+            field = model_class.get_fields()[field_name]
+            yield (
+                model_class.get_cold_prefix(namespace, field_name),
+                lambda value, field=field: _reencrypt_cold(field, value),
+            )
+
+
+def reencrypt(models=None, namespaces=None, workers=4):
+    """Rewrite encrypted values of all objects by current encryption key.
+
+    Directories are read one by one, so only one directory is held in memory, and its keys
+    are rewritten by `workers` threads. Must be called within application context.
+
+    Attributes:
+        models (list): Model classes, all models of `kqueen.models` by default.
+        namespaces (list): Namespaces of namespaced models, namespaces of all organizations
+            by default.
+        workers (int): Number of threads rewriting the keys.
+
+    Returns:
+        Counter: Number of keys by result, `rewritten`, `current` or `missing`.
+    """
+    from kqueen.models import Cluster
+    from kqueen.models import Organization
+    from kqueen.models import Provisioner
+    from kqueen.models import User
+
+    if models is None:
+        models = [Organization, User, Provisioner, Cluster]
+
+    app = current_app._get_current_object()
+    if namespaces is None:
+        namespaces = sorted({o.namespace for o in Organization.list(None).values() if o.namespace})
+
+    counts = Counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for model_class in models:
+            for directory, reencrypt_value in _directories(model_class, namespaces):
+                nodes = app.db.list_prefix(directory)
+                results = executor.map(lambda node: _rewrite(app, node, reencrypt_value), nodes)
+                counts.update(results)
+                logger.info('Re-encrypted {} keys in {}'.format(len(nodes), directory))
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rewrite encrypted values by current encryption key')
+    parser.add_argument('--workers', type=int, default=4, help='number of parallel writers')
+    args = parser.parse_args()
+
+    from kqueen.server import storage_context
+
+    with storage_context():
+        counts = reencrypt(workers=args.workers)
+
+    print('Rewritten: {rewritten}, current: {current}, deleted meanwhile: {missing}'.format(
+        rewritten=counts['rewritten'],
+        current=counts['current'],
+        missing=counts['missing'],
+    ))
@@ -0,0 +1,297 @@
+from .base import StorageNode
+from .etcd import EtcdBackend
+from .etcd import Model
+from .etcd3 import Etcd3Backend
+from .etcd3 import Etcd3Client
+from .exceptions import KeyConflict
+from .exceptions import KeyNotFound
+from .exceptions import WatchExpired
+from .memory import MemoryBackend
+from .memory import MemoryStore
+from . import test_model_fields
+from .test_model_fields import create_model
+from .test_model_fields import model_kwargs
+from .test_model_fields import SortedModel
+from .test_model_fields import UniqueModel
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+
+import pytest
+import uuid
+
+
+def create_backend(name):
+    if name == 'memory':
+        return MemoryBackend(store=MemoryStore(history_size=10))
+
+    backend = EtcdBackend() if name == 'etcd' else Etcd3Backend()
+    if name == 'etcd3':
+        # connect to the same server as the application, configuration can be changed by other tests
+        backend.client = Etcd3Client(host=current_app.db.client.host, port=current_app.db.client.port)
+    else:
+        backend.client = current_app.db.client
+
+    return backend
+
+
+@pytest.fixture(params=['etcd', 'etcd3', 'memory'])
+def backend(request, monkeypatch):
+    yield from use_backend(request.param, monkeypatch)
+
+
+@pytest.fixture(params=['etcd3', 'memory'])
+def transactional_backend(request, monkeypatch):
+    yield from use_backend(request.param, monkeypatch)
+
+
+def use_backend(name, monkeypatch):
+    backend = create_backend(name)
+    monkeypatch.setattr(current_app._get_current_object(), 'db', backend)
+
+    yield backend
+    try:
+        backend.delete(current_app.config['ETCD_PREFIX'], recursive=True)
+    except KeyNotFound:
+        pass
+
+
+class TestStorageBackend:
+    @pytest.fixture(autouse=True)
+    def prepare(self, backend):
+        self.backend = backend
+        self.prefix = '{}/backend/{}/'.format(current_app.config['ETCD_PREFIX'], uuid.uuid4())
+
+    def key(self, name):
+        return '{}{}'.format(self.prefix, name)
+
+    def test_put_get(self):
+        written = self.backend.put(self.key('a'), 1)
+
+        assert written == StorageNode(self.key('a'), '1', written.modified_index)
+        assert self.backend.get(self.key('a')) == written
+
+    def test_exists(self):
+        self.backend.put(self.key('a'), 1)
+
+        assert self.backend.exists(self.key('a'))
+        assert not self.backend.exists(self.key('missing'))
+
+    def test_get_missing(self):
+        with pytest.raises(KeyNotFound):
+            self.backend.get(self.key('missing'))
+
+    def test_modified_index_grows(self):
+        first = self.backend.put(self.key('a'), 1)
+        second = self.backend.put(self.key('b'), 2)
+        third = self.backend.put(self.key('a'), 3)
+
+        assert first.modified_index < second.modified_index < third.modified_index
+
+    def test_list_prefix(self):
+        for name in ['b', 'a', 'sub/c']:
+            self.backend.put(self.key(name), name)
+
+        nodes = self.backend.list_prefix(self.prefix)
+
+        assert [(node.key, node.value) for node in nodes] == [(self.key('a'), 'a'), (self.key('b'), 'b')]
+        assert self.backend.list_prefix(self.key('missing/')) == []
+
+    def test_cas_prev_exist(self):
+        self.backend.cas(self.key('a'), 1, prev_exist=False)
+
+        with pytest.raises(KeyConflict):
+            self.backend.cas(self.key('a'), 2, prev_exist=False)
+        with pytest.raises(KeyConflict):
+            self.backend.cas(self.key('missing'), 2, prev_exist=True)
+
+        assert self.backend.get(self.key('a')).value == '1'
+
+    def test_cas_prev_index(self):
+        written = self.backend.put(self.key('a'), 1)
+        self.backend.cas(self.key('a'), 2, prev_index=written.modified_index)
+
+        with pytest.raises(KeyConflict):
+            self.backend.cas(self.key('a'), 3, prev_index=written.modified_index)
+        with pytest.raises(KeyConflict):
+            self.backend.cas(self.key('missing'), 3, prev_index=written.modified_index)
+
+        assert self.backend.get(self.key('a')).value == '2'
+
+    def test_delete(self):
+        self.backend.put(self.key('a'), 1)
+
+        with pytest.raises(KeyConflict):
+            self.backend.delete(self.key('a'), prev_value='2')
+        self.backend.delete(self.key('a'), prev_value='1')
+
+        with pytest.raises(KeyNotFound):
+            self.backend.delete(self.key('a'))
+
+    def test_delete_recursive(self):
+        self.backend.put(self.key('a'), 1)
+        self.backend.put(self.key('sub/b'), 2)
+
+        self.backend.delete(self.prefix, recursive=True)
+
+        assert self.backend.list_prefix(self.prefix) == []
+        with pytest.raises(KeyNotFound):
+            self.backend.get(self.key('sub/b'))
+
+    def test_list_sorted(self):
+        for name in ['c', 'a', 'b']:
+            self.backend.put(self.key(name), name)
+
+        assert self.backend.list_sorted(self.prefix, offset=1, limit=1) == ([('b', 'b')], 3)
+        assert self.backend.list_sorted(self.prefix, reverse=True) == ([('c', 'c'), ('b', 'b'), ('a', 'a')], 3)
+
+    def test_watch_since_index(self):
+        first = self.backend.put(self.key('a'), 1)
+        self.backend.delete(self.key('a'))
+
+        event = self.backend.watch(self.prefix, index=first.modified_index)
+        assert event.action == 'set'
+        assert event.node == first
+
+        event = self.backend.watch(self.prefix, index=first.modified_index + 1)
+        assert event.action == 'delete'
+        assert event.node.key == self.key('a')
+
+    def test_watch_waits_for_change(self):
+        start = self.backend.put(self.key('start'), 0)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(self.backend.watch, self.prefix, start.modified_index + 1, 10)
+            written = self.backend.put(self.key('a'), 1)
+            event = future.result(timeout=10)
+
+        assert event.node == written
+
+    def test_watch_timeout(self):
+        assert self.backend.watch(self.prefix, timeout=0.5) is None
+
+    def test_transaction(self):
+        if not self.backend.transactions:
+            pytest.skip('Backend has no transactions')
+
+        existing = self.backend.put(self.key('a'), 1)
+
+        succeeded, nodes = self.backend.transaction(
+            {self.key('a'): existing.modified_index, self.key('b'): None},
+            [(self.key('a'), 2), (self.key('b'), 3)],
+        )
+        assert succeeded
+        assert [(node.key, node.value) for node in nodes] == [(self.key('a'), '2'), (self.key('b'), '3')]
+
+        succeeded, nodes = self.backend.transaction(
+            {self.key('a'): existing.modified_index},
+            [(self.key('a'), 4)],
+            reads=[self.key('a'), self.key('missing')],
+        )
+        assert not succeeded
+        assert nodes[0].value == '2'
+        assert nodes[1] is None
+        assert self.backend.get(self.key('a')).value == '2'
+
+
+class TestMemoryBackend:
+    @pytest.fixture(autouse=True)
+    def prepare(self, monkeypatch):
+        self.backend = create_backend('memory')
+        monkeypatch.setattr(current_app._get_current_object(), 'db', self.backend)
+        self.namespace = str(uuid.uuid4())
+
+    def test_watch_expired(self):
+        first = self.backend.put('/a', 0)
+        for i in range(self.backend.store.events.maxlen):
+            self.backend.put('/a', i)
+
+        with pytest.raises(WatchExpired):
+            self.backend.watch('/', index=first.modified_index)
+
+    def test_shared_store(self):
+        MemoryBackend().put('/shared', 1)
+
+        assert MemoryBackend().get('/shared').value == '1'
+        MemoryBackend().delete('/shared')
+
+    def test_concurrent_cas(self):
+        written = self.backend.put('/counter', 0)
+
+        def increment(_):
+            return self.backend.cas('/counter', 1, prev_index=written.modified_index)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = [executor.submit(increment, i) for i in range(8)]
+        results = [future.exception() is None for future in futures]
+
+        assert results.count(True) == 1
+
+    def test_models(self):
+        model = create_model(encrypted=True)
+        obj = model(self.namespace, **model_kwargs)
+        obj.save()
+
+        assert model.load(self.namespace, obj.id).get_dict() == obj.get_dict()
+        assert list(model.list(self.namespace).keys()) == [obj.id]
+
+        obj.delete()
+        assert model.list(self.namespace) == {}
+
+    def test_unique(self):
+        value = str(uuid.uuid4())
+        UniqueModel(self.namespace, string=value).save()
+
+        with pytest.raises(ValueError, match='should be unique'):
+            UniqueModel(self.namespace, string=value).save()
+
+    def test_list_page(self):
+        for string in ['b', 'c', 'a']:
+            SortedModel(self.namespace, string=string).save()
+
+        objects, total = SortedModel.list_page(self.namespace, 'string', limit=2)
+
+        assert total == 3
+        assert [obj.string for obj in objects] == ['a', 'b']
+
+
+@pytest.mark.usefixtures('transactional_backend')
+class TestTransactionalSaveMany(test_model_fields.TestSaveMany):
+    def test_written_in_batches(self, monkeypatch):
+        calls = []
+        transaction = current_app.db.transaction
+
+        def counted(*args, **kwargs):
+            calls.append(args)
+            return transaction(*args, **kwargs)
+
+        monkeypatch.setattr(current_app.db, 'max_txn_operations', 4)
+        monkeypatch.setattr(current_app.db, 'transaction', counted)
+        objs = [UniqueModel(self.namespace, string=str(uuid.uuid4())) for _ in range(4)]
+
+        Model.save_many(objs)
+
+        # object and its index entry
+        assert len(calls) == 2
+        assert len(UniqueModel.list(self.namespace)) == 4
+
+
+@pytest.mark.usefixtures('backend')
+class TestColdFieldsOnBackends(test_model_fields.TestColdFields):
+    pass
+
+
+@pytest.mark.usefixtures('backend')
+class TestChangedFieldsOnBackends(test_model_fields.TestChangedFields):
+    pass
+
+
+@pytest.mark.usefixtures('backend')
+class TestMissingObjectsOnBackends(test_model_fields.TestMissingObjects):
+    pass
+
+
+class TestGroupIndexOnBackends(test_model_fields.TestGroupIndex):
+    @pytest.fixture(autouse=True)
+    def prepare(self, backend):
+        # objects are saved to the tested backend
+        self.create_objects()
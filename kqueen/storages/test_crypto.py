@@ -0,0 +1,144 @@
+from .crypto import GCM_PREFIX
+from .crypto import KeyRing
+from .exceptions import FieldError
+from .reencrypt import reencrypt
+from .test_model_fields import ColdModel
+from .test_model_fields import create_model
+from .test_model_fields import model_kwargs
+from flask import current_app
+
+import base64
+import json
+import pytest
+import uuid
+
+SECRET_KEY = 'current secret key'
+OLD_KEY = 'previous secret key'
+
+
+class TestKeyRing:
+    def test_gcm_round_trip(self):
+        keyring = KeyRing(SECRET_KEY, key_id='k2')
+        encrypted = keyring.encrypt('value')
+
+        assert encrypted.startswith('{}k2$'.format(GCM_PREFIX))
+        assert keyring.is_current(encrypted)
+        assert keyring.decrypt(encrypted) == 'value'
+
+    def test_legacy_cbc_readable(self):
+        legacy = KeyRing(SECRET_KEY, cipher='cbc')
+        encrypted = legacy.encrypt('value' * 5)
+
+        assert not encrypted.startswith(GCM_PREFIX)
+        # IV and two blocks of padded value
+        assert len(base64.b64decode(encrypted)) == 48
+
+        keyring = KeyRing(SECRET_KEY, key_id='k2')
+        assert not keyring.is_current(encrypted)
+        assert keyring.decrypt(encrypted) == 'value' * 5
+
+    def test_rotated_key_readable(self):
+        encrypted = KeyRing(OLD_KEY, key_id='k1').encrypt('value')
+        keyring = KeyRing(SECRET_KEY, key_id='k2', old_keys={'k1': OLD_KEY})
+
+        assert not keyring.is_current(encrypted)
+        assert keyring.decrypt(encrypted) == 'value'
+
+    def test_unknown_key(self):
+        encrypted = KeyRing(OLD_KEY, key_id='k1').encrypt('value')
+
+        with pytest.raises(FieldError, match='Unknown encryption key k1'):
+            KeyRing(SECRET_KEY, key_id='k2').decrypt(encrypted)
+
+    def test_tampered_value(self):
+        keyring = KeyRing(SECRET_KEY)
+        encrypted = KeyRing(OLD_KEY).encrypt('value')
+
+        with pytest.raises(FieldError, match='can\'t be decrypted'):
+            keyring.decrypt(encrypted)
+
+    def test_from_config_parses_json(self):
+        keyring = KeyRing.from_config({
+            'SECRET_KEY': SECRET_KEY,
+            'ENCRYPTION_KEY_ID': 'k2',
+            'ENCRYPTION_OLD_KEYS': json.dumps({'k1': OLD_KEY}),
+        })
+
+        assert set(keyring.aead) == {'k1', 'k2'}
+
+    @pytest.mark.parametrize('kwargs', [{'key_id': 'a$b'}, {'cipher': 'ecb'}])
+    def test_invalid_options(self, kwargs):
+        with pytest.raises(FieldError):
+            KeyRing(SECRET_KEY, **kwargs)
+
+
+class TestReencrypt:
+    @pytest.fixture(autouse=True)
+    def prepare(self, monkeypatch):
+        self.namespace = str(uuid.uuid4())
+        self.monkeypatch = monkeypatch
+        self.use_keyring(KeyRing(OLD_KEY, key_id='k1'))
+
+    def use_keyring(self, keyring):
+        self.monkeypatch.setattr(current_app.db, 'keyring', keyring)
+
+    def stored(self, key):
+        return current_app.db.get(key).value
+
+    def test_rewrites_stale_values(self):
+        model = create_model(encrypted=True)
+        obj = model(self.namespace, **model_kwargs)
+        obj.save()
+        cold = ColdModel(self.namespace, string='abc', secret={'token': 'a'}, metadata={'a': 1})
+        cold.save()
+        cold_key = '{}{}'.format(ColdModel.get_cold_prefix(self.namespace, 'secret'), cold.id)
+        keyring = KeyRing(SECRET_KEY, key_id='k2', old_keys={'k1': OLD_KEY})
+        self.use_keyring(keyring)
+
+        counts = reencrypt(models=[model, ColdModel], namespaces=[self.namespace], workers=2)
+
+        # object of encrypted model and secret cold value, other keys have no encrypted values
+        assert counts == {'rewritten': 2, 'current': 2}
+        stored = json.loads(self.stored(obj.get_db_key()))
+        assert all(keyring.is_current(value) for value in stored.values())
+        assert keyring.is_current(json.loads(self.stored(cold_key)))
+
+        assert model.load(self.namespace, obj.id).get_dict() == obj.get_dict()
+        assert ColdModel.load(self.namespace, cold.id).secret == {'token': 'a'}
+
+        # old key is not needed anymore
+        self.use_keyring(KeyRing(SECRET_KEY, key_id='k2'))
+        assert model.load(self.namespace, obj.id).get_dict() == obj.get_dict()
+        assert reencrypt(models=[model, ColdModel], namespaces=[self.namespace])['rewritten'] == 0
+
+    def test_rewrites_legacy_values(self):
+        self.use_keyring(KeyRing(SECRET_KEY, cipher='cbc'))
+        model = create_model(encrypted=True)
+        obj = model(self.namespace, **model_kwargs)
+        obj.save()
+        self.use_keyring(KeyRing(SECRET_KEY, key_id='k2'))
+
+        assert reencrypt(models=[model], namespaces=[self.namespace])['rewritten'] == 1
+        stored = json.loads(self.stored(obj.get_db_key()))
+        assert all(value.startswith(GCM_PREFIX) for value in stored.values())
+        assert model.load(self.namespace, obj.id).get_dict() == obj.get_dict()
+
+    def test_retries_concurrent_change(self, monkeypatch):
+        model = create_model(encrypted=True)
+        obj = model(self.namespace, **model_kwargs)
+        obj.save()
+        self.use_keyring(KeyRing(SECRET_KEY, key_id='k2', old_keys={'k1': OLD_KEY}))
+        cas = current_app.db.cas
+        calls = []
+
+        def conflicting(key, value, **kwargs):
+            if not calls:
+                # application writes the object meanwhile
+                current_app.db.put(key, self.stored(key))
+            calls.append(key)
+            return cas(key, value, **kwargs)
+
+        monkeypatch.setattr(current_app.db, 'cas', conflicting)
+
+        assert reencrypt(models=[model], namespaces=[self.namespace], workers=1)['rewritten'] == 1
+        assert len(calls) == 2
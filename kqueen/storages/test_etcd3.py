@@ -0,0 +1,215 @@
+from .etcd3 import Etcd3Backend
+from .etcd3 import Etcd3Client
+from .etcd3 import prefix_end
+from .exceptions import KeyNotFound
+from .test_model_fields import create_model
+from .test_model_fields import model_kwargs
+from .test_model_fields import SortedModel
+from .test_model_fields import UniqueModel
+from flask import current_app
+
+import etcd
+import pytest
+import uuid
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = Etcd3Backend()
+    # connect to the same server as the application, configuration can be changed by other tests
+    backend.client = Etcd3Client(host=current_app.db.client.host, port=current_app.db.client.port)
+    monkeypatch.setattr(current_app._get_current_object(), 'db', backend)
+
+    yield backend
+    try:
+        backend.delete(current_app.config['ETCD_PREFIX'], recursive=True)
+    except KeyNotFound:
+        pass
+
+
+def test_prefix_end():
+    assert prefix_end('/a/') == b'/a0'
+    assert prefix_end('a\xff') == b'a\xc3\xc0'
+
+
+@pytest.mark.usefixtures('backend')
+class TestEtcd3Client:
+    def setup(self):
+        self.key = '{}/client/{}'.format(current_app.config['ETCD_PREFIX'], uuid.uuid4())
+
+    def test_write_read(self):
+        response = current_app.db.client.write(self.key, 'value')
+        node = current_app.db.client.read(self.key)
+
+        assert node.value == 'value'
+        assert node.modifiedIndex == response.modifiedIndex
+
+    def test_missing_raises(self):
+        with pytest.raises(etcd.EtcdKeyNotFound):
+            current_app.db.client.read(self.key)
+
+    def test_prev_exist(self):
+        current_app.db.client.write(self.key, 'value', prevExist=False)
+
+        with pytest.raises(etcd.EtcdAlreadyExist):
+            current_app.db.client.write(self.key, 'other', prevExist=False)
+
+    def test_prev_index(self):
+        response = current_app.db.client.write(self.key, 'value')
+        current_app.db.client.write(self.key, 'second', prevIndex=response.modifiedIndex)
+
+        with pytest.raises(etcd.EtcdCompareFailed):
+            current_app.db.client.write(self.key, 'third', prevIndex=response.modifiedIndex)
+        assert current_app.db.client.read(self.key).value == 'second'
+
+    def test_delete_prev_value(self):
+        current_app.db.client.write(self.key, 'value')
+
+        with pytest.raises(etcd.EtcdCompareFailed):
+            current_app.db.client.delete(self.key, prevValue='other')
+        current_app.db.client.delete(self.key, prevValue='value')
+
+        with pytest.raises(etcd.EtcdKeyNotFound):
+            current_app.db.client.delete(self.key)
+
+    def test_directory(self):
+        current_app.db.client.write('{}/a'.format(self.key), 1)
+        current_app.db.client.write('{}/b'.format(self.key), 2)
+        current_app.db.client.write('{}/sub/c'.format(self.key), 3)
+
+        directory = current_app.db.client.read('{}/'.format(self.key))
+        children = [(node.key, node.value) for node in directory.children if not node.dir]
+
+        assert children == [('{}/a'.format(self.key), '1'), ('{}/b'.format(self.key), '2')]
+
+    def test_delete_recursive(self):
+        current_app.db.client.write('{}/a'.format(self.key), 1)
+        current_app.db.client.delete(self.key, recursive=True)
+
+        with pytest.raises(etcd.EtcdKeyNotFound):
+            current_app.db.client.read(self.key)
+
+
+@pytest.mark.usefixtures('backend')
+class TestEtcd3Backend:
+    def setup(self):
+        self.key = '{}/backend/{}'.format(current_app.config['ETCD_PREFIX'], uuid.uuid4())
+
+    @pytest.fixture
+    def ranges(self, monkeypatch):
+        calls = []
+        client_range = current_app.db.client.range
+
+        def counted_range(*args, **kwargs):
+            calls.append(args)
+            return client_range(*args, **kwargs)
+
+        monkeypatch.setattr(current_app.db.client, 'range', counted_range)
+        return calls
+
+    def test_get(self, ranges):
+        current_app.db.put(self.key, 'value')
+
+        node = current_app.db.get(self.key)
+
+        assert (node.key, node.value) == (self.key, 'value')
+        assert len(ranges) == 1
+
+    def test_get_missing_single_request(self, ranges):
+        with pytest.raises(KeyNotFound):
+            current_app.db.get(self.key)
+
+        assert len(ranges) == 1
+
+    def test_get_directory_not_read(self, ranges):
+        current_app.db.put('{}/child'.format(self.key), 'value')
+
+        with pytest.raises(KeyNotFound):
+            current_app.db.get(self.key)
+
+        assert ranges == [(self.key,)]
+
+
+@pytest.mark.usefixtures('backend')
+class TestEtcd3Models:
+    def setup(self):
+        self.namespace = str(uuid.uuid4())
+
+    def test_save_load_list(self):
+        model = create_model(encrypted=True)
+        obj = model(self.namespace, **model_kwargs)
+        obj.save()
+
+        loaded = model.load(self.namespace, obj.id)
+        assert loaded.get_dict() == obj.get_dict()
+        assert list(model.list(self.namespace).keys()) == [obj.id]
+
+    def test_save_conflict_retried(self):
+        model = create_model()
+        obj = model(self.namespace, **model_kwargs)
+        obj.save()
+
+        other = model.load(self.namespace, obj.id)
+        other.string = 'other'
+        other.save()
+
+        obj.string = 'changed'
+        obj.save()
+
+        assert model.load(self.namespace, obj.id).string == 'changed'
+
+    def test_unique(self):
+        value = str(uuid.uuid4())
+        obj = UniqueModel(self.namespace, string=value)
+        obj.save()
+
+        duplicate = UniqueModel(self.namespace, string=value)
+        with pytest.raises(ValueError, match='should be unique'):
+            duplicate.save()
+        assert UniqueModel.load_by(self.namespace, 'string', value).id == obj.id
+
+    def test_unique_index_checked_in_transaction(self, monkeypatch):
+        value = str(uuid.uuid4())
+        obj = UniqueModel(self.namespace, string=value)
+        obj.save()
+
+        # skip validation, uniqueness is still enforced by the transaction
+        monkeypatch.setattr(UniqueModel, '_is_unique', lambda self, field_name: True)
+        duplicate = UniqueModel(self.namespace, string=value)
+        with pytest.raises(ValueError, match='should be unique'):
+            duplicate.save()
+
+    def test_stale_index_replaced(self):
+        value = str(uuid.uuid4())
+        index_key = UniqueModel.get_index_key(self.namespace, 'string', value)
+        current_app.db.put(index_key, str(uuid.uuid4()))
+
+        obj = UniqueModel(self.namespace, string=value)
+        obj.save()
+
+        assert current_app.db.get(index_key).value == obj.id
+
+    def test_list_page(self):
+        objs = []
+        for string in ['c', 'a', 'd', 'b']:
+            obj = SortedModel(self.namespace, string=string)
+            obj.save()
+            objs.append(obj)
+        expected = [obj.id for obj in sorted(objs, key=lambda x: x.string)]
+
+        objects, total = SortedModel.list_page(self.namespace, 'string', offset=1, limit=2)
+        assert total == len(objs)
+        assert [obj.id for obj in objects] == expected[1:3]
+
+        objects, _ = SortedModel.list_page(self.namespace, 'string', limit=3, reverse=True)
+        assert [obj.id for obj in objects] == expected[::-1][:3]
+
+    def test_write_many(self, monkeypatch):
+        monkeypatch.setattr(current_app.db, 'max_txn_operations', 2)
+        prefix = '{}/many/'.format(current_app.config['ETCD_PREFIX'])
+
+        current_app.db.write_many([('{}{}'.format(prefix, i), i) for i in range(5)])
+
+        entries, total = current_app.db.list_sorted(prefix)
+        assert total == 5
+        assert entries == [(str(i), str(i)) for i in range(5)]
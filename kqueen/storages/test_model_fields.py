@@ -1,7 +1,10 @@
+from kqueen.storages.base import DeserializationCache
+from kqueen.storages.base import MissingKeyCache
 from kqueen.storages.etcd import BoolField
 from kqueen.storages.etcd import DatetimeField
 from kqueen.storages.etcd import Field
 from kqueen.storages.etcd import IdField
+from kqueen.storages.etcd import IdentityMap
 from kqueen.storages.etcd import JSONField
 from kqueen.storages.etcd import Model
 from kqueen.storages.etcd import ModelMeta
@@ -10,10 +13,20 @@ from kqueen.storages.etcd import RelationField
 from kqueen.storages.etcd import StringField
 from kqueen.storages.exceptions import BackendError
 from kqueen.storages.exceptions import FieldError
+from kqueen.storages.exceptions import KeyConflict
+from kqueen.storages.exceptions import KeyNotFound
+from flask import current_app
 
+import base64
 import datetime
+import etcd
 import itertools
+import json
+import os
 import pytest
+import time
+import uuid
+import zlib
 
 
 def create_model(required=False, global_ns=False, encrypted=False, unique=False):
@@ -171,6 +184,208 @@ class TestUniqueFields:
             obj2.save()
 
 
+class UniqueModel(Model, metaclass=ModelMeta):
+    id = IdField()
+    secret = StringField(unique=True, encrypted=True)
+    string = StringField(unique=True)
+
+
+class TestUniqueIndex:
+    def setup(self):
+        self.model = UniqueModel
+        self.value = str(uuid.uuid4())
+        self.obj = self.model(namespace, string=self.value, secret=self.value)
+        self.obj.save()
+
+    def test_index_written(self):
+        index_key = self.model.get_index_key(namespace, 'string', self.value)
+
+        assert current_app.db.get(index_key).value == self.obj.id
+        assert self.model.lookup_id(namespace, 'string', self.value) == self.obj.id
+
+    def test_index_moved_on_change(self):
+        self.obj.string = 'changed {}'.format(self.value)
+        self.obj.save()
+
+        assert self.model.lookup_id(namespace, 'string', self.obj.string) == self.obj.id
+        assert self.model.lookup_id(namespace, 'string', self.value) is None
+
+    def test_index_removed_on_delete(self):
+        self.obj.delete()
+
+        with pytest.raises(KeyNotFound):
+            current_app.db.get(self.model.get_index_key(namespace, 'string', self.value))
+
+    def test_validation_does_not_list(self, monkeypatch):
+        def fail(*args, **kwargs):
+            raise AssertionError('Objects should not be listed')
+
+        monkeypatch.setattr(self.model, 'list', fail)
+        obj = self.model(namespace, string=self.value)
+
+        assert self.obj.validate() == (True, None)
+        assert obj.validate() == (False, 'Field "string" should be unique')
+
+    def test_load_by(self):
+        loaded = self.model.load_by(namespace, 'string', self.value)
+
+        assert loaded.id == self.obj.id
+        with pytest.raises(NameError):
+            self.model.load_by(namespace, 'string', 'missing')
+
+    def test_stale_index_is_ignored(self):
+        stale = 'stale {}'.format(self.value)
+        current_app.db.put(self.model.get_index_key(namespace, 'string', stale), 'missing-id')
+        obj = self.model(namespace, string=stale)
+
+        assert obj._is_unique('string')
+        with pytest.raises(NameError):
+            self.model.load_by(namespace, 'string', stale)
+
+    def test_indexes_built_for_existing_objects(self):
+        legacy = 'legacy {}'.format(self.value)
+        obj = self.model(namespace, string=legacy)
+        obj.verify_id()
+        current_app.db.put(obj.get_db_key(), obj.serialize())
+        current_app.db.delete(self.model.get_index_prefix(namespace), recursive=True)
+        current_app.db.indexed.clear()
+
+        assert self.model.lookup_id(namespace, 'string', legacy) == obj.id
+        assert self.model.lookup_id(namespace, 'string', self.value) == self.obj.id
+
+    def test_encrypted_values_are_hashed(self):
+        assert self.value not in str(self.obj._index_values()['secret'])
+        assert self.model.lookup_id(namespace, 'secret', self.value) == self.obj.id
+
+
+class TestOptimisticSave:
+    def setup(self):
+        self.model = UniqueModel
+        self.value = str(uuid.uuid4())
+        self.obj = self.model(namespace, string=self.value)
+        self.obj.save()
+
+    def test_global_lock_not_used(self, monkeypatch):
+        def fail(*args, **kwargs):
+            raise AssertionError('Lock should not be used')
+
+        monkeypatch.setattr(etcd, 'Lock', fail)
+
+        self.obj.secret = 'secret'
+        assert self.obj.save()
+
+    def test_concurrent_update_is_retried(self):
+        first = self.model.load(namespace, self.obj.id)
+        second = self.model.load(namespace, self.obj.id)
+
+        first.secret = 'first'
+        first.save()
+        second.secret = 'second'
+        second.save()
+
+        assert self.model.load(namespace, self.obj.id).secret == 'second'
+        assert second._modified_index == current_app.db.get(second.get_db_key()).modified_index
+
+    def test_new_object_with_existing_id(self):
+        obj = self.model(namespace, id=self.obj.id, string=self.value, secret='replaced')
+
+        assert obj.save()
+        assert self.model.load(namespace, self.obj.id).secret == 'replaced'
+
+    def test_unique_value_claimed_atomically(self, monkeypatch):
+        monkeypatch.setattr(self.model, '_is_unique', lambda obj, field_name: True)
+        obj = self.model(namespace, string=self.value)
+
+        with pytest.raises(ValueError, match='Field "string" should be unique'):
+            obj.save()
+
+        assert self.model.lookup_id(namespace, 'string', self.value) == self.obj.id
+        assert not self.model.exists(namespace, obj.id)
+
+    def racing_write(self, monkeypatch, first, concurrent):
+        """Run `concurrent` when `first` claimed its index entries but wasn't written yet."""
+        write = self.model._write
+
+        def racing(obj, key):
+            if obj is first and not getattr(self, 'raced', False):
+                self.raced = True
+                concurrent()
+            return write(obj, key)
+
+        monkeypatch.setattr(self.model, '_write', racing)
+
+    @pytest.mark.parametrize('save_many', [False, True])
+    def test_entry_taken_over_before_write(self, monkeypatch, save_many):
+        value = str(uuid.uuid4())
+        first = self.model(namespace, string=value)
+        second = self.model(namespace, string=value)
+        # second finds entry of first without object and takes it over as stale
+        self.racing_write(monkeypatch, first, second.save)
+
+        with pytest.raises(ValueError, match='Field "string" should be unique'):
+            Model.save_many([first]) if save_many else first.save()
+
+        assert self.model.lookup_id(namespace, 'string', value) == second.id
+        assert self.model.exists(namespace, second.id)
+        assert not self.model.exists(namespace, first.id)
+
+    def test_update_undone_when_entry_taken_over(self, monkeypatch):
+        value = str(uuid.uuid4())
+        second = self.model(namespace, string=value)
+        self.obj.string = value
+        self.racing_write(monkeypatch, self.obj, second.save)
+
+        with pytest.raises(ValueError, match='Field "string" should be unique'):
+            self.obj.save()
+
+        assert self.model.load(namespace, self.obj.id).string == self.value
+        assert self.model.lookup_id(namespace, 'string', value) == second.id
+
+    def test_live_owner_keeps_entry(self, monkeypatch):
+        value = str(uuid.uuid4())
+        first = self.model(namespace, string=value)
+        first.verify_id()
+        index_key = self.model.get_index_key(namespace, 'string', self.model._index_value('string', value))
+        current_app.db.put(index_key, first.id)
+        check = self.model._index_owner_exists.__func__
+        checks = []
+
+        def racing_check(cls, *args):
+            checks.append(args)
+            if len(checks) == 1:
+                # owner is written between the check and the swap
+                current_app.db.put(first.get_db_key(), first.serialize())
+                return False
+            return check(cls, *args)
+
+        monkeypatch.setattr(self.model, '_index_owner_exists', classmethod(racing_check))
+
+        with pytest.raises(ValueError, match='Field "string" should be unique'):
+            self.model(namespace, string=value).save()
+
+        assert current_app.db.get(index_key).value == first.id
+
+    def test_claims_released_on_failure(self, monkeypatch):
+        monkeypatch.setattr(self.model, '_is_unique', lambda obj, field_name: True)
+        secret = 'secret {}'.format(self.value)
+        obj = self.model(namespace, string=self.value, secret=secret)
+
+        with pytest.raises(ValueError):
+            obj.save()
+
+        assert self.model.lookup_id(namespace, 'secret', secret) is None
+
+    def test_too_many_conflicts(self, monkeypatch):
+        def conflict(obj, key):
+            raise KeyConflict('Compare failed')
+
+        monkeypatch.setattr(self.model, '_write', conflict)
+        self.obj.secret = 'changed'
+
+        with pytest.raises(BackendError, match='too many conflicting writes'):
+            self.obj.save()
+
+
 class TestGetFieldNames:
     def test_get_field_names(self, get_object):
         field_names = get_object.__class__.get_field_names()
@@ -228,6 +443,665 @@ class TestSerialization:
         assert new_object.get_dict(True) == get_object.get_dict(True)
 
 
+class TestDeserializationCache:
+    def setup(self):
+        self.model = create_model(encrypted=True)
+        self.obj = self.model(namespace, **model_kwargs)
+        self.obj.save()
+
+    def count_decrypts(self, monkeypatch):
+        calls = []
+        original = Field.decrypt_serialized
+
+        def counting(field, crypted):
+            calls.append(crypted)
+            return original(field, crypted)
+
+        monkeypatch.setattr(Field, 'decrypt_serialized', counting)
+        return calls
+
+    def test_unchanged_objects_skip_decryption(self, monkeypatch):
+        self.model.list(namespace)[str(self.obj.id)].get_dict()
+        calls = self.count_decrypts(monkeypatch)
+
+        loaded = self.model.list(namespace)[str(self.obj.id)]
+
+        assert loaded.get_dict() == self.obj.get_dict()
+        assert not calls
+
+    def test_changed_objects_are_reparsed(self, monkeypatch):
+        self.model.list(namespace)[str(self.obj.id)].get_dict()
+        self.obj.string = 'changed'
+        self.obj.save()
+        calls = self.count_decrypts(monkeypatch)
+
+        loaded = self.model.load(namespace, self.obj.id)
+
+        assert loaded.string == 'changed'
+        assert calls
+
+    def test_cached_objects_are_not_shared(self):
+        first = self.model.load(namespace, self.obj.id)
+        first.json['a'] = 'modified'
+        second = self.model.load(namespace, self.obj.id)
+
+        assert second.json == model_kwargs['json']
+
+    def test_size_limit(self):
+        cache = DeserializationCache(max_size=2)
+        for index in range(3):
+            cache.set('key{}'.format(index), index, {})
+
+        assert len(cache) == 2
+        assert cache.get('key0', 0) is None
+        assert cache.get('key2', 2) == {}
+
+    def test_stale_index(self):
+        cache = DeserializationCache(max_size=2)
+        cache.set('key', 1, {'string': 'abc'})
+
+        assert cache.get('key', 2) is None
+        assert len(cache) == 0
+
+
+class TestMissingObjects:
+    def setup(self):
+        self.model = create_model()
+        self.obj = self.model(namespace, **model_kwargs)
+        self.obj.verify_id()
+
+    def count_reads(self, monkeypatch):
+        reads = []
+        db = current_app.db
+
+        for method in ['get', 'exists']:
+            def counted(key, *args, original=getattr(db, method), **kwargs):
+                reads.append(key)
+                return original(key, *args, **kwargs)
+
+            monkeypatch.setattr(db, method, counted)
+
+        return reads
+
+    def test_exists_skips_deserialization(self, monkeypatch):
+        self.obj.save()
+        monkeypatch.setattr(self.model, 'deserialize', None)
+
+        assert self.model.exists(namespace, self.obj.id)
+
+    def test_missing_objects_are_remembered(self, monkeypatch):
+        reads = self.count_reads(monkeypatch)
+        assert not self.model.exists(namespace, self.obj.id)
+        assert reads
+        reads.clear()
+
+        assert not self.model.exists(namespace, self.obj.id)
+        with pytest.raises(NameError):
+            self.model.load(namespace, self.obj.id)
+
+        assert not reads
+
+    def test_saved_objects_are_forgotten(self):
+        with pytest.raises(NameError):
+            self.model.load(namespace, self.obj.id)
+
+        self.obj.save()
+
+        assert self.model.exists(namespace, self.obj.id)
+        assert self.model.load(namespace, self.obj.id).get_dict() == self.obj.get_dict()
+
+    def test_ttl(self, monkeypatch):
+        cache = MissingKeyCache(ttl=10)
+        cache.add('key')
+        assert 'key' in cache
+
+        now = time.monotonic()
+        monkeypatch.setattr(time, 'monotonic', lambda: now + 11)
+
+        assert 'key' not in cache
+        assert len(cache) == 0
+
+    def test_disabled(self):
+        cache = MissingKeyCache(ttl=0)
+        cache.add('key')
+
+        assert 'key' not in cache
+
+
+class RelatedModel(Model, metaclass=ModelMeta):
+    id = IdField()
+    string = StringField()
+
+
+class TestLazyFields:
+    def setup(self):
+        self.model = create_model(encrypted=True)
+        self.obj = self.model(namespace, **model_kwargs)
+        self.obj.save()
+        current_app.db.cache.clear()
+
+    def count_decrypts(self, monkeypatch):
+        calls = []
+        original = Field.decrypt_serialized
+
+        def counting(field, crypted):
+            calls.append(crypted)
+            return original(field, crypted)
+
+        monkeypatch.setattr(Field, 'decrypt_serialized', counting)
+        return calls
+
+    def test_load_does_not_decrypt(self, monkeypatch):
+        calls = self.count_decrypts(monkeypatch)
+
+        loaded = self.model.load(namespace, self.obj.id)
+
+        assert loaded._json.deferred
+        assert len(calls) == 0
+
+    def test_access_decrypts_one_field(self, monkeypatch):
+        calls = self.count_decrypts(monkeypatch)
+        loaded = self.model.load(namespace, self.obj.id)
+
+        assert loaded.json == model_kwargs['json']
+        assert len(calls) == 1
+        assert not loaded._json.deferred
+        assert loaded._string.deferred
+
+    def test_save_reuses_stored_values(self, monkeypatch):
+        loaded = self.model.load(namespace, self.obj.id)
+        stored = current_app.db.get(self.obj.get_db_key()).value
+        calls = self.count_decrypts(monkeypatch)
+
+        loaded.save()
+        saved = current_app.db.get(self.obj.get_db_key()).value
+
+        # only id is needed to save the object
+        assert len(calls) == 1
+        assert json.loads(saved)['json'] == json.loads(stored)['json']
+        assert json.loads(saved)['string'] == json.loads(stored)['string']
+
+    def test_changed_field_is_encrypted_again(self):
+        loaded = self.model.load(namespace, self.obj.id)
+        loaded.string = 'changed'
+        loaded.save()
+
+        reloaded = self.model.load(namespace, self.obj.id)
+        assert reloaded.string == 'changed'
+        assert reloaded.json == model_kwargs['json']
+
+
+class TestIdentityMap:
+    @pytest.fixture(autouse=True)
+    def prepare(self, monkeypatch):
+        self.related_model = RelatedModel
+        self.model = create_model()
+
+        def fake_related_class(their, class_name):
+            return self.related_model
+
+        monkeypatch.setattr(RelationField, '_get_related_class', fake_related_class)
+
+        self.related = [self.related_model(namespace, string='related') for _ in range(3)]
+        for related in self.related:
+            related.save()
+
+        self.objs = []
+        for index in range(6):
+            obj = self.model(namespace, **model_kwargs)
+            obj.relation = self.related[index % 3]
+            obj.save()
+            self.objs.append(obj)
+
+        self.loads = []
+        original = self.related_model.load.__func__
+
+        def counting_load(cls, *args, **kwargs):
+            self.loads.append(args)
+            return original(cls, *args, **kwargs)
+
+        monkeypatch.setattr(self.related_model, 'load', classmethod(counting_load))
+
+    def test_relations_are_loaded_once(self):
+        with IdentityMap():
+            first = self.related_model.load_related(namespace, self.related[0].id)
+            second = self.related_model.load_related(namespace, self.related[0].id)
+
+        assert first is second
+        assert len(self.loads) == 1
+
+    def test_list_prefetches_relations(self, monkeypatch):
+        monkeypatch.setattr(current_app.db, 'prefetch_threshold', 3)
+        loaded = self.model.list(namespace)
+
+        assert not self.loads
+        for obj in self.objs:
+            assert loaded[str(obj.id)].relation.id == obj.relation.id
+
+    def test_few_relations_loaded_by_id(self, monkeypatch):
+        monkeypatch.setattr(current_app.db, 'prefetch_threshold', 1000)
+        monkeypatch.setattr(self.related_model, 'list', None)
+        loaded = self.model.list(namespace)
+
+        # every related object is loaded once
+        assert len(self.loads) == len(set(self.loads))
+        assert {(namespace, str(related.id)) for related in self.related} <= {(n, str(i)) for n, i in self.loads}
+        for obj in self.objs:
+            assert loaded[str(obj.id)].relation.id == obj.relation.id
+
+    def test_list_shares_related_objects(self):
+        with IdentityMap():
+            loaded = self.model.list(namespace)
+
+        relation = loaded[str(self.objs[0].id)].relation
+        assert loaded[str(self.objs[3].id)].relation is relation
+
+    def test_closed_map_is_cleared(self):
+        with IdentityMap() as identity_map:
+            self.related_model.load_related(namespace, self.related[0].id)
+
+        assert IdentityMap.current() is None
+        assert identity_map.get(self.related_model, namespace, self.related[0].id) is None
+
+    def test_without_map_relations_are_loaded(self):
+        self.model.load(namespace, self.objs[0].id)
+
+        assert len(self.loads) == 1
+
+
+class TestProjection:
+    @pytest.fixture(autouse=True)
+    def prepare(self, monkeypatch):
+        self.model = create_model()
+
+        def fake_related_class(their, class_name):
+            return RelatedModel
+
+        monkeypatch.setattr(RelationField, '_get_related_class', fake_related_class)
+
+        self.related = RelatedModel(namespace, string='related')
+        self.related.save()
+        self.obj = self.model(namespace, **model_kwargs)
+        self.obj.relation = self.related
+        self.obj.save()
+
+        self.loads = []
+        original = RelatedModel.load.__func__
+
+        def counting_load(cls, *args, **kwargs):
+            self.loads.append(args)
+            return original(cls, *args, **kwargs)
+
+        monkeypatch.setattr(RelatedModel, 'load', classmethod(counting_load))
+
+    def test_get_projection(self):
+        projection = self.model.get_projection(['string', 'relation.string', 'relation.id'])
+
+        assert projection == {'id': None, 'string': None, 'relation': ['string', 'id']}
+
+    def test_whole_relation_wins(self):
+        projection = self.model.get_projection(['relation.string', 'relation'])
+
+        assert projection['relation'] is None
+
+    @pytest.mark.parametrize('fields', [
+        ['missing'],
+        ['string.id'],
+    ])
+    def test_get_projection_raises(self, fields):
+        with pytest.raises(FieldError):
+            self.model.get_projection(fields)
+
+    def test_list_loads_selected_fields(self):
+        loaded = self.model.list(namespace, fields=['string'])[str(self.obj.id)]
+
+        assert loaded.id == str(self.obj.id)
+        assert loaded.string == model_kwargs['string']
+        assert loaded.json is None
+        assert loaded.relation is None
+        assert not self.loads
+
+    def test_list_loads_selected_relations(self):
+        loaded = self.model.list(namespace, fields=['relation.string'])[str(self.obj.id)]
+
+        assert loaded.relation.string == 'related'
+        assert loaded.get_dict(fields=['relation.string']) == {
+            'id': str(self.obj.id),
+            'relation': {'id': str(self.related.id), 'string': 'related'},
+        }
+
+    def test_projected_object_cant_be_saved(self):
+        loaded = self.model.list(namespace, fields=['string'])[str(self.obj.id)]
+
+        with pytest.raises(BackendError):
+            loaded.save()
+
+
+class SortedModel(Model, metaclass=ModelMeta):
+    id = IdField()
+    string = StringField()
+    datetime = DatetimeField()
+
+    sort_indexes = {
+        'string': ('string', 'datetime'),
+        'datetime': ('datetime',),
+    }
+
+
+class TestSortIndex:
+    def setup(self):
+        self.model = SortedModel
+        self.namespace = str(uuid.uuid4())
+
+        values = [('b', 3), ('a', 2), ('c', 1), ('a', 1), ('d', 5)]
+        self.objs = []
+        for string, day in values:
+            obj = self.model(self.namespace, string=string, datetime=datetime.datetime(2018, 1, day))
+            obj.save()
+            self.objs.append(obj)
+
+    def expected(self, key=lambda x: (x.string, x.datetime, x.id), reverse=False):
+        return [obj.id for obj in sorted(self.objs, key=key, reverse=reverse)]
+
+    def test_page(self):
+        objects, total = self.model.list_page(self.namespace, 'string', offset=1, limit=2)
+
+        assert total == len(self.objs)
+        assert [obj.id for obj in objects] == self.expected()[1:3]
+
+    def test_reverse(self):
+        objects, _ = self.model.list_page(self.namespace, 'datetime', reverse=True)
+
+        assert [obj.id for obj in objects] == self.expected(key=lambda x: (x.datetime, x.id), reverse=True)
+
+    def test_reads_only_page(self, monkeypatch):
+        loads = []
+        original = self.model.load.__func__
+
+        def counting_load(cls, *args, **kwargs):
+            loads.append(args)
+            return original(cls, *args, **kwargs)
+
+        monkeypatch.setattr(self.model, 'load', classmethod(counting_load))
+        self.model.list_page(self.namespace, 'string', limit=2)
+
+        assert len(loads) == 2
+
+    def test_projection(self):
+        objects, _ = self.model.list_page(self.namespace, 'datetime', limit=1, fields=['string'])
+
+        assert objects[0].string is not None
+        assert objects[0]._projection is not None
+
+    def test_entry_moved_on_change(self):
+        self.objs[0].string = 'z'
+        self.objs[0].save()
+
+        objects, total = self.model.list_page(self.namespace, 'string')
+
+        assert total == len(self.objs)
+        assert [obj.id for obj in objects] == self.expected()
+        assert objects[-1].id == self.objs[0].id
+
+    def test_entry_removed_on_delete(self):
+        self.objs.pop().delete()
+
+        objects, total = self.model.list_page(self.namespace, 'string')
+
+        assert total == len(self.objs)
+        assert [obj.id for obj in objects] == self.expected()
+
+    def entry_key(self, entry):
+        return '{}{}'.format(self.model.get_sort_index_prefix(self.namespace, 'string'), entry)
+
+    def test_stale_entry_skipped(self):
+        current_app.db.put(self.entry_key('00'), str(uuid.uuid4()))
+
+        objects, total = self.model.list_page(self.namespace, 'string')
+
+        assert [obj.id for obj in objects] == self.expected()
+        assert total == len(self.objs)
+        assert not current_app.db.exists(self.entry_key('00'))
+
+    def test_stale_entries_replaced_on_page(self):
+        current_app.db.put(self.entry_key('00'), str(uuid.uuid4()))
+        # entry of previous value of existing object
+        current_app.db.put(self.entry_key('01'), self.objs[0].id)
+
+        objects, total = self.model.list_page(self.namespace, 'string', limit=2)
+
+        assert [obj.id for obj in objects] == self.expected()[:2]
+        assert total == len(self.objs)
+        assert not current_app.db.exists(self.entry_key('01'))
+
+    def test_entry_of_concurrent_save_kept(self, monkeypatch):
+        obj = self.objs[0]
+        stale = self.model.load(self.namespace, obj.id)
+        obj.string = 'z'
+        obj.save()
+        entry = obj._sort_values()['string']
+
+        # object read before the concurrent save wrote it
+        monkeypatch.setattr(self.model, 'load', classmethod(lambda cls, *args, **kwargs: stale))
+        self.model.list_page(self.namespace, 'string')
+
+        assert current_app.db.get(self.entry_key(entry)).value == obj.id
+
+    def test_failed_write_leaves_no_entries(self, monkeypatch):
+        def conflict(obj, key):
+            raise KeyConflict('Compare failed')
+
+        monkeypatch.setattr(self.model, '_write', conflict)
+        obj = self.objs[0]
+        obj.string = 'z'
+
+        with pytest.raises(BackendError):
+            obj.save()
+
+        entries = current_app.db.list_prefix(self.model.get_sort_index_prefix(self.namespace, 'string'))
+        assert len(entries) == len(self.objs)
+
+    def test_built_for_stored_objects(self):
+        prefix = self.model.get_index_prefix(self.namespace)
+        current_app.db.delete(prefix, recursive=True)
+        current_app.db.indexed.discard(prefix)
+
+        objects, _ = self.model.list_page(self.namespace, 'string')
+
+        assert [obj.id for obj in objects] == self.expected()
+
+    def test_unknown_sort_index(self):
+        with pytest.raises(BackendError):
+            self.model.list_page(self.namespace, 'missing')
+
+    def test_encrypted_field_raises(self):
+        with pytest.raises(FieldError):
+            class EncryptedSortedModel(Model, metaclass=ModelMeta):
+                id = IdField()
+                string = StringField(encrypted=True)
+
+                sort_indexes = {'string': ('string',)}
+
+
+class GroupedModel(Model, metaclass=ModelMeta):
+    id = IdField()
+    team = StringField()
+    secret = StringField(encrypted=True)
+
+    group_indexes = {
+        'team': 'team',
+        'secret': 'secret',
+    }
+
+
+class TestGroupIndex:
+    @pytest.fixture(autouse=True)
+    def prepare(self):
+        self.create_objects()
+
+    def create_objects(self):
+        self.model = GroupedModel
+        self.namespace = str(uuid.uuid4())
+
+        self.objs = []
+        for team in ['a/b', 'a', 'a/b', None]:
+            obj = self.model(self.namespace, team=team, secret=team)
+            obj.save()
+            self.objs.append(obj)
+
+    def ids(self, team, **kwargs):
+        return sorted(self.model.list_group(self.namespace, 'team', team, **kwargs))
+
+    def expected(self, team):
+        return sorted(obj.id for obj in self.objs if obj.team == team)
+
+    def test_list_group(self):
+        listed = self.model.list_group(self.namespace, 'team', 'a/b')
+
+        assert sorted(listed) == self.expected('a/b')
+        assert all(obj.team == 'a/b' for obj in listed.values())
+        assert self.ids('a') == self.expected('a')
+        assert self.ids('missing') == []
+
+    def test_encrypted_value_is_hashed(self):
+        assert sorted(self.model.list_group(self.namespace, 'secret', 'a/b')) == self.expected('a/b')
+        assert not [
+            node for node in current_app.db.list_prefix(self.model.get_group_index_prefix(self.namespace, 'secret'))
+            if 'a/b' in node.key
+        ]
+
+    def test_reads_only_group(self, monkeypatch):
+        self.model.list_group(self.namespace, 'team', 'a')
+        reads = []
+        original = current_app.db.list_prefix
+
+        def counted(prefix, *args, **kwargs):
+            nodes = original(prefix, *args, **kwargs)
+            reads.extend(nodes)
+            return nodes
+
+        monkeypatch.setattr(current_app.db, 'list_prefix', counted)
+
+        assert self.ids('a', return_objects=False) == self.expected('a')
+        assert len(reads) == 1
+
+    def test_entry_moved_on_change(self):
+        obj = self.objs[0]
+        obj.team = 'a'
+        obj.save()
+
+        assert self.ids('a') == self.expected('a')
+        assert self.ids('a/b', return_objects=False) == self.expected('a/b')
+
+    def test_entry_removed_on_delete(self):
+        self.objs.pop(0).delete()
+
+        assert self.ids('a/b', return_objects=False) == self.expected('a/b')
+
+    def test_stale_entry_skipped(self):
+        obj = self.objs[1]
+        current_app.db.put('{}{}'.format(self.model.get_group_index_prefix(self.namespace, 'team', 'a/b'), obj.id), obj.id)
+
+        assert self.ids('a/b') == self.expected('a/b')
+
+    def test_built_for_stored_objects(self):
+        prefix = self.model.get_index_prefix(self.namespace)
+        current_app.db.delete(prefix, recursive=True)
+        # indexes built before the group index was added
+        current_app.db.put('{}_built'.format(prefix), 1)
+        current_app.db.indexed.discard(prefix)
+
+        assert self.ids('a/b') == self.expected('a/b')
+
+    def test_unknown_group_index(self):
+        with pytest.raises(BackendError):
+            self.model.list_group(self.namespace, 'missing', 'a')
+
+    def test_cold_field_raises(self):
+        with pytest.raises(FieldError):
+            class ColdGroupedModel(Model, metaclass=ModelMeta):
+                id = IdField()
+                team = JSONField(cold=True)
+
+                group_indexes = {'team': 'team'}
+
+
+class TestSaveMany:
+    def setup(self):
+        self.namespace = str(uuid.uuid4())
+
+    def test_objects_saved(self):
+        objs = [UniqueModel(self.namespace, string=str(uuid.uuid4())) for _ in range(3)]
+        objs.append(SortedModel(self.namespace, string='sorted'))
+
+        assert Model.save_many(objs)
+
+        for obj in objs:
+            assert obj.__class__.load(self.namespace, obj.id).string == obj.string
+        for obj in objs[:3]:
+            assert UniqueModel.lookup_id(self.namespace, 'string', obj.string) == obj.id
+        assert [obj.id for obj in SortedModel.list_page(self.namespace, 'string')[0]] == [objs[3].id]
+
+    def test_uniqueness_checked_once(self, monkeypatch):
+        existing = UniqueModel(self.namespace, string=str(uuid.uuid4()))
+        existing.save()
+
+        def fail(*args, **kwargs):
+            raise AssertionError('Values should not be looked up one by one')
+
+        monkeypatch.setattr(UniqueModel, 'lookup_id', fail)
+        obj = UniqueModel(self.namespace, string=existing.string)
+
+        with pytest.raises(ValueError, match='Field "string" should be unique'):
+            Model.save_many([UniqueModel(self.namespace, string=str(uuid.uuid4())), obj])
+
+    def test_duplicate_values_in_batch(self):
+        value = str(uuid.uuid4())
+        objs = [UniqueModel(self.namespace, string=value) for _ in range(2)]
+
+        with pytest.raises(ValueError, match='Field "string" should be unique'):
+            Model.save_many(objs)
+
+        assert UniqueModel.list(self.namespace) == {}
+
+    def test_duplicate_object(self):
+        obj = UniqueModel(self.namespace, string=str(uuid.uuid4()))
+
+        with pytest.raises(BackendError, match='saved more than once'):
+            Model.save_many([obj, obj])
+
+    def test_changed_values(self):
+        objs = [SortedModel(self.namespace, string=string) for string in ['a', 'b']]
+        unique = UniqueModel(self.namespace, string=str(uuid.uuid4()))
+        Model.save_many(objs + [unique])
+
+        old_value = unique.string
+        unique.string = str(uuid.uuid4())
+        objs[0].string = 'c'
+        Model.save_many(objs + [unique])
+
+        objects, total = SortedModel.list_page(self.namespace, 'string')
+        assert total == 2
+        assert [obj.string for obj in objects] == ['b', 'c']
+        assert UniqueModel.lookup_id(self.namespace, 'string', old_value) is None
+        assert UniqueModel.lookup_id(self.namespace, 'string', unique.string) == unique.id
+
+    def test_conflict_saved_one_by_one(self):
+        obj = UniqueModel(self.namespace, string=str(uuid.uuid4()))
+        obj.save()
+
+        other = UniqueModel.load(self.namespace, obj.id)
+        other.secret = 'other'
+        other.save()
+
+        obj.secret = 'changed'
+        new = UniqueModel(self.namespace, string=str(uuid.uuid4()))
+        Model.save_many([obj, new])
+
+        assert UniqueModel.load(self.namespace, obj.id).secret == 'changed'
+        assert UniqueModel.exists(self.namespace, new.id)
+
+
 class TestGetDict:
     """Verify objects are serialized properly"""
 
@@ -422,6 +1296,32 @@ class TestNamespaces:
 datetime_sample = datetime.datetime(2007, 12, 6, 16, 29, 43)
 
 
+class TestFieldCopy:
+    def test_parameters_copied(self):
+        field = StringField(required=True, unique=True, encrypted=True, cold=False, default='a')
+        field.value = 'changed'
+
+        copied = field.copy()
+
+        assert (copied.required, copied.unique, copied.encrypted, copied.default) == (True, True, True, 'a')
+        assert copied.value is None
+        assert not hasattr(copied, '__dict__')
+
+    def test_relation(self):
+        field = RelationField(remote_class_name='Cluster')
+
+        assert field.copy().remote_class_name == 'Cluster'
+
+    def test_model_fields_not_shared(self):
+        model = create_model()
+        first = model(namespace, **model_kwargs)
+        second = model(namespace)
+
+        assert first._string is not second._string
+        assert first._string is not model._fields['string']
+        assert second.string is None
+
+
 class TestDateTimeField:
     def setup(self):
         self.datetime = datetime_sample
@@ -530,6 +1430,275 @@ class TestFieldEncryption:
         assert '"{}"'.format(field.serialize()) not in serialized
 
 
+class TestFieldCompression:
+    @pytest.fixture(autouse=True)
+    def threshold(self, monkeypatch):
+        monkeypatch.setattr(current_app.db, 'compression_threshold', 64)
+        self.large = {'items': ['value {}'.format(i % 10) for i in range(100)]}
+
+    @pytest.mark.parametrize('encrypted', [False, True])
+    def test_round_trip(self, encrypted):
+        model = create_model(encrypted=encrypted)
+        obj = model(namespace, **dict(model_kwargs, json=self.large))
+        obj.save()
+
+        stored = json.loads(current_app.db.get(obj.get_db_key()).value)
+        assert stored['json']['codec'] == 'zlib'
+        assert len(stored['json']['data']) < len(json.dumps(self.large))
+        assert not isinstance(stored['string'], dict)
+
+        loaded = model.load(namespace, obj.id)
+        assert loaded.json == self.large
+        assert loaded.string == model_kwargs['string']
+
+    def test_compressed_before_encryption(self):
+        model = create_model(encrypted=True)
+        obj = model(namespace, **dict(model_kwargs, json=self.large))
+
+        envelope = obj._json.encrypt()
+        assert envelope['encrypted']
+        assert 'items' not in envelope['data']
+
+        data = obj._json._decrypt_string(envelope['data'])
+        assert zlib.decompress(base64.b64decode(data)).decode('utf-8') == obj._json.serialize()
+
+    def test_incompressible_value_not_compressed(self):
+        field = StringField(value=base64.b64encode(os.urandom(256)).decode('ascii'))
+
+        assert field.encrypt() == field.value
+
+    def test_read_without_compression(self, monkeypatch):
+        model = create_model()
+        obj = model(namespace, **dict(model_kwargs, json=self.large))
+        obj.save()
+
+        monkeypatch.setattr(current_app.db, 'compression_threshold', 0)
+        assert model.load(namespace, obj.id).json == self.large
+
+    def test_unknown_version(self):
+        field = StringField()
+
+        with pytest.raises(FieldError, match='Unsupported compressed value'):
+            field.decrypt({'v': 2, 'codec': 'zstd', 'data': ''})
+
+
+class ColdModel(Model, metaclass=ModelMeta):
+    id = IdField()
+    string = StringField()
+    secret = JSONField(encrypted=True, cold=True)
+    metadata = JSONField(cold=True)
+
+
+class TestColdFields:
+    def setup(self):
+        self.namespace = str(uuid.uuid4())
+        self.secret = {'token': str(uuid.uuid4())}
+        self.metadata = {'items': list(range(10))}
+
+    def create(self, **kwargs):
+        obj = ColdModel(self.namespace, string='abc', secret=self.secret, metadata=self.metadata, **kwargs)
+        obj.save()
+        return obj
+
+    def cold_key(self, obj, field_name):
+        return '{}{}'.format(ColdModel.get_cold_prefix(self.namespace, field_name), obj.id)
+
+    def test_stored_separately(self):
+        obj = self.create()
+
+        stored = json.loads(current_app.db.get(obj.get_db_key()).value)
+        assert set(stored) == {'id', 'string'}
+        assert self.secret['token'] not in current_app.db.get(self.cold_key(obj, 'secret')).value
+
+        loaded = ColdModel.load(self.namespace, obj.id)
+        assert loaded.secret == self.secret
+        assert loaded.metadata == self.metadata
+
+    def test_stored_outside_object_directory(self):
+        obj = self.create()
+        db_prefix = ColdModel.get_db_prefix(self.namespace)
+
+        # backends listing key ranges would read nested cold values with objects
+        for field_name in ColdModel._cold_fields:
+            assert not self.cold_key(obj, field_name).startswith(db_prefix)
+
+    def test_loaded_on_demand(self, monkeypatch):
+        obj = self.create()
+        loaded = ColdModel.load(self.namespace, obj.id)
+        reads = []
+        get = current_app.db.get
+
+        def counted(key, *args, **kwargs):
+            reads.append(key)
+            return get(key, *args, **kwargs)
+
+        monkeypatch.setattr(current_app.db, 'get', counted)
+
+        assert loaded.string == 'abc'
+        assert reads == []
+        assert loaded.metadata == self.metadata
+        assert reads == [self.cold_key(obj, 'metadata')]
+
+    def test_list_reads_field_once(self, monkeypatch):
+        objs = [self.create() for _ in range(3)]
+        reads = []
+        list_prefix = current_app.db.list_prefix
+
+        def counted(prefix, *args, **kwargs):
+            reads.append(prefix)
+            return list_prefix(prefix, *args, **kwargs)
+
+        monkeypatch.setattr(current_app.db, 'list_prefix', counted)
+        listed = ColdModel.list(self.namespace)
+
+        assert sorted(listed) == sorted(str(obj.id) for obj in objs)
+        assert all(obj.metadata == self.metadata for obj in listed.values())
+        assert reads == [ColdModel.get_db_prefix(self.namespace), ColdModel.get_cold_prefix(self.namespace, 'metadata')]
+
+    def test_unchanged_not_written(self):
+        obj = self.create()
+        metadata_index = current_app.db.get(self.cold_key(obj, 'metadata')).modified_index
+
+        loaded = ColdModel.load(self.namespace, obj.id)
+        assert loaded.metadata == self.metadata
+        loaded.string = 'changed'
+        loaded.secret = {'token': 'changed'}
+        loaded.save()
+
+        assert current_app.db.get(self.cold_key(obj, 'metadata')).modified_index == metadata_index
+        reloaded = ColdModel.load(self.namespace, obj.id)
+        assert reloaded.secret == {'token': 'changed'}
+        assert reloaded.metadata == self.metadata
+
+    def test_empty_values_not_written(self):
+        obj = ColdModel(self.namespace, string='abc')
+        obj.save()
+
+        with pytest.raises(KeyNotFound):
+            current_app.db.get(self.cold_key(obj, 'metadata'))
+        assert ColdModel.load(self.namespace, obj.id).metadata is None
+
+    def test_cleared_value(self):
+        obj = self.create()
+        obj.metadata = {}
+        obj.save()
+
+        assert ColdModel.load(self.namespace, obj.id).metadata == {}
+
+    def test_stored_with_object_moved(self):
+        obj = ColdModel(self.namespace, string='abc')
+        obj.save()
+        legacy = json.loads(obj.serialize())
+        legacy['metadata'] = json.dumps(self.metadata)
+        current_app.db.put(obj.get_db_key(), json.dumps(legacy))
+
+        loaded = ColdModel.load(self.namespace, obj.id)
+        assert loaded.metadata == self.metadata
+        ColdModel.load(self.namespace, obj.id).save()
+
+        assert 'metadata' not in json.loads(current_app.db.get(obj.get_db_key()).value)
+        assert ColdModel.load(self.namespace, obj.id).metadata == self.metadata
+
+    def test_save_many(self):
+        objs = [ColdModel(self.namespace, metadata={'i': i}) for i in range(3)]
+        Model.save_many(objs)
+
+        assert [ColdModel.load(self.namespace, obj.id).metadata for obj in objs] == [{'i': i} for i in range(3)]
+
+    def test_delete(self):
+        obj = self.create()
+        obj.delete()
+
+        with pytest.raises(KeyNotFound):
+            current_app.db.get(self.cold_key(obj, 'secret'))
+        assert ColdModel.list(self.namespace) == {}
+
+    @pytest.mark.parametrize('options', [{'unique': True}, {'remote_class_name': 'ColdModel'}])
+    def test_invalid_cold_field(self, options):
+        field_class = RelationField if 'remote_class_name' in options else StringField
+
+        with pytest.raises(FieldError, match='can\'t be cold'):
+            ModelMeta('InvalidModel', (Model,), {'field': field_class(cold=True, **options)})
+
+    def test_sort_index_on_cold_field(self):
+        with pytest.raises(FieldError, match='sort index'):
+            ModelMeta('InvalidModel', (Model,), {
+                'field': StringField(cold=True),
+                'sort_indexes': {'field': ('field',)},
+            })
+
+
+class TestChangedFields:
+    def setup(self):
+        self.namespace = str(uuid.uuid4())
+        self.writes = []
+
+    def create(self):
+        obj = ColdModel(self.namespace, string='abc', secret={'token': 'a'}, metadata={'items': [1]})
+        obj.save()
+        return obj
+
+    def count_writes(self, monkeypatch):
+        for method in ['put', 'cas', 'transaction']:
+            original = getattr(current_app.db, method)
+
+            def counted(*args, original=original, **kwargs):
+                self.writes.append(args[0])
+                return original(*args, **kwargs)
+
+            monkeypatch.setattr(current_app.db, method, counted)
+
+    def test_new_object(self):
+        obj = ColdModel(self.namespace, string='abc')
+
+        assert set(obj.changed_fields()) == set(ColdModel.get_field_names())
+
+    def test_saved_object_unchanged(self):
+        assert self.create().changed_fields() == []
+
+    def test_unchanged_not_written(self, monkeypatch):
+        obj = self.create()
+        loaded = ColdModel.load(self.namespace, obj.id)
+        loaded.string = 'abc'
+        loaded.metadata['items'] = [1]
+        self.count_writes(monkeypatch)
+
+        assert loaded.changed_fields() == []
+        assert loaded.save()
+        assert self.writes == []
+
+    def test_changed_in_place(self):
+        loaded = ColdModel.load(self.namespace, self.create().id)
+        loaded.metadata['items'].append(2)
+
+        assert loaded.changed_fields() == ['metadata']
+
+    def test_only_cold_field_written(self, monkeypatch):
+        obj = self.create()
+        loaded = ColdModel.load(self.namespace, obj.id)
+        loaded.metadata['items'].append(2)
+        modified_index = current_app.db.get(obj.get_db_key()).modified_index
+        self.count_writes(monkeypatch)
+
+        loaded.save()
+
+        assert self.writes == ['{}{}'.format(ColdModel.get_cold_prefix(self.namespace, 'metadata'), obj.id)]
+        assert current_app.db.get(obj.get_db_key()).modified_index == modified_index
+        assert ColdModel.load(self.namespace, obj.id).metadata == {'items': [1, 2]}
+        assert loaded.changed_fields() == []
+
+    def test_save_many_skips_unchanged(self, monkeypatch):
+        obj = self.create()
+        loaded = ColdModel.load(self.namespace, obj.id)
+        new = ColdModel(self.namespace, string='new')
+        self.count_writes(monkeypatch)
+
+        Model.save_many([loaded, new])
+
+        assert obj.get_db_key() not in self.writes
+        assert ColdModel.load(self.namespace, new.id).string == 'new'
+
+
 class TestModelEncryptionWithNone:
     def test_serialization(self, monkeypatch, get_object):
         def fake(self, class_name):
@@ -0,0 +1,89 @@
+from .etcd import EtcdReplica
+from .test_model_fields import create_model
+from .test_model_fields import model_kwargs
+from .test_model_fields import namespace
+from flask import current_app
+
+import pytest
+import time
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+class TestEtcdReplica:
+    @pytest.fixture(autouse=True)
+    def replica(self, monkeypatch):
+        self.replica = EtcdReplica(current_app.db.client, current_app.db.prefix, max_staleness=2)
+        monkeypatch.setattr(current_app.db, 'replica', self.replica)
+        self.model = create_model()
+
+        yield self.replica
+        self.replica.stop()
+
+    def test_initial_sync(self):
+        obj = self.model(namespace, **model_kwargs)
+        obj.save()
+
+        self.replica.start()
+
+        assert self.replica.get(obj.get_db_key()).value == obj.serialize()
+
+    def test_watch_applies_changes(self):
+        self.replica.start()
+        key = '{}{}/{}/watched'.format(current_app.db.prefix, namespace, self.model.get_model_name())
+
+        current_app.db.client.write(key, 'value')
+        assert wait_for(lambda: self.replica.get(key) is not None)
+
+        current_app.db.client.delete(key)
+        assert wait_for(lambda: self.replica.get(key) is None)
+
+    def test_reads_served_from_replica(self, monkeypatch):
+        obj = self.model(namespace, **model_kwargs)
+        obj.save()
+        self.replica.start()
+
+        def fail(*args, **kwargs):
+            raise AssertionError('etcd should not be read')
+
+        monkeypatch.setattr(current_app.db.client, 'read', fail)
+        monkeypatch.setattr(current_app.db.client, 'get', fail)
+
+        assert self.model.load(namespace, obj.id).string == obj.string
+        assert str(obj.id) in self.model.list(namespace)
+
+    def test_local_writes_are_visible(self):
+        self.replica.start()
+        obj = self.model(namespace, **model_kwargs)
+        obj.save()
+
+        assert self.model.load(namespace, obj.id).string == obj.string
+
+        obj.delete()
+        with pytest.raises(NameError):
+            self.model.load(namespace, obj.id)
+
+    def test_old_changes_are_ignored(self):
+        self.replica.apply('set', '/a/b', 'new', 10)
+        self.replica.apply('set', '/a/b', 'old', 5)
+
+        assert self.replica.get('/a/b').value == 'new'
+
+        self.replica.apply('delete', '/a/b', None, 11)
+        self.replica.apply('set', '/a/b', 'new', 10)
+
+        assert self.replica.get('/a/b') is None
+
+    def test_stale_replica_is_not_used(self, monkeypatch):
+        self.replica.start()
+        self.replica.stop()
+        monkeypatch.setattr(self.replica, '_synced_at', time.monotonic() - 10)
+
+        assert current_app.db.get_replica() is None
@@ -1,4 +1,15 @@
 from kqueen.auth import authenticate
+from kqueen.auth import authorize_many
+from kqueen.auth import common
+from kqueen.auth import identity
+from kqueen.auth import is_authorized
+from kqueen.auth.common import IdentityCache
+from kqueen.conftest import UserFixture
+from kqueen.models import User
+from uuid import uuid4
+
+import pytest
+import time
 
 
 def test_nonexisting_user():
@@ -13,3 +24,208 @@ def test_nonexisting_user():
     result = authenticate(username, password)
 
     assert result is None
+
+
+def test_reads_only_user(monkeypatch):
+    """
+    Try authenticate existing user
+    Only the user is loaded, other users are not listed
+    """
+    user = UserFixture()
+    monkeypatch.setattr(User, 'list', None)
+
+    try:
+        result = authenticate(user.obj.username, user.obj.username + 'password')
+        assert result.id == user.obj.id
+        assert authenticate(user.obj.username, 'wrong password') is None
+    finally:
+        user.destroy()
+
+
+class TestIdentityCache:
+    @pytest.fixture(autouse=True)
+    def prepare(self, monkeypatch):
+        self.user = UserFixture()
+        self.payload = {'identity': self.user.obj.id}
+        monkeypatch.setattr(common, 'identity_cache', IdentityCache(max_size=10, ttl=60))
+        yield
+        self.user.destroy()
+
+    def count_loads(self, monkeypatch):
+        loads = []
+        original = User.load.__func__
+
+        def counting_load(cls, *args, **kwargs):
+            loads.append(args)
+            return original(cls, *args, **kwargs)
+
+        monkeypatch.setattr(User, 'load', classmethod(counting_load))
+        return loads
+
+    def test_cached(self, monkeypatch):
+        loads = self.count_loads(monkeypatch)
+
+        assert identity(self.payload).id == self.user.obj.id
+        assert identity(self.payload).id == self.user.obj.id
+        assert len(loads) == 1
+
+    def test_cached_fully_loaded(self):
+        user = identity(self.payload)
+
+        for obj in [user, user.organization]:
+            assert not [name for name, hidden, _ in obj._field_specs if getattr(obj, hidden).deferred]
+
+    def test_missing_user_not_cached(self):
+        assert identity({'identity': 'missing'}) is None
+        assert len(common.identity_cache) == 0
+
+    def test_invalidated_on_user_save(self):
+        identity(self.payload)
+        user = User.load(None, self.user.obj.id)
+        user.role = 'member'
+        user.save()
+
+        assert identity(self.payload).role == 'member'
+
+    def test_invalidated_on_save_many(self):
+        identity(self.payload)
+        user = User.load(None, self.user.obj.id)
+        user.role = 'member'
+        User.save_many([user])
+
+        assert identity(self.payload).role == 'member'
+
+    def test_invalidated_on_organization_save(self):
+        identity(self.payload)
+        organization = self.user.test_org.obj
+        organization.name = 'renamed'
+        organization.save()
+
+        assert identity(self.payload).organization.name == 'renamed'
+
+    def test_invalidated_on_user_delete(self):
+        identity(self.payload)
+        self.user.obj.delete()
+
+        assert identity(self.payload) is None
+
+    def test_expired(self, monkeypatch):
+        identity(self.payload)
+        now = time.monotonic()
+        monkeypatch.setattr(time, 'monotonic', lambda: now + 61)
+
+        assert common.identity_cache.get(self.user.obj.id) is None
+
+    def test_size_limit(self):
+        cache = IdentityCache(max_size=1, ttl=60)
+        other = UserFixture()
+        try:
+            cache.set(self.user.obj)
+            cache.set(other.obj)
+
+            assert cache.get(self.user.obj.id) is None
+            assert cache.get(other.obj.id) is other.obj
+        finally:
+            other.destroy()
+
+
+class TestPolicies:
+    @pytest.fixture(autouse=True)
+    def prepare(self):
+        self.owner = UserFixture()
+        self.other = UserFixture()
+        self.organization = self.owner.obj.organization
+        self.resources = [self.owner.obj, self.other.obj]
+
+        yield
+
+        self.owner.destroy()
+        self.other.destroy()
+
+    def user(self, role, user_id=None, organization=None):
+        return {
+            'id': user_id or uuid4(),
+            'username': 'user',
+            'organization': organization or self.organization,
+            'role': role,
+        }
+
+    @pytest.mark.parametrize('role, policy, owner_result, member_result', [
+        ('member', 'ALL', True, True),
+        ('member', 'IS_ADMIN', False, False),
+        ('admin', 'IS_ADMIN', True, True),
+        ('member', 'IS_OWNER', True, False),
+        ('admin', 'IS_OWNER', True, False),
+        ('member', 'ADMIN_OR_OWNER', True, False),
+        ('admin', 'ADMIN_OR_OWNER', True, True),
+        ('admin', 'IS_SUPERADMIN', False, False),
+        ('superadmin', 'IS_SUPERADMIN', True, True),
+        ('member', 'UNKNOWN', False, False),
+    ])
+    def test_same_organization(self, role, policy, owner_result, member_result):
+        owner = self.user(role, user_id=self.owner.obj.id)
+        member = self.user(role)
+
+        assert is_authorized(owner, policy, resource=self.owner.obj) is owner_result
+        assert is_authorized(member, policy, resource=self.owner.obj) is member_result
+
+    @pytest.mark.parametrize('policy', ['ALL', 'IS_ADMIN', 'IS_OWNER', 'ADMIN_OR_OWNER'])
+    def test_other_organization(self, policy):
+        user = self.user('admin', user_id=self.owner.obj.id, organization=self.other.obj.organization)
+
+        assert not is_authorized(user, policy, resource=self.owner.obj)
+
+    def test_organization_resource(self):
+        user = self.user('member')
+
+        assert is_authorized(user, 'ALL', resource=self.organization)
+        assert not is_authorized(user, 'IS_OWNER', resource=self.organization)
+
+    def test_without_resource(self):
+        assert not is_authorized(self.user('admin'), 'ALL')
+        assert is_authorized(self.user('superadmin'), 'ALL')
+
+    def test_validated(self, monkeypatch):
+        user = self.user('member')
+        monkeypatch.setattr(User, 'validate', lambda obj, *args, **kwargs: (False, 'invalid'))
+
+        # policy is not evaluated for invalid resources
+        assert is_authorized(user, 'IS_OWNER', resource=self.owner.obj)
+        assert not is_authorized(user, 'IS_OWNER', resource=self.owner.obj, validate=False)
+
+    def test_not_validated(self, monkeypatch):
+        def validate(obj, *args, **kwargs):
+            raise AssertionError('Resource validated')
+
+        monkeypatch.setattr(User, 'validate', validate)
+        user = self.user('member', user_id=self.owner.obj.id)
+
+        assert authorize_many(user, 'IS_OWNER', self.resources, validate=False) == [self.owner.obj]
+
+    @pytest.mark.parametrize('role, policy', [
+        ('member', 'ALL'),
+        ('member', 'IS_OWNER'),
+        ('admin', 'ADMIN_OR_OWNER'),
+        ('superadmin', 'IS_OWNER'),
+        ('member', 'UNKNOWN'),
+    ])
+    def test_authorize_many(self, role, policy):
+        user = self.user(role, user_id=self.owner.obj.id)
+        expected = [r for r in self.resources if is_authorized(user, policy, resource=r)]
+
+        assert authorize_many(user, policy, self.resources) == expected
+
+    def test_authorize_many_reads_user_once(self, monkeypatch):
+        calls = []
+        get_dict = User.get_dict
+
+        def counting(obj, *args, **kwargs):
+            calls.append(obj.id)
+            return get_dict(obj, *args, **kwargs)
+
+        monkeypatch.setattr(User, 'get_dict', counting)
+        result = authorize_many(self.owner.obj, 'ALL', self.resources)
+
+        # superadmin is authorized to objects of other organizations too
+        assert result == self.resources
+        assert calls == [self.owner.obj.id]
@@ -1,15 +1,23 @@
 from datetime import datetime
 from datetime import timedelta
+from flask import current_app
 from kqueen.config import current_config
+from kqueen.conftest import UserFixture
 from kqueen.engines import __all__ as all_engines
 from kqueen.engines import ManualEngine
 from kqueen.models import Cluster
+from kqueen.models import Organization
 from kqueen.models import Provisioner
+from kqueen.models import User
+from kqueen.server import storage_app
+from kqueen.server import storage_context
 from kqueen.storages.etcd import Field
 from kqueen.storages.etcd import Model
 
+import kqueen.server
 import pytest
 import subprocess
+import threading
 import yaml
 
 config = current_config()
@@ -234,3 +242,104 @@ class TestClusterState:
         print(self.cluster.update_state())
 
         assert cluster_state == config.get('CLUSTER_ERROR_STATE')
+
+    def test_repeated_status_not_written(self, monkeypatch):
+        def fake_cluster_get(self):
+            return {'state': config.get('CLUSTER_OK_STATE'), 'metadata': {'status_message': 'Running'}}
+
+        monkeypatch.setattr(ManualEngine, 'cluster_get', fake_cluster_get)
+        self.cluster.update_state()
+
+        writes = []
+        for method in ['put', 'cas']:
+            monkeypatch.setattr(current_app.db, method, lambda *args, **kwargs: writes.append(args))
+        Cluster.load(self.cluster._object_namespace, self.cluster.id).update_state()
+
+        assert writes == []
+
+
+class TestStorageContext:
+    @pytest.fixture(autouse=True)
+    def fresh_storage_app(self):
+        # storage application is created from current configuration by the test
+        kqueen.server._storage_app = None
+        yield
+        kqueen.server._storage_app = None
+
+    def test_current_context_used(self):
+        with storage_context() as app:
+            assert app is current_app._get_current_object()
+
+    def test_storage_app_shared(self):
+        assert storage_app() is storage_app()
+        assert not hasattr(storage_app(), 'executor')
+
+    def test_missing_cache_shared(self):
+        organization = Organization(None, name='shared', namespace='shared')
+        organization.verify_id()
+        with pytest.raises(NameError):
+            Organization.load(None, organization.id)
+
+        assert storage_app().db.missing is current_app.db.missing
+
+        def save():
+            # thread has no application context, backend of storage application is used
+            with storage_context():
+                organization.save(validate=False)
+
+        thread = threading.Thread(target=save)
+        thread.start()
+        thread.join()
+
+        try:
+            assert Organization.load(None, organization.id).name == 'shared'
+        finally:
+            organization.delete()
+
+    def test_save_outside_app_context(self, cluster, monkeypatch):
+        def fail(*args, **kwargs):
+            raise AssertionError('Application should not be created')
+
+        monkeypatch.setattr(kqueen.server, 'create_app', fail)
+        storage_app()
+        cluster.state = 'Saved from thread'
+        errors = []
+
+        def save():
+            try:
+                cluster.save()
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=save)
+        thread.start()
+        thread.join()
+
+        assert errors == []
+        assert Cluster.load(cluster._object_namespace, cluster.id).state == 'Saved from thread'
+
+
+class TestOrganizationUsers:
+    @pytest.fixture(autouse=True)
+    def prepare(self):
+        self.user = UserFixture()
+        self.other = UserFixture()
+        yield
+        self.user.destroy()
+        self.other.destroy()
+
+    def test_users_listed_by_organization(self):
+        organization = self.user.test_org.obj
+
+        users = User.list_group(None, 'organization', organization)
+
+        assert list(users) == [self.user.obj.id]
+
+    def test_is_deletable(self):
+        deletable, remaining = self.user.test_org.obj.is_deletable()
+
+        assert not deletable
+        assert remaining == [{'object': 'User', 'name': self.user.obj.username, 'uuid': self.user.obj.id}]
+
+        self.user.obj.delete()
+        assert self.user.test_org.obj.is_deletable() == (True, [])
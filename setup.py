@@ -79,6 +79,7 @@ setup(
     entry_points={
         'console_scripts': [
             'kqueen = kqueen.server:run',
+            'kqueen-reencrypt = kqueen.storages.reencrypt:main',
         ],
     },
 )